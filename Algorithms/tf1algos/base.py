@@ -14,7 +14,7 @@ class Base(object):
         self.graph = tf.Graph()
         gpu_options = tf.GPUOptions(allow_growth=True)
         self.sess = tf.Session(config=tf.ConfigProto(gpu_options=gpu_options), graph=self.graph)
-        self.cp_dir, self.log_dir, self.excel_dir = [os.path.join(base_dir, i) for i in ['model', 'log', 'excel']]
+        self.cp_dir, self.log_dir, self.metrics_dir = [os.path.join(base_dir, i) for i in ['model', 'log', 'metrics']]
         self.action_type = action_type
         self.a_counts = int(np.array(a_dim_or_list).prod())
         self.assign_init = None
@@ -46,10 +46,10 @@ class Base(object):
 
         self.check_or_create(self.cp_dir, 'checkpoints')
         self.check_or_create(self.log_dir, 'logs(summaries)')
-        self.check_or_create(self.excel_dir, 'excel')
+        self.check_or_create(self.metrics_dir, 'metrics')
         self.recorder = Recorder(
             log_dir=self.log_dir,
-            excel_dir=self.excel_dir,
+            metrics_dir=self.metrics_dir,
             logger2file=logger2file,
             graph=graph
         )
@@ -87,6 +87,7 @@ class Base(object):
             x=global_step,
             ys=[{'tag': 'MAIN/' + key, 'value': kargs[key]} for key in kargs]
         )
+        self.recorder.metrics.add(episode=global_step, **kargs)
 
     def _process_graph(self):
         """
@@ -128,6 +129,7 @@ class Base(object):
         """
         end training, and export the training model
         """
+        self.recorder.close()
         self.export_model()
 
     def get_global_step(self):
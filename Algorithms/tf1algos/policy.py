@@ -111,6 +111,13 @@ class Policy(Base):
         if self.policy_mode == 'OFF':
             self.data.add(s, visual_s, a, r[:, np.newaxis], s_, visual_s_, done[:, np.newaxis])
 
+    def truncate(self, index=None):
+        """
+        tell the n-step ReplayBuffer that episodes of the specified agents are cut off without done, e.g. by max_step.
+        """
+        if self.policy_mode == 'OFF':
+            self.data.truncate(index)
+
     def clear(self):
         """
         clear the DataFrame.
@@ -44,7 +44,7 @@ class A2C(Policy):
         self.beta = beta
         self.epsilon = epsilon
         self.epoch = epoch
-        self.TensorSpecs = self.get_TensorSpecs([self.s_dim], self.visual_dim, [self.a_counts], [1])
+        self.TensorSpecs = self.get_TensorSpecs([self.s_dim], self.visual_dim, [self.a_store_dim], [1], visual_index=1)
         if self.action_type == 'continuous':
             self.actor_net = Nn.actor_mu(self.s_dim, self.visual_dim, self.a_counts, 'actor_net', hidden_units['actor_continuous'])
         else:
@@ -72,15 +72,10 @@ class A2C(Policy):
         ''')
 
     def choose_action(self, s, visual_s):
-        if self.action_type == 'continuous':
-            return self._get_action(s, visual_s).numpy()
-        else:
-            a = self._get_action(s, visual_s).numpy()
-            return sth.int2action_index(a, self.a_dim_or_list)
+        return self.call_action(self._get_action, s, visual_s)
 
     def choose_inference_action(self, s, visual_s):
-        a = self._get_action(s, visual_s).numpy()
-        return a if self.action_type == 'continuous' else sth.int2action_index(a, self.a_dim_or_list)
+        return self.call_action(self._get_action, s, visual_s)
 
     @tf.function
     def _get_action(self, vector_input, visual_input):
@@ -91,47 +86,39 @@ class A2C(Policy):
             else:
                 logits = self.actor_net(vector_input, visual_input)
                 norm_dist = tfp.distributions.Categorical(logits)
-                sample_op = norm_dist.sample()
+                sample_op = self.action_index_decode(norm_dist.sample())
         return sample_op
 
     def store_data(self, s, visual_s, a, r, s_, visual_s_, done):
         self.on_store(s, visual_s, a, r, s_, visual_s_, done)
 
     def calculate_statistics(self):
-        s, visual_s = self.data.s_.values[-1], self.data.visual_s_.values[-1]
-        init_value = np.squeeze(self.critic_net(s, visual_s))
-        self.data['discounted_reward'] = sth.discounted_sum(self.data.r.values, self.gamma, init_value, self.data.done.values)
-
-    def get_sample_data(self, index):
-        i_data = self.data.iloc[index:index+self.batch_size]
-        s = np.vstack(i_data.s.values)
-        visual_s = np.vstack(i_data.visual_s.values)
-        a = np.vstack(i_data.a.values)
-        dc_r = np.vstack(i_data.discounted_reward.values).reshape(-1, 1)
-        return s, visual_s, a, dc_r
+        init_value = np.squeeze(self.critic_net(self.s_, self.visual_s_), axis=-1)
+        self.data['discounted_reward'] = sth.discounted_returns(self.data['r'], self.gamma, init_value, self.data['done'])
 
     def learn(self, **kwargs):
-        assert self.batch_size <= self.data.shape[0], "batch_size must less than the length of an episode"
+        assert self.batch_size <= len(self.data), "batch_size must less than the length of an episode"
         self.episode = kwargs['episode']
         self.calculate_statistics()
         for _ in range(self.epoch):
-            for index in range(0, self.data.shape[0], self.batch_size):
-                s, visual_s, a, dc_r = [tf.convert_to_tensor(i) for i in self.get_sample_data(index)]
+            for data in self.data.sample_generator(self.batch_size, ['s', 'visual_s', 'a', 'discounted_reward']):
+                s, visual_s, a, dc_r = [tf.convert_to_tensor(i) for i in data]
                 actor_loss, critic_loss, entropy = self.train.get_concrete_function(
                         *self.TensorSpecs)(s, visual_s, a, dc_r)
         self.global_step.assign_add(1)
-        tf.summary.experimental.set_step(self.episode)
-        tf.summary.scalar('LOSS/entropy', entropy)
-        tf.summary.scalar('LOSS/actor_loss', actor_loss)
-        tf.summary.scalar('LOSS/critic_loss', critic_loss)
-        tf.summary.scalar('LEARNING_RATE/actor_lr', self.actor_lr(self.episode))
-        tf.summary.scalar('LEARNING_RATE/actor_lr', self.critic_lr(self.episode))
-        self.recorder.writer.flush()
+        self.recorder.add_scalars(self.episode, {
+            'LOSS/entropy': entropy,
+            'LOSS/actor_loss': actor_loss,
+            'LOSS/critic_loss': critic_loss,
+            'LEARNING_RATE/actor_lr': self.actor_lr(self.episode),
+            'LEARNING_RATE/critic_lr': self.critic_lr(self.episode)
+        })
         self.clear()
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, s, visual_s, a, dc_r):
         with tf.device(self.device):
+            a = self.action_one_hot(a)
             with tf.GradientTape() as tape:
                 v = self.critic_net(s, visual_s)
                 td_error = dc_r - v
@@ -162,6 +149,7 @@ class A2C(Policy):
     @tf.function(experimental_relax_shapes=True)
     def train_persistent(self, s, visual_s, a, dc_r):
         with tf.device(self.device):
+            a = self.action_one_hot(a)
             with tf.GradientTape(persistent=True) as tape:
                 if self.action_type == 'continuous':
                     mu = self.actor_net(s, visual_s)
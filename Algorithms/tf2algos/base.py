@@ -5,6 +5,42 @@ import tensorflow as tf
 from utils.recorder import RecorderTf2 as Recorder
 
 
+class TargetSync(object):
+    '''
+    sync the weights of target networks with their source networks in one graph call, create it once per pair.
+        ployak=None: copy the weights, t = s
+        otherwise: t = ployak * t + (1 - ployak) * s
+    with interval=N the sync only happens every N-th call, a Polyak blend then uses ployak**N,
+    so the target moves roughly as much as it would with N per-call updates.
+    '''
+
+    def __init__(self, tge, src, ployak=None, interval=1):
+        assert len(tge) == len(src), 'target and source networks must have the same number of variables'
+        assert type(interval) == int and interval > 0, 'interval must be int and larger than 0'
+        self.tge = list(tge)
+        self.src = list(src)
+        self.tau = None if ployak is None else ployak ** interval
+        self.interval = interval
+        self.calls = tf.Variable(0, name='target_sync_calls', trainable=False, dtype=tf.int64)
+
+    @tf.function
+    def __call__(self):
+        if self.interval == 1:
+            self._sync()
+        else:
+            self.calls.assign_add(1)
+            if self.calls % self.interval == 0:
+                self._sync()
+
+    def _sync(self):
+        if self.tau is None:
+            for t, s in zip(self.tge, self.src):
+                t.assign(s)
+        else:
+            for t, s in zip(self.tge, self.src):
+                t.assign(self.tau * t + (1 - self.tau) * s)
+
+
 class Base(tf.keras.Model):
 
     def __init__(self, a_dim_or_list, action_type, base_dir):
@@ -22,7 +58,7 @@ class Base(tf.keras.Model):
         else:
             self.device = "/cpu:0"
         tf.keras.backend.set_floatx('float32')
-        self.cp_dir, self.log_dir, self.excel_dir = [os.path.join(base_dir, i) for i in ['model', 'log', 'excel']]
+        self.cp_dir, self.log_dir, self.metrics_dir = [os.path.join(base_dir, i) for i in ['model', 'log', 'metrics']]
         self.action_type = action_type
         self.a_counts = int(np.array(a_dim_or_list).prod())
         self.global_step = tf.Variable(0, name="global_step", trainable=False, dtype=tf.int64)  # in TF 2.x must be tf.int64, because function set_step need args to be tf.int64.
@@ -45,11 +81,11 @@ class Base(tf.keras.Model):
 
         self.check_or_create(self.cp_dir, 'checkpoints')
         self.check_or_create(self.log_dir, 'logs(summaries)')
-        self.check_or_create(self.excel_dir, 'excel')
+        self.check_or_create(self.metrics_dir, 'metrics')
         self.recorder = Recorder(
             cp_dir=self.cp_dir,
             log_dir=self.log_dir,
-            excel_dir=self.excel_dir,
+            metrics_dir=self.metrics_dir,
             logger2file=logger2file,
             model=model
         )
@@ -78,12 +114,10 @@ class Base(tf.keras.Model):
 
     def writer_summary(self, global_step, **kargs):
         """
-        record the data used to show in the tensorboard
+        record the data used to show in the tensorboard, and a row of the metrics with the latest losses.
         """
-        tf.summary.experimental.set_step(global_step)
-        for i in [{'tag': 'MAIN/' + key, 'value': kargs[key]} for key in kargs]:
-            tf.summary.scalar(i['tag'], i['value'])
-        self.recorder.writer.flush()
+        self.recorder.write_scalars(global_step, {'MAIN/' + key: kargs[key] for key in kargs})
+        self.recorder.metrics.add(episode=global_step, **kargs, **self.recorder.get_last_scalars())
 
     def check_or_create(self, dicpath, name=''):
         """
@@ -97,7 +131,7 @@ class Base(tf.keras.Model):
         """
         end training, and export the training model
         """
-        pass
+        self.recorder.close()
 
     def get_global_step(self):
         """
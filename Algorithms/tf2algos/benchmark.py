@@ -0,0 +1,83 @@
+'''
+Benchmark of the xla and mixed_precision options of the off-policy tf2 algorithms.
+Every case fills the replay buffer with random transitions, runs one warm-up call of learn so that tracing and
+XLA compilation are not timed, and then reports the mean wall time of one update, i.e. of one step of learn
+including sampling.
+
+    python -m Algorithms.tf2algos.benchmark [--steps 200] [--batch-size 256] [--algorithms dqn,sac,td3] [--visual]
+'''
+import time
+import argparse
+import tempfile
+import numpy as np
+import tensorflow as tf
+from .dqn import DQN
+from .sac import SAC
+from .td3 import TD3
+
+CASES = {
+    'dqn': (DQN, 'discrete', [4], {'hidden_units': [128, 128]}),
+    'sac': (SAC, 'continuous', [2], {}),
+    'td3': (TD3, 'continuous', [2], {}),
+}
+
+
+def build(cls, action_type, a_dim_or_list, kwargs, s_dim, visual_resolution, batch_size, **options):
+    return cls(
+        s_dim=s_dim,
+        visual_sources=1 if visual_resolution else 0,
+        visual_resolution=visual_resolution,
+        a_dim_or_list=a_dim_or_list,
+        action_type=action_type,
+        base_dir=tempfile.mkdtemp() + '/',
+        batch_size=batch_size,
+        buffer_size=batch_size * 4,
+        **kwargs,
+        **options)
+
+
+def fill(model, s_dim, visual_resolution, n):
+    s = np.random.randn(n, s_dim).astype(np.float32)
+    if visual_resolution:
+        visual_s = np.random.randint(0, 256, (n, 1, *visual_resolution), dtype=np.uint8)
+    else:
+        visual_s = np.zeros((n, 0), dtype=np.float32)
+    a = model.random_action(n) if model.action_type == 'discrete' else np.random.uniform(-1, 1, (n, model.a_counts))
+    model.store_data(s=s, visual_s=visual_s, a=a, r=np.random.randn(n), s_=s, visual_s_=visual_s, done=np.zeros(n))
+
+
+def timeit(model, steps):
+    model.learn(episode=0, step=1)
+    start = time.perf_counter()
+    model.learn(episode=0, step=steps)
+    return (time.perf_counter() - start) / steps * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--algorithms', type=str, default=','.join(CASES.keys()))
+    parser.add_argument('--visual', action='store_true', help='84x84x3 visual input instead of the small MLP case')
+    args = parser.parse_args()
+    s_dim, visual_resolution = (8, [84, 84, 3]) if args.visual else (8, [])
+    options = [('baseline', {})]
+    options.append(('xla', {'xla': True}))
+    if args.visual:
+        options += [('mixed_precision', {'mixed_precision': True}), ('xla+mixed_precision', {'xla': True, 'mixed_precision': True})]
+    print(f'tensorflow {tf.__version__}, batch_size {args.batch_size}, {"visual 84x84x3" if args.visual else "vector"} input')
+    print(f'{"algorithm":<10}{"options":<22}{"ms/update":>10}{"speedup":>9}')
+    for name in args.algorithms.split(','):
+        cls, action_type, a_dim_or_list, kwargs = CASES[name]
+        base = None
+        for label, option in options:
+            model = build(cls, action_type, a_dim_or_list, kwargs, s_dim, visual_resolution, args.batch_size, **option)
+            fill(model, s_dim, visual_resolution, args.batch_size * 2)
+            ms = timeit(model, args.steps)
+            model.close()
+            base = base or ms
+            print(f'{name:<10}{label:<22}{ms:>10.2f}{base / ms:>8.2f}x', flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,8 @@
 import numpy as np
 import tensorflow as tf
 import Nn
-from utils.sth import sth
 from .policy import Policy
+from .base import TargetSync
 
 
 class DDDQN(Policy):
@@ -22,6 +22,9 @@ class DDDQN(Policy):
                  buffer_size=10000,
                  use_priority=False,
                  n_step=False,
+                 fused_steps=1,
+                 xla=False,
+                 mixed_precision=False,
                  base_dir=None,
 
                  lr=5.0e-4,
@@ -48,14 +51,18 @@ class DDDQN(Policy):
             batch_size=batch_size,
             buffer_size=buffer_size,
             use_priority=use_priority,
-            n_step=n_step)
+            n_step=n_step,
+            fused_steps=fused_steps,
+            xla=xla,
+            mixed_precision=mixed_precision)
         self.epsilon = epsilon
         self.assign_interval = assign_interval
-        self.dueling_net = Nn.critic_dueling(self.s_dim, self.visual_dim, self.a_counts, 'dueling_net', hidden_units)
-        self.dueling_target_net = Nn.critic_dueling(self.s_dim, self.visual_dim, self.a_counts, 'dueling_target_net', hidden_units)
+        self.dueling_net = Nn.critic_dueling(self.s_dim, self.visual_dim, self.a_counts, 'dueling_net', hidden_units, conv_dtype=self.conv_dtype)
+        self.dueling_target_net = Nn.critic_dueling(self.s_dim, self.visual_dim, self.a_counts, 'dueling_target_net', hidden_units, conv_dtype=self.conv_dtype)
         self.update_target_net_weights(self.dueling_target_net.weights, self.dueling_net.weights)
+        self.target_sync = TargetSync(self.dueling_target_net.weights, self.dueling_net.weights, interval=assign_interval)
         self.lr = tf.keras.optimizers.schedules.PolynomialDecay(lr, self.max_episode, 1e-10, power=1.0)
-        self.optimizer = tf.keras.optimizers.Adam(learning_rate=self.lr(self.episode))
+        self.optimizer = self.init_optimizer(tf.keras.optimizers.Adam(learning_rate=self.lr(self.episode)))
         self.generate_recorder(
             logger2file=logger2file,
             model=self
@@ -77,46 +84,38 @@ class DDDQN(Policy):
 
     def choose_action(self, s, visual_s):
         if np.random.uniform() < self.epsilon:
-            a = np.random.randint(0, self.a_counts, len(s))
-        else:
-            a = self._get_action(s, visual_s).numpy()
-        return sth.int2action_index(a, self.a_dim_or_list)
+            return self.random_action(len(s))
+        return self.call_action(self._get_action, s, visual_s)
 
     def choose_inference_action(self, s, visual_s):
-        return sth.int2action_index(
-            self._get_action(s, visual_s).numpy(),
-            self.a_dim_or_list
-        )
+        return self.call_action(self._get_action, s, visual_s)
 
     @tf.function
     def _get_action(self, vector_input, visual_input):
         with tf.device(self.device):
             _, advs = self.dueling_net(vector_input, visual_input)
-        return tf.argmax(advs, axis=1)
+        return self.action_index_decode(tf.argmax(advs, axis=1))
 
     def store_data(self, s, visual_s, a, r, s_, visual_s_, done):
         self.off_store(s, visual_s, a, r[:, np.newaxis], s_, visual_s_, done[:, np.newaxis])
 
     def learn(self, **kwargs):
         self.episode = kwargs['episode']
-        for i in range(kwargs['step']):
-            if self.data.is_lg_batch_size:
-                s, visual_s, a, r, s_, visual_s_, done = self.data.sample()
-                if self.use_priority:
-                    self.IS_w = self.data.get_IS_w()
-                q_loss, td_error = self.train(s, visual_s, a, r, s_, visual_s_, done)
-                if self.use_priority:
-                    self.data.update(td_error, self.episode)
-                if self.global_step % self.assign_interval == 0:
-                    self.update_target_net_weights(self.dueling_target_net.weights, self.dueling_net.weights)
-                tf.summary.experimental.set_step(self.global_step)
-                tf.summary.scalar('LOSS/loss', q_loss)
-                tf.summary.scalar('LEARNING_RATE/lr', self.lr(self.episode))
-                self.recorder.writer.flush()
+        return self.off_policy_learn(kwargs['step'], self._train_step, summaries={
+            'LEARNING_RATE/lr': self.lr(self.episode)
+        })
+
+    def _train_step(self, s, visual_s, a, r, s_, visual_s_, done):
+        q_loss, td_error = self.train(s, visual_s, a, r, s_, visual_s_, done)
+        self.target_sync()
+        return td_error, {
+            'LOSS/loss': q_loss
+        }
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, s, visual_s, a, r, s_, visual_s_, done):
         with tf.device(self.device):
+            a = self.action_one_hot(a)
             with tf.GradientTape() as tape:
                 v, adv = self.dueling_net(s, visual_s)
                 average_adv = tf.reduce_mean(adv, axis=1, keepdims=True)
@@ -133,7 +132,7 @@ class DDDQN(Policy):
                 q_target = tf.stop_gradient(r + self.gamma * (1 - done) * q_target_next_max)
                 td_error = q_eval - q_target
                 q_loss = tf.reduce_mean(tf.square(td_error) * self.IS_w)
-            grads = tape.gradient(q_loss, self.dueling_net.trainable_variables)
+            grads = self.gradient(tape, self.optimizer, q_loss, self.dueling_net.trainable_variables)
             self.optimizer.apply_gradients(
                 zip(grads, self.dueling_net.trainable_variables)
             )
@@ -64,7 +64,7 @@ class MADPG(Base):
         return self._get_action(s)[-1].numpy()
 
     def get_target_action(self, s):
-        return self._get_action(s)[-1].numpy()
+        return self._get_target_action(s)[-1].numpy()
 
     def choose_inference_action(self, s):
         return self._get_action(s)[0].numpy()
@@ -75,15 +75,21 @@ class MADPG(Base):
             mu = self.actor_net(vector_input, None)
         return mu, tf.clip_by_value(mu + self.action_noise(), -1, 1)
 
+    def _get_target_action(self, vector_input):
+        '''
+        madpg has no target networks, target actions come from the actor itself.
+        '''
+        return self._get_action(vector_input)
+
     def learn(self, episode, ap, al, ss, ss_, aa, aa_, s, r):
         self.episode = episode
         actor_loss, q_loss = self.train(ap, al, ss, ss_, aa, aa_, s, r)
-        tf.summary.experimental.set_step(self.global_step)
-        tf.summary.scalar('LOSS/actor_loss', actor_loss)
-        tf.summary.scalar('LOSS/critic_loss', q_loss)
-        tf.summary.scalar('LEARNING_RATE/actor_lr', self.actor_lr(self.episode))
-        tf.summary.scalar('LEARNING_RATE/critic_lr', self.critic_lr(self.episode))
-        self.recorder.writer.flush()
+        self.recorder.add_scalars(self.global_step, {
+            'LOSS/actor_loss': actor_loss,
+            'LOSS/critic_loss': q_loss,
+            'LEARNING_RATE/actor_lr': self.actor_lr(self.episode),
+            'LEARNING_RATE/critic_lr': self.critic_lr(self.episode)
+        })
 
     def get_max_episode(self):
         """
@@ -0,0 +1,50 @@
+import tensorflow as tf
+
+
+class MultiAgentLearner(object):
+    '''
+    Joint update step for ma_dpg, ma_ddpg and ma_td3.
+    Target actions of all agents, the joint Q targets and the critic/actor updates of every agent run in one tf.function,
+    so one update crosses the Python<->TF boundary once instead of 2N times plus N learn calls.
+    Other agents' actions in the actor update of agent i are their current deterministic actions mu_j(s_j).
+    '''
+
+    def __init__(self, models):
+        assert len(models) > 1, 'MultiAgentLearner needs more than one agent'
+        assert len(set(type(m) for m in models)) == 1, 'all agents must use the same algorithm'
+        self.models = models
+        self.n = len(models)
+
+    def learn(self, episode, s, a, r, s_):
+        '''
+        inputs: a batch sampled from the shared ExperienceReplay, s: [B, n, s_dim], a: [B, n, a_dim], r: [B, n, 1]
+        '''
+        results = self._train(s, a, r, s_, tf.constant(episode, dtype=tf.int64))
+        for m, (actor_loss, critic_loss, actor_lr, critic_lr) in zip(self.models, results):
+            m.episode = episode
+            m.recorder.add_scalars(m.global_step, {
+                'LOSS/actor_loss': actor_loss,
+                'LOSS/critic_loss': critic_loss,
+                'LEARNING_RATE/actor_lr': actor_lr,
+                'LEARNING_RATE/critic_lr': critic_lr
+            })
+
+    @tf.function(experimental_relax_shapes=True)
+    def _train(self, s, a, r, s_, episode):
+        s, a, r, s_ = [tf.cast(x, tf.float32) for x in (s, a, r, s_)]
+        batch_size = tf.shape(s)[0]
+        ss = tf.reshape(s, [batch_size, -1])
+        ss_ = tf.reshape(s_, [batch_size, -1])
+        aa = tf.reshape(a, [batch_size, -1])
+        aa_ = tf.concat([m._get_target_action(s_[:, i])[-1] for i, m in enumerate(self.models)], axis=-1)
+        mu = [m._get_action(s[:, i])[0] for i, m in enumerate(self.models)]
+        empty = tf.zeros([batch_size, 0])
+        results = []
+        for i, m in enumerate(self.models):
+            ap = tf.concat(mu[:i], axis=-1) if i > 0 else empty
+            al = tf.concat(mu[i + 1:], axis=-1) if i < self.n - 1 else empty
+            actor_loss, critic_loss = m.train(ap, al, ss, ss_, aa, aa_, s[:, i], r[:, i])
+            if hasattr(m, 'target_sync'):
+                m.target_sync()
+            results.append((actor_loss, critic_loss, m.actor_lr(episode), m.critic_lr(episode)))
+        return results
@@ -1,7 +1,7 @@
 import numpy as np
 import tensorflow as tf
 import Nn
-from .base import Base
+from .base import Base, TargetSync
 
 
 class MATD3(Base):
@@ -14,6 +14,7 @@ class MATD3(Base):
 
                  gamma=0.99,
                  ployak=0.995,
+                 assign_interval=1,
                  actor_lr=5.0e-4,
                  critic_lr=1.0e-3,
                  max_episode=50000,
@@ -46,6 +47,10 @@ class MATD3(Base):
             self.actor_target_net.weights + self.q1_target_net.weights + self.q2_target_net.weights,
             self.actor_net.weights + self.q1_net.weights + self.q2_net.weights
         )
+        self.target_sync = TargetSync(
+            self.actor_target_net.weights + self.q1_target_net.weights + self.q2_target_net.weights,
+            self.actor_net.weights + self.q1_net.weights + self.q2_net.weights,
+            self.ployak, assign_interval)
         self.actor_lr = tf.keras.optimizers.schedules.PolynomialDecay(actor_lr, self.max_episode, 1e-10, power=1.0)
         self.critic_lr = tf.keras.optimizers.schedules.PolynomialDecay(critic_lr, self.max_episode, 1e-10, power=1.0)
         self.optimizer_critic = tf.keras.optimizers.Adam(learning_rate=self.critic_lr(self.episode))
@@ -91,16 +96,13 @@ class MATD3(Base):
     def learn(self, episode, ap, al, ss, ss_, aa, aa_, s, r):
         self.episode = episode
         actor_loss, critic_loss = self.train(ap, al, ss, ss_, aa, aa_, s, r)
-        self.update_target_net_weights(
-            self.actor_target_net.weights + self.q1_target_net.weights + self.q2_target_net.weights,
-            self.actor_net.weights + self.q1_net.weights + self.q2_net.weights,
-            self.ployak)
-        tf.summary.experimental.set_step(self.global_step)
-        tf.summary.scalar('LOSS/actor_loss', actor_loss)
-        tf.summary.scalar('LOSS/critic_loss', critic_loss)
-        tf.summary.scalar('LEARNING_RATE/actor_lr', self.actor_lr(self.episode))
-        tf.summary.scalar('LEARNING_RATE/critic_lr', self.critic_lr(self.episode))
-        self.recorder.writer.flush()
+        self.target_sync()
+        self.recorder.add_scalars(self.global_step, {
+            'LOSS/actor_loss': actor_loss,
+            'LOSS/critic_loss': critic_loss,
+            'LEARNING_RATE/actor_lr': self.actor_lr(self.episode),
+            'LEARNING_RATE/critic_lr': self.critic_lr(self.episode)
+        })
 
     def get_max_episode(self):
         """
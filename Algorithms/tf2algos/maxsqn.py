@@ -2,8 +2,8 @@ import numpy as np
 import tensorflow as tf
 import tensorflow_probability as tfp
 import Nn
-from utils.sth import sth
 from .policy import Policy
+from .base import TargetSync
 
 
 class MAXSQN(Policy):
@@ -19,11 +19,18 @@ class MAXSQN(Policy):
                  buffer_size=10000,
                  use_priority=False,
                  n_step=False,
+                 fused_steps=1,
+                 xla=False,
+                 mixed_precision=False,
                  base_dir=None,
 
                  alpha=0.2,
                  beta=0.1,
                  ployak=0.995,
+                 assign_interval=1,
+                 ensemble_size=2,
+                 share_encoder=False,
+                 target_heads=2,
                  epsilon=0.2,
                  use_epsilon=False,
                  q_lr=5.0e-4,
@@ -46,25 +53,32 @@ class MAXSQN(Policy):
             batch_size=batch_size,
             buffer_size=buffer_size,
             use_priority=use_priority,
-            n_step=n_step)
+            n_step=n_step,
+            fused_steps=fused_steps,
+            xla=xla,
+            mixed_precision=mixed_precision)
         self.epsilon = epsilon
         self.use_epsilon = use_epsilon
         self.ployak = ployak
         self.log_alpha = alpha if not auto_adaption else tf.Variable(initial_value=0.0, name='log_alpha', dtype=tf.float32, trainable=True)
         self.auto_adaption = auto_adaption
         self.target_alpha = beta * np.log(self.a_counts)
-        self.q1_net = Nn.critic_q_all(self.s_dim, self.visual_dim, self.a_counts, 'q1_net', hidden_units)
-        self.q1_target_net = Nn.critic_q_all(self.s_dim, self.visual_dim, self.a_counts, 'q1_target_net', hidden_units)
-        self.q2_net = Nn.critic_q_all(self.s_dim, self.visual_dim, self.a_counts, 'q2_net', hidden_units)
-        self.q2_target_net = Nn.critic_q_all(self.s_dim, self.visual_dim, self.a_counts, 'q2_target_net', hidden_units)
+        self.target_heads = target_heads
+        self.q_hidden_units = hidden_units
+        self.q_net = Nn.critic_q_all_ensemble(self.s_dim, self.visual_dim, self.a_counts, 'q_net', hidden_units, ensemble_size, conv_dtype=self.conv_dtype, share_encoder=share_encoder)
+        self.q_target_net = Nn.critic_q_all_ensemble(self.s_dim, self.visual_dim, self.a_counts, 'q_target_net', hidden_units, ensemble_size, conv_dtype=self.conv_dtype, share_encoder=share_encoder)
         self.update_target_net_weights(
-            self.q1_target_net.weights + self.q2_target_net.weights,
-            self.q1_net.weights + self.q2_net.weights
+            self.q_target_net.weights,
+            self.q_net.weights
         )
+        self.target_sync = TargetSync(
+            self.q_target_net.weights,
+            self.q_net.weights,
+            self.ployak, assign_interval)
         self.q_lr = tf.keras.optimizers.schedules.PolynomialDecay(q_lr, self.max_episode, 1e-10, power=1.0)
         self.alpha_lr = tf.keras.optimizers.schedules.PolynomialDecay(alpha_lr, self.max_episode, 1e-10, power=1.0)
-        self.optimizer_critic = tf.keras.optimizers.Adam(learning_rate=self.q_lr(self.episode))
-        self.optimizer_alpha = tf.keras.optimizers.Adam(learning_rate=self.alpha_lr(self.episode))
+        self.optimizer_critic = self.init_optimizer(tf.keras.optimizers.Adam(learning_rate=self.q_lr(self.episode)))
+        self.optimizer_alpha = self.init_optimizer(tf.keras.optimizers.Adam(learning_rate=self.alpha_lr(self.episode)))
         self.generate_recorder(
             logger2file=logger2file,
             model=self
@@ -84,91 +98,78 @@ class MAXSQN(Policy):
 
     def choose_action(self, s, visual_s):
         if self.use_epsilon and np.random.uniform() < self.epsilon:
-            a = np.random.randint(0, self.a_counts, len(s))
-        else:
-            a = self._get_action(s, visual_s)[-1].numpy()
-        return sth.int2action_index(a, self.a_dim_or_list)
+            return self.random_action(len(s))
+        return self.call_action(self._get_action, s, visual_s)[-1]
 
     def choose_inference_action(self, s, visual_s):
-        return sth.int2action_index(
-            self._get_action(s, visual_s)[0].numpy(),
-            self.a_dim_or_list
-        )
+        return self.call_action(self._get_action, s, visual_s)[0]
 
     @tf.function
     def _get_action(self, vector_input, visual_input):
         with tf.device(self.device):
-            q = self.q1_net(vector_input, visual_input)
+            q = self.q_net(vector_input, visual_input)[0]
             cate_dist = tfp.distributions.Categorical(logits=q / tf.exp(self.log_alpha))
             pi = cate_dist.sample()
-        return tf.argmax(q, axis=1), pi
+        return self.action_index_decode(tf.argmax(q, axis=1)), self.action_index_decode(pi)
+
+    def init_or_restore(self, base_dir):
+        super().init_or_restore(base_dir)
+        self.restore_twin_critics(base_dir, {
+            self.q_net: ['q1_net', 'q2_net'],
+            self.q_target_net: ['q1_target_net', 'q2_target_net']
+        }, lambda name: Nn.critic_q_all(self.s_dim, self.visual_dim, self.a_counts, name, self.q_hidden_units, conv_dtype=self.conv_dtype))
 
     def store_data(self, s, visual_s, a, r, s_, visual_s_, done):
         self.off_store(s, visual_s, a, r[:, np.newaxis], s_, visual_s_, done[:, np.newaxis])
 
     def learn(self, **kwargs):
         self.episode = kwargs['episode']
-        for i in range(kwargs['step']):
-            if self.data.is_lg_batch_size:
-                s, visual_s, a, r, s_, visual_s_, done = self.data.sample()
-                if self.use_priority:
-                    self.IS_w = self.data.get_IS_w()
-                loss, entropy, td_error = self.train(s, visual_s, a, r, s_, visual_s_, done)
-                if self.use_priority:
-                    self.data.update(td_error, self.episode)
-                self.update_target_net_weights(
-                    self.q1_target_net.weights + self.q2_target_net.weights,
-                    self.q1_net.weights + self.q2_net.weights,
-                    self.ployak)
-                tf.summary.experimental.set_step(self.global_step)
-                tf.summary.scalar('LOSS/loss', loss)
-                tf.summary.scalar('LOSS/alpha', tf.exp(self.log_alpha))
-                tf.summary.scalar('LOSS/entropy', entropy)
-                tf.summary.scalar('LEARNING_RATE/q_lr', self.q_lr(self.episode))
-                tf.summary.scalar('LEARNING_RATE/alpha_lr', self.alpha_lr(self.episode))
-                self.recorder.writer.flush()
+        return self.off_policy_learn(kwargs['step'], self._train_step, summaries={
+            'LEARNING_RATE/q_lr': self.q_lr(self.episode),
+            'LEARNING_RATE/alpha_lr': self.alpha_lr(self.episode)
+        })
+
+    def _train_step(self, s, visual_s, a, r, s_, visual_s_, done):
+        loss, entropy, td_error = self.train(s, visual_s, a, r, s_, visual_s_, done)
+        self.target_sync()
+        return td_error, {
+            'LOSS/loss': loss,
+            'LOSS/alpha': tf.exp(self.log_alpha),
+            'LOSS/entropy': entropy
+        }
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, s, visual_s, a, r, s_, visual_s_, done):
         with tf.device(self.device):
+            a = self.action_one_hot(a)
             with tf.GradientTape() as tape:
-                q1 = self.q1_net(s, visual_s)
-                q1_eval = tf.reduce_sum(tf.multiply(q1, a), axis=1, keepdims=True)
-                q2 = self.q2_net(s, visual_s)
-                q2_eval = tf.reduce_sum(tf.multiply(q2, a), axis=1, keepdims=True)
+                q = self.q_net(s, visual_s)
+                q_eval = tf.reduce_sum(tf.multiply(q, a), axis=-1, keepdims=True)
 
-                q1_target = self.q1_target_net(s_, visual_s_)
-                q1_target_max = tf.reduce_max(q1_target, axis=1, keepdims=True)
+                q_target_all = self.q_target_net(s_, visual_s_)
+                q_target_max = tf.reduce_max(q_target_all, axis=-1, keepdims=True)
+                q1_target = q_target_all[0]
                 q1_target_log_probs = tf.nn.log_softmax(q1_target / tf.exp(self.log_alpha), axis=1) + 1e-8
                 q1_target_log_max = tf.reduce_max(q1_target_log_probs, axis=1, keepdims=True)
                 q1_target_entropy = -tf.reduce_mean(tf.reduce_sum(tf.exp(q1_target_log_probs) * q1_target_log_probs, axis=1, keepdims=True))
 
-                q2_target = self.q2_target_net(s_, visual_s_)
-                q2_target_max = tf.reduce_max(q2_target, axis=1, keepdims=True)
-                # q2_target_log_probs = tf.nn.log_softmax(q2_target, axis=1)
-                # q2_target_log_max = tf.reduce_max(q2_target_log_probs, axis=1, keepdims=True)
-
-                q_target = tf.minimum(q1_target_max, q2_target_max) + tf.exp(self.log_alpha) * q1_target_entropy
+                q_target = self.q_target_net.random_min_q(q_target_max, self.target_heads) + tf.exp(self.log_alpha) * q1_target_entropy
                 dc_r = tf.stop_gradient(r + self.gamma * q_target * (1 - done))
-                td_error1 = q1_eval - dc_r
-                td_error2 = q2_eval - dc_r
-                q1_loss = tf.reduce_mean(tf.square(td_error1) * self.IS_w)
-                q2_loss = tf.reduce_mean(tf.square(td_error2) * self.IS_w)
-                loss = 0.5 * (q1_loss + q2_loss)
-            loss_grads = tape.gradient(loss, self.q1_net.trainable_variables + self.q2_net.trainable_variables)
+                td_error = q_eval - dc_r
+                loss = 0.5 * tf.reduce_sum(tf.reduce_mean(tf.square(td_error) * self.IS_w, axis=[1, 2]))
+            loss_grads = self.gradient(tape, self.optimizer_critic, loss, self.q_net.trainable_variables)
             self.optimizer_critic.apply_gradients(
-                zip(loss_grads, self.q1_net.trainable_variables + self.q2_net.trainable_variables)
+                zip(loss_grads, self.q_net.trainable_variables)
             )
             if self.auto_adaption:
                 with tf.GradientTape() as tape:
-                    q1 = self.q1_net(s, visual_s)
                     q1_log_probs = tf.nn.log_softmax(q1_target / tf.exp(self.log_alpha), axis=1) + 1e-8
                     q1_log_max = tf.reduce_max(q1_log_probs, axis=1, keepdims=True)
                     q1_entropy = -tf.reduce_mean(tf.reduce_sum(tf.exp(q1_log_probs) * q1_log_probs, axis=1, keepdims=True))
                     alpha_loss = -tf.reduce_mean(self.log_alpha * tf.stop_gradient(self.target_alpha - q1_entropy))
-                alpha_grads = tape.gradient(alpha_loss, [self.log_alpha])
+                alpha_grads = self.gradient(tape, self.optimizer_alpha, alpha_loss, [self.log_alpha])
                 self.optimizer_alpha.apply_gradients(
                     zip(alpha_grads, [self.log_alpha])
                 )
             self.global_step.assign_add(1)
-            return loss, q1_entropy, td_error1 + td_error2 / 2
+            return loss, q1_entropy, tf.reduce_mean(td_error, axis=0)
@@ -40,7 +40,7 @@ class PG(Policy):
             batch_size=batch_size)
         self.epoch = epoch
         self.epsilon = epsilon
-        self.TensorSpecs = self.get_TensorSpecs([self.s_dim], self.visual_dim, [self.a_counts], [1])
+        self.TensorSpecs = self.get_TensorSpecs([self.s_dim], self.visual_dim, [self.a_store_dim], [1], visual_index=1)
         if self.action_type == 'continuous':
             self.net = Nn.actor_mu(self.s_dim, self.visual_dim, self.a_counts, 'pg_net', hidden_units['actor_continuous'])
         else:
@@ -66,18 +66,12 @@ class PG(Policy):
         ''')
 
     def choose_action(self, s, visual_s):
-        if self.action_type == 'continuous':
-            return self._get_action(s, visual_s).numpy()
-        else:
-            if np.random.uniform() < self.epsilon:
-                a = np.random.randint(0, self.a_counts, len(s))
-            else:
-                a = self._get_action(s, visual_s).numpy()
-            return sth.int2action_index(a, self.a_dim_or_list)
+        if not self.action_type == 'continuous' and np.random.uniform() < self.epsilon:
+            return self.random_action(len(s))
+        return self.call_action(self._get_action, s, visual_s)
 
     def choose_inference_action(self, s, visual_s):
-        a = self._get_action(s, visual_s).numpy()
-        return a if self.action_type == 'continuous' else sth.int2action_index(a, self.a_dim_or_list)
+        return self.call_action(self._get_action, s, visual_s)
 
     @tf.function
     def _get_action(self, vector_input, visual_input):
@@ -88,46 +82,39 @@ class PG(Policy):
             else:
                 logits = self.net(vector_input, visual_input)
                 norm_dist = tfp.distributions.Categorical(logits)
-                sample_op = norm_dist.sample()
+                sample_op = self.action_index_decode(norm_dist.sample())
         return sample_op
 
     def store_data(self, s, visual_s, a, r, s_, visual_s_, done):
         self.on_store(s, visual_s, a, r, s_, visual_s_, done)
 
     def calculate_statistics(self):
-        self.data['total_reward'] = sth.discounted_sum(self.data.r.values, 1, 0, self.data.done.values)
-        a = np.array(sth.discounted_sum(self.data.r.values, self.gamma, 0, self.data.done.values))
+        self.data['total_reward'] = sth.discounted_returns(self.data['r'], 1, 0, self.data['done'])
+        a = sth.discounted_returns(self.data['r'], self.gamma, 0, self.data['done'])
         a -= np.mean(a)
         a /= np.std(a)
-        self.data['discounted_reward'] = list(a)
-
-    def get_sample_data(self, index):
-        i_data = self.data.iloc[index:index+self.batch_size]
-        s = np.vstack(i_data.s.values)
-        visual_s = np.vstack(i_data.visual_s.values)
-        a = np.vstack(i_data.a.values)
-        dc_r = np.vstack(i_data.discounted_reward.values).reshape(-1, 1)
-        return s, visual_s, a, dc_r
+        self.data['discounted_reward'] = a
 
     def learn(self, **kwargs):
-        assert self.batch_size <= self.data.shape[0], "batch_size must less than the length of an episode"
+        assert self.batch_size <= len(self.data), "batch_size must less than the length of an episode"
         self.episode = kwargs['episode']
         self.calculate_statistics()
         for _ in range(self.epoch):
-            for index in range(0, self.data.shape[0], self.batch_size):
-                s, visual_s, a, dc_r = [tf.convert_to_tensor(i) for i in self.get_sample_data(index)]
+            for data in self.data.sample_generator(self.batch_size, ['s', 'visual_s', 'a', 'discounted_reward']):
+                s, visual_s, a, dc_r = [tf.convert_to_tensor(i) for i in data]
                 loss, entropy = self.train.get_concrete_function(
                             *self.TensorSpecs)(s, visual_s, a, dc_r)
-        tf.summary.experimental.set_step(self.episode)
-        tf.summary.scalar('LOSS/entropy', entropy)
-        tf.summary.scalar('LOSS/loss', loss)
-        tf.summary.scalar('LEARNING_RATE/lr', self.lr(self.episode))
-        self.recorder.writer.flush()
+        self.recorder.add_scalars(self.episode, {
+            'LOSS/entropy': entropy,
+            'LOSS/loss': loss,
+            'LEARNING_RATE/lr': self.lr(self.episode)
+        })
         self.clear()
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, s, visual_s, a, dc_r):
         with tf.device(self.device):
+            a = self.action_one_hot(a)
             with tf.GradientTape() as tape:
                 if self.action_type == 'continuous':
                     mu = self.net(s, visual_s)
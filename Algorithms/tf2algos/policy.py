@@ -1,9 +1,43 @@
+import os
+import types
+import shutil
+import threading
 import numpy as np
-import pandas as pd
 import tensorflow as tf
+import Nn
 from .base import Base
-from utils.sth import sth
-from utils.replay_buffer import ExperienceReplay, NStepExperienceReplay, PrioritizedExperienceReplay, NStepPrioritizedExperienceReplay, er_config
+from utils.replay_buffer import ExperienceReplay, VisualExperienceReplay, NStepExperienceReplay, PrioritizedExperienceReplay, NStepPrioritizedExperienceReplay, er_config
+from utils.on_policy_buffer import OnPolicyBuffer
+
+
+class _ActorView(object):
+    '''
+    the policy as the action functions see it after act_with_copies: networks and variables are replaced by copies
+    the first time they are looked up, everything else is read from the policy.
+    '''
+
+    def __init__(self, policy):
+        self._policy = policy
+        self._sources = {}
+
+    def __getattr__(self, name):
+        value = getattr(self._policy, name)
+        if isinstance(value, (Nn.ImageNet, tf.Variable)):
+            with tf.init_scope():   # looked up while tracing, the copies have to be created eagerly
+                copy = value.clone() if isinstance(value, Nn.ImageNet) else tf.Variable(value, trainable=False)
+            self._sources[name] = value
+            setattr(self, name, copy)
+            return copy
+        return value
+
+    def sync(self):
+        for name, source in self._sources.items():
+            copy = getattr(self, name)
+            if isinstance(source, tf.Variable):
+                copy.assign(source)
+            else:
+                for t, s in zip(copy.weights, source.weights):
+                    t.assign(s)
 
 
 class Policy(Base):
@@ -21,7 +55,10 @@ class Policy(Base):
                  batch_size=1,
                  buffer_size=1,
                  use_priority=False,
-                 n_step=False):
+                 n_step=False,
+                 fused_steps=1,
+                 xla=False,
+                 mixed_precision=False):
         super().__init__(
             a_dim_or_list=a_dim_or_list,
             action_type=action_type,
@@ -30,6 +67,7 @@ class Policy(Base):
         self.visual_sources = visual_sources
         self.visual_dim = [visual_sources, *visual_resolution] if visual_sources else [0]
         self.a_dim_or_list = a_dim_or_list
+        self.a_store_dim = self.a_counts if self.action_type == 'continuous' else len(a_dim_or_list)  # width of actions in buffers
         self.gamma = gamma
         self.max_episode = max_episode
         self.policy_mode = policy_mode
@@ -37,17 +75,68 @@ class Policy(Base):
         self.buffer_size = buffer_size
         self.use_priority = use_priority
         self.n_step = n_step
+        self.fused_steps = fused_steps  # number of updates that off_policy_learn runs in one tf.function
+        self.xla = xla  # whether train and train_persistent are compiled with XLA
+        self.mixed_precision = mixed_precision and bool(visual_sources)  # only visual encoders run in float16
+        self.conv_dtype = 'mixed_float16' if self.mixed_precision else 'float32'  # dtype policy of the visual encoders of this policy
+        self._action_fns = {}
+        self._fused_fns = {}
+        self.trace_counts = {}  # how many times every action function has been traced, see call_action
+        self.save_replay = False    # whether save_checkpoint also writes a snapshot of the replay buffer
+        self.weights_lock = threading.Lock()  # held by whoever writes the weights from another thread, see AsyncLearner
+        self._actor_lock = threading.Lock()
+        self._actor_view = None
         self.init_data_memory()
+        if self.xla:
+            self._compile_train_functions()
+
+    def _compile_train_functions(self):
+        """
+        replace the tf.function train and train_persistent of the algorithm with XLA-compiled versions of them.
+        XLA compiles one program per input shape, off_policy_learn only samples once the buffer holds more than
+        batch_size transitions, so every batch has batch_size rows and one program is compiled.
+        """
+        for name in ['train', 'train_persistent']:
+            fn = getattr(type(self), name, None)
+            if not hasattr(fn, 'python_function'):
+                continue
+            python_function = fn.python_function.__get__(self, type(self))
+            try:
+                compiled = tf.function(python_function, jit_compile=True)   # TF >= 2.5
+            except TypeError:
+                compiled = tf.function(python_function, experimental_compile=True)
+            setattr(self, name, compiled)
+
+    def init_optimizer(self, optimizer):
+        """
+        with mixed precision the optimizer is wrapped into a LossScaleOptimizer with dynamic loss scaling, see gradient.
+        """
+        if not self.mixed_precision:
+            return optimizer
+        if hasattr(tf.keras.mixed_precision, 'LossScaleOptimizer'):    # TF >= 2.4
+            return tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+        return tf.keras.mixed_precision.experimental.LossScaleOptimizer(optimizer, loss_scale='dynamic')
+
+    def gradient(self, tape, optimizer, loss, variables):
+        """
+        tape.gradient(loss, variables), with mixed precision backprop starts from the loss scale of optimizer instead of 1,
+        so small float16 gradients of visual encoders do not underflow, and the gradients are unscaled afterwards.
+        optimizer.apply_gradients skips the update and lowers the scale if they are not finite.
+        """
+        if not self.mixed_precision:
+            return tape.gradient(loss, variables)
+        grads = tape.gradient(loss, variables, output_gradients=optimizer.get_scaled_loss(tf.ones_like(loss)))
+        return optimizer.get_unscaled_gradients(grads)
 
     def init_data_memory(self):
         '''
         the biggest diffenernce between policy_modes(ON and OFF) is 'OFF' mode need raise the dimension
         of 'r' and 'done'.
-        'ON' mode means program will call on_store function and use pandas dataframe to store data.
+        'ON' mode means program will call on_store function and use OnPolicyBuffer to store data.
         'OFF' mode will call off_store function and use replay buffer to store data.
         '''
         if self.policy_mode == 'ON':
-            self.data = pd.DataFrame(columns=['s', 'a', 'r', 'done'])
+            self.data = OnPolicyBuffer()
         elif self.policy_mode == 'OFF':
             if self.use_priority:
                 if self.n_step:
@@ -79,6 +168,11 @@ class Policy(Base):
                                                       gamma=self.gamma,
                                                       agents_num=er_config['ner_config']['max_agents'],
                                                       n=er_config['ner_config']['n'])
+                elif self.visual_sources:
+                    print('Visual ER')
+                    self.data = VisualExperienceReplay(self.batch_size,
+                                                       self.buffer_size,
+                                                       extra_frames_ratio=er_config['ver_config']['extra_frames_ratio'])
                 else:
                     print('ER')
                     self.data = ExperienceReplay(self.batch_size, self.buffer_size)
@@ -87,39 +181,48 @@ class Policy(Base):
 
     def on_store(self, s, visual_s, a, r, s_, visual_s_, done):
         """
-        for on-policy training, use this function to store <s, a, r, s_, done> into DataFrame of Pandas.
+        for on-policy training, use this function to store <s, a, r, done> into OnPolicyBuffer, only the last <s_> is kept.
+        discrete actions are stored as branch indices [N, len(a_dim_or_list)], see action_one_hot.
         """
         assert isinstance(a, np.ndarray), "on_store need action type is np.ndarray"
         assert isinstance(r, np.ndarray), "on_store need reward type is np.ndarray"
         assert isinstance(done, np.ndarray), "on_store need done type is np.ndarray"
-        if not self.action_type == 'continuous':
-            a = sth.action_index2one_hot(a, self.a_dim_or_list)
-        self.data = self.data.append({
-            's': s.astype(np.float32),
-            'visual_s': visual_s.astype(np.float32),
-            'a': a.astype(np.float32),
-            'r': r.astype(np.float32),
-            's_': s_.astype(np.float32),
-            'visual_s_': visual_s_.astype(np.float32),
-            'done': done.astype(np.float32)
-        }, ignore_index=True)
+        self.data.add(
+            s=s,
+            visual_s=self.visual_store_type(visual_s),
+            a=a.reshape(len(a), -1),
+            r=r,
+            done=done
+        )
+        self.s_ = s_
+        self.visual_s_ = visual_s_
+
+    @staticmethod
+    def visual_store_type(visual_s):
+        """
+        visual input of policies is raw uint8 pixels, it stays uint8 in buffers and TensorSpecs and ImageNet scales it on device.
+        float frames in [0, 1], e.g. from environments that already normalized them, are converted back to uint8.
+        """
+        visual_s = np.asarray(visual_s)
+        if visual_s.dtype == np.uint8:
+            return visual_s
+        return np.clip(np.rint(visual_s * 255.), 0, 255).astype(np.uint8)
 
     def off_store(self, s, visual_s, a, r, s_, visual_s_, done):
         """
         for off-policy training, use this function to store <s, a, r, s_, done> into ReplayBuffer.
+        discrete actions are stored as branch indices [N, len(a_dim_or_list)], see action_one_hot.
         """
         assert isinstance(a, np.ndarray), "off_store need action type is np.ndarray"
         assert isinstance(r, np.ndarray), "off_store need reward type is np.ndarray"
         assert isinstance(done, np.ndarray), "off_store need done type is np.ndarray"
-        if not self.action_type == 'continuous':
-            a = sth.action_index2one_hot(a, self.a_dim_or_list)
         self.data.add(
             s.astype(np.float32),
-            visual_s.astype(np.float32),
-            a.astype(np.float32),
+            self.visual_store_type(visual_s),
+            a.reshape(len(a), -1).astype(np.float32),
             r.astype(np.float32),
             s_.astype(np.float32),
-            visual_s_.astype(np.float32),
+            self.visual_store_type(visual_s_),
             done.astype(np.float32)
         )
 
@@ -128,23 +231,149 @@ class Policy(Base):
         assert isinstance(r, np.ndarray), "no_op_store need reward type is np.ndarray"
         assert isinstance(done, np.ndarray), "no_op_store need done type is np.ndarray"
         if self.policy_mode == 'OFF':
-            if not self.action_type == 'continuous':
-                a = sth.action_index2one_hot(a, self.a_dim_or_list)
             self.data.add(
                 s.astype(np.float32),
-                visual_s.astype(np.float32),
-                a.astype(np.float32),
+                self.visual_store_type(visual_s),
+                a.reshape(len(a), -1).astype(np.float32),
                 r[:, np.newaxis].astype(np.float32),
                 s_.astype(np.float32),
-                visual_s_.astype(np.float32),
+                self.visual_store_type(visual_s_),
                 done[:, np.newaxis].astype(np.float32)
             )
 
+    def truncate(self, index=None):
+        """
+        tell the n-step ReplayBuffer that episodes of the specified agents are cut off without done, e.g. by max_step.
+        """
+        if self.policy_mode == 'OFF':
+            self.data.truncate(index)
+
+    def save_checkpoint(self, global_step):
+        """
+        save the training model, and the replay buffer as cp_dir/replay-{global_step} if save_replay is set.
+        older snapshots are removed after the new one is complete.
+        """
+        with self.weights_lock:
+            super().save_checkpoint(global_step)
+        if self.save_replay and self.policy_mode == 'OFF' and not self.data.is_empty():
+            path = os.path.join(self.cp_dir, f'replay-{global_step}')
+            if not os.path.exists(path):
+                self.data.save(path)
+            for old in self.replay_snapshots(self.cp_dir):
+                if old != path:
+                    shutil.rmtree(old, ignore_errors=True)   # a snapshot that is still memory-mapped may not be removable on Windows
+            self.recorder.logger.info(f'Save replay buffer success. Transitions: {self.data.size}')
+
+    def init_or_restore(self, base_dir):
+        """
+        restore the model, and the latest replay buffer snapshot in base_dir if there is one.
+        """
+        super().init_or_restore(base_dir)
+        snapshots = self.replay_snapshots(os.path.join(base_dir, 'model'))
+        if self.policy_mode == 'OFF' and snapshots:
+            try:
+                self.data.load(snapshots[-1])
+            except Exception as e:
+                self.recorder.logger.error(f'restore replay buffer FAILED. {e}')
+            else:
+                self.recorder.logger.info(f'restore replay buffer SUCCUESS. Transitions: {self.data.size}')
+
+    def restore_twin_critics(self, base_dir, ensembles, build_net):
+        """
+        checkpoints saved before the critics became ensembles keep every head as its own network.
+        inputs:
+            ensembles: {ensemble: [names of the old networks]}, e.g. {self.q_net: ['q1_net', 'q2_net']}
+            build_net: build_net(name) returns a network with the layout of the old ones
+        """
+        cp = tf.train.latest_checkpoint(os.path.join(base_dir, 'model'))
+        if cp is None:
+            return
+        for ensemble, names in ensembles.items():
+            try:
+                converted = Nn.restore_twin_critics(cp, ensemble, names, build_net)
+            except ValueError as e:
+                self.recorder.logger.error(f'convert {", ".join(names)} into {ensemble.name} FAILED. {e}')
+            else:
+                if converted:
+                    self.recorder.logger.info(f'convert {", ".join(names)} into {ensemble.name} SUCCUESS.')
+
+    @staticmethod
+    def replay_snapshots(cp_dir):
+        """
+        complete replay buffer snapshots in cp_dir, ordered by step.
+        """
+        if not os.path.isdir(cp_dir):
+            return []
+        steps = [int(f[len('replay-'):]) for f in os.listdir(cp_dir) if f.startswith('replay-') and f[len('replay-'):].isdigit()]
+        return [os.path.join(cp_dir, f'replay-{i}') for i in sorted(steps)]
+
+    def off_policy_learn(self, steps, train_step, summaries={}):
+        """
+        run `steps` updates of an off-policy algorithm.
+        inputs:
+            train_step: train_step(*self.data.sample()) runs one update including the target networks' update,
+                        and returns td_error and a dict of scalars to record. it must be traceable by tf.function.
+            summaries: scalars that stay constant during this call, e.g. learning rates.
+        if fused_steps > 1 and PER is off, fused_steps sampled batches are stacked and moved to the device together,
+        then all updates run in one tf.function, and the scalars are averaged and recorded once per call.
+        return: the number of updates that ran, 0 while the buffer holds no more than batch_size transitions.
+        """
+        if self.fused_steps > 1 and not self.use_priority:
+            return self._fused_off_policy_learn(steps, train_step, summaries)
+        count = 0
+        for i in range(steps):
+            if self.data.is_lg_batch_size:
+                batch = self.data.sample()
+                if self.use_priority:
+                    self.IS_w = self.data.get_IS_w()
+                td_error, step_summaries = train_step(*batch)
+                if self.use_priority:
+                    self.data.update(td_error, self.episode)
+                self.recorder.add_scalars(self.global_step, {**step_summaries, **summaries})
+                count += 1
+        return count
+
+    def _fused_off_policy_learn(self, steps, train_step, summaries):
+        totals, count = {}, 0
+        while steps > 0 and self.data.is_lg_batch_size:
+            k = min(self.fused_steps, steps)
+            batches = [np.stack(x) for x in zip(*[self.data.sample() for _ in range(k)])]
+            name = train_step.__name__
+            if name not in self._fused_fns:
+                self._fused_fns[name] = self._build_fused_fn(train_step)
+            means = self._fused_fns[name](*batches)
+            for key, v in means.items():
+                totals[key] = totals.get(key, 0.) + v.numpy() * k
+            count += k
+            steps -= k
+        if count > 0:
+            self.recorder.add_scalars(self.global_step, {
+                **{k: v / count for k, v in totals.items()},
+                **summaries
+            })
+        return count
+
+    def _build_fused_fn(self, train_step):
+        """
+        wrap train_step into a tf.function looping over the first dimension of stacked batches [K, batch_size, ...],
+        it returns the mean of every scalar over the K updates.
+        """
+        @tf.function(experimental_relax_shapes=True)
+        def fused_fn(*batches):
+            with tf.device(self.device):
+                n = tf.shape(batches[0])[0]
+                _, totals = train_step(*[x[0] for x in batches])
+                for i in tf.range(1, n):
+                    _, step_summaries = train_step(*[x[i] for x in batches])
+                    totals = {k: totals[k] + step_summaries[k] for k in totals}
+                return {k: v / tf.cast(n, v.dtype) for k, v in totals.items()}
+        return fused_fn
+
     def clear(self):
         """
-        clear the DataFrame.
+        clear the OnPolicyBuffer.
         """
-        self.data.drop(self.data.index, inplace=True)
+        self.data.clear()
 
     def get_max_episode(self):
         """
@@ -152,11 +381,93 @@ class Policy(Base):
         """
         return self.max_episode
 
-    def get_TensorSpecs(self, *args):
+    def act_with_copies(self):
+        """
+        let the action functions read copies of the networks and variables they use instead of the trained ones,
+        sync_actor copies the trained weights into them. used when another thread trains the policy, see AsyncLearner,
+        so that an action is never computed from weights that are half way through an update.
+        """
+        self._actor_view = _ActorView(self)
+        self._action_fns = {}
+        self.trace_counts = {}
+
+    def sync_actor(self):
+        """
+        copy the trained weights into the copies used by the action functions. the caller must hold weights_lock,
+        or be the only thread writing the weights.
+        """
+        with self._actor_lock:
+            self._actor_view.sync()
+
+    def call_action(self, func, s, visual_s):
+        """
+        run the action tf.function func(vector_input, visual_input) through a concrete function with the input signature
+        [None, s_dim], [None, *visual_dim], so a changing number of agents never retraces it.
+        trace_counts[name] is increased in the traced python body, i.e. only when the function is really traced,
+        a warning is logged from the second trace on.
+        after act_with_copies func reads the copies, they are made by an extra trace under weights_lock.
+        """
+        s = np.asarray(s, dtype=np.float32)
+        visual_s = self.visual_store_type(visual_s)
+        name = func.python_function.__name__
+        if name not in self._action_fns:
+            python_function = func.python_function
+            input_signature = self.get_TensorSpecs([self.s_dim], self.visual_dim, visual_index=1)
+            if self._actor_view is not None:
+                python_function = types.MethodType(getattr(type(self), name).python_function, self._actor_view)
+                with self.weights_lock:  # trace once to create the copies, it is not counted
+                    tf.function(python_function, input_signature=input_signature).get_concrete_function()
+
+            def traced(vector_input, visual_input):
+                self.trace_counts[name] = self.trace_counts.get(name, 0) + 1
+                if self.trace_counts[name] > 1:
+                    self.recorder.logger.warning(f'{name} has been traced {self.trace_counts[name]} times.')
+                return python_function(vector_input, visual_input)
+            self._action_fns[name] = tf.function(traced, input_signature=input_signature)
+        if self._actor_view is not None:
+            with self._actor_lock:
+                return tf.nest.map_structure(lambda x: x.numpy(), self._action_fns[name](s, visual_s))
+        return tf.nest.map_structure(lambda x: x.numpy(), self._action_fns[name](s, visual_s))
+
+    def action_index_decode(self, a):
+        """
+        in-graph version of sth.int2action_index, input: [batch,], output: [batch, len(a_dim_or_list)]
+        """
+        a = tf.cast(a, tf.int32)
+        y = []
+        for i in reversed(self.a_dim_or_list):
+            y.insert(0, a % i)
+            a //= i
+        return tf.stack(y, axis=1)
+
+    def action_index_encode(self, a):
+        """
+        in-graph version of sth.action_index2int, input: [batch, len(a_dim_or_list)], output: [batch,]
+        """
+        factors = np.cumprod([1] + list(reversed(self.a_dim_or_list[1:])))[::-1]
+        return tf.reduce_sum(tf.cast(a, tf.int32) * tf.constant(factors, dtype=tf.int32), axis=-1)
+
+    def action_one_hot(self, a):
+        """
+        expand actions read from buffers on device, discrete branch indices [batch, len(a_dim_or_list)] become
+        one-hot vectors [batch, a_counts] of the joint action, continuous actions are only cast to float32.
+        """
+        if self.action_type == 'continuous':
+            return tf.cast(a, tf.float32)
+        return tf.one_hot(self.action_index_encode(a), self.a_counts, dtype=tf.float32)
+
+    def random_action(self, n):
+        """
+        uniformly sample n discrete actions with the same format as action_index_decode.
+        """
+        return np.stack([np.random.randint(0, i, n) for i in self.a_dim_or_list], axis=1)
+
+    def get_TensorSpecs(self, *args, visual_index=None):
         """
         get all inputs' shape in order to fix the problem of retracting in TF2.0
+        the spec at position visual_index is the visual input and has dtype uint8, see visual_store_type, others are float32.
         """
-        return [tf.TensorSpec(shape=[None] + i, dtype=tf.float32) for i in args]
+        return [tf.TensorSpec(shape=[None] + i, dtype=tf.uint8 if j == visual_index else tf.float32) for j, i in enumerate(args)]
 
     @staticmethod
     def clip_nn_log_std(log_std, _min=-20, _max=2):
@@ -171,7 +482,7 @@ class Policy(Base):
         reparameter
         """
         std = tf.exp(log_std)
-        pi = mu + tf.random.normal(mu.shape) * std
+        pi = mu + tf.random.normal(tf.shape(mu)) * std
         log_pi = Policy.gaussian_likelihood(pi, mu, log_std)
         return pi, log_pi
 
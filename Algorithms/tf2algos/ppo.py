@@ -62,7 +62,7 @@ class PPO(Policy):
         self.epsilon = epsilon
         self.share_net = share_net
         if self.share_net:
-            self.TensorSpecs = self.get_TensorSpecs([self.s_dim], self.visual_dim, [self.a_counts], [1], [1], [1])
+            self.TensorSpecs = self.get_TensorSpecs([self.s_dim], self.visual_dim, [self.a_store_dim], [1], [1], [1], visual_index=1)
             if self.action_type == 'continuous':
                 self.net = Nn.a_c_v_continuous(self.s_dim, self.visual_dim, self.a_counts, 'ppo_net', hidden_units['share']['continuous'])
             else:
@@ -70,8 +70,8 @@ class PPO(Policy):
             self.lr = tf.keras.optimizers.schedules.PolynomialDecay(lr, self.max_episode, 1e-10, power=1.0)
             self.optimizer = tf.keras.optimizers.Adam(learning_rate=self.lr(self.episode))
         else:
-            self.actor_TensorSpecs = self.get_TensorSpecs([self.s_dim], self.visual_dim, [self.a_counts], [1], [1])
-            self.critic_TensorSpecs = self.get_TensorSpecs([self.s_dim], self.visual_dim, [1])
+            self.actor_TensorSpecs = self.get_TensorSpecs([self.s_dim], self.visual_dim, [self.a_store_dim], [1], [1], visual_index=1)
+            self.critic_TensorSpecs = self.get_TensorSpecs([self.s_dim], self.visual_dim, [1], visual_index=1)
             if self.action_type == 'continuous':
                 self.actor_net = Nn.actor_mu(self.s_dim, self.visual_dim, self.a_counts, 'actor_net', hidden_units['actor_continuous'])
             else:
@@ -99,12 +99,10 @@ class PPO(Policy):
         ''')
 
     def choose_action(self, s, visual_s):
-        a = self._get_action(s, visual_s).numpy()
-        return a if self.action_type == 'continuous' else sth.int2action_index(a, self.a_dim_or_list)
+        return self.call_action(self._get_action, s, visual_s)
 
     def choose_inference_action(self, s, visual_s):
-        a = self._get_action(s, visual_s).numpy()
-        return a if self.action_type == 'continuous' else sth.int2action_index(a, self.a_dim_or_list)
+        return self.call_action(self._get_action, s, visual_s)
 
     @tf.function
     def _get_action(self, vector_input, visual_input):
@@ -121,24 +119,23 @@ class PPO(Policy):
                 else:
                     logits = self.actor_net(vector_input, visual_input)
                 norm_dist = tfp.distributions.Categorical(logits)
-                sample_op = norm_dist.sample()
+                sample_op = self.action_index_decode(norm_dist.sample())
         return sample_op
 
     def store_data(self, s, visual_s, a, r, s_, visual_s_, done):
         assert isinstance(a, np.ndarray), "store_data need action type is np.ndarray"
         assert isinstance(r, np.ndarray), "store_data need reward type is np.ndarray"
         assert isinstance(done, np.ndarray), "store_data need done type is np.ndarray"
-        if not self.action_type == 'continuous':
-            a = sth.action_index2one_hot(a, self.a_dim_or_list)
-        self.data = self.data.append({
-            's': s.astype(np.float32),
-            'visual_s': visual_s.astype(np.float32),
-            'a': a.astype(np.float32),
-            'r': r.astype(np.float32),
-            'done': done.astype(np.float32),
-            'value': np.squeeze(self._get_value(s, visual_s).numpy().astype(np.float32)),
-            'log_prob': self._get_log_prob(s, visual_s, a).numpy().astype(np.float32) + 1e-10
-        }, ignore_index=True)
+        visual_s = self.visual_store_type(visual_s)
+        self.data.add(
+            s=s,
+            visual_s=visual_s,
+            a=a,
+            r=r,
+            done=done,
+            value=np.squeeze(self._get_value(s, visual_s).numpy(), axis=-1),
+            log_prob=self._get_log_prob(s, visual_s, a).numpy() + 1e-10
+        )
         self.s_ = s_
         self.visual_s_ = visual_s_
 
@@ -153,8 +150,8 @@ class PPO(Policy):
 
     @tf.function
     def _get_log_prob(self, s, visual_s, a):
-        a = tf.cast(a, tf.float32)
         with tf.device(self.device):
+            a = self.action_one_hot(a)
             if self.action_type == 'continuous':
                 if self.share_net:
                     mu, _ = self.net(s, visual_s)
@@ -171,44 +168,19 @@ class PPO(Policy):
             return new_log_prob
 
     def calculate_statistics(self):
-        init_value = np.squeeze(self._get_value(self.s_, self.visual_s_).numpy())
-        self.data['total_reward'] = sth.discounted_sum(self.data.r.values, 1, init_value, self.data.done.values)
-        self.data['discounted_reward'] = sth.discounted_sum(self.data.r.values, self.gamma, init_value, self.data.done.values)
-        self.data['td_error'] = sth.discounted_sum_minus(
-            self.data.r.values,
-            self.gamma,
-            init_value,
-            self.data.done.values,
-            self.data.value.values
-        )
-        # GAE
-        adv = np.array(sth.discounted_sum(
-            self.data.td_error.values,
-            self.lambda_ * self.gamma,
-            0,
-            self.data.done.values
-        ))
-        self.data['advantage'] = [i for i in (adv - adv.mean()) / adv.std()]
-        # self.data.to_excel(self.recorder.excel_writer, sheet_name=f'test{self.episode}', index=True)
-        # self.recorder.excel_writer.save()
-
-    def get_sample_data(self, index):
-        i_data = self.data.iloc[index:index+self.batch_size]
-        s = np.vstack(i_data.s.values)
-        visual_s = np.vstack(i_data.visual_s.values)
-        a = np.vstack(i_data.a.values)
-        dc_r = np.vstack(i_data.discounted_reward.values).reshape(-1, 1)
-        old_log_prob = np.vstack(i_data.log_prob.values)
-        advantage = np.vstack(i_data.advantage.values).reshape(-1, 1)
-        return s, visual_s, a, dc_r, old_log_prob, advantage
+        init_value = np.squeeze(self._get_value(self.s_, self.visual_s_).numpy(), axis=-1)
+        self.data['total_reward'] = sth.discounted_returns(self.data['r'], 1, init_value, self.data['done'])
+        self.data['discounted_reward'] = sth.discounted_returns(self.data['r'], self.gamma, init_value, self.data['done'])
+        adv = sth.gae(self.data['r'], self.gamma, self.lambda_, init_value, self.data['done'], self.data['value'])
+        self.data['advantage'] = (adv - adv.mean()) / adv.std()
 
     def learn(self, **kwargs):
-        assert self.batch_size <= self.data.shape[0], "batch_size must less than the length of an episode"
+        assert self.batch_size <= len(self.data), "batch_size must less than the length of an episode"
         self.episode = kwargs['episode']
         self.calculate_statistics()
         for _ in range(self.epoch):
-            for index in range(0, self.data.shape[0], self.batch_size):
-                s, visual_s, a, dc_r, old_log_prob, advantage = [tf.convert_to_tensor(i) for i in self.get_sample_data(index)]
+            for data in self.data.sample_generator(self.batch_size, ['s', 'visual_s', 'a', 'discounted_reward', 'log_prob', 'advantage'], shuffle=True):
+                s, visual_s, a, dc_r, old_log_prob, advantage = [tf.convert_to_tensor(i) for i in data]
                 if self.share_net:
                     actor_loss, critic_loss, entropy, kl = self.train_share.get_concrete_function(
                         *self.TensorSpecs)(s, visual_s, a, dc_r, old_log_prob, advantage)
@@ -220,21 +192,23 @@ class PPO(Policy):
                     critic_loss = self.train_critic.get_concrete_function(
                         *self.critic_TensorSpecs)(s, visual_s, dc_r)
         self.global_step.assign_add(1)
-        tf.summary.experimental.set_step(self.episode)
-        tf.summary.scalar('LOSS/entropy', entropy)
-        tf.summary.scalar('LOSS/actor_loss', actor_loss)
-        tf.summary.scalar('LOSS/critic_loss', critic_loss)
+        summaries = {
+            'LOSS/entropy': entropy,
+            'LOSS/actor_loss': actor_loss,
+            'LOSS/critic_loss': critic_loss
+        }
         if self.share_net:
-            tf.summary.scalar('LEARNING_RATE/lr', self.lr(self.episode))
+            summaries['LEARNING_RATE/lr'] = self.lr(self.episode)
         else:
-            tf.summary.scalar('LEARNING_RATE/actor_lr', self.actor_lr(self.episode))
-            tf.summary.scalar('LEARNING_RATE/critic_lr', self.critic_lr(self.episode))
-        self.recorder.writer.flush()
+            summaries['LEARNING_RATE/actor_lr'] = self.actor_lr(self.episode)
+            summaries['LEARNING_RATE/critic_lr'] = self.critic_lr(self.episode)
+        self.recorder.add_scalars(self.episode, summaries)
         self.clear()
 
     @tf.function(experimental_relax_shapes=True)
     def train_share(self, s, visual_s, a, dc_r, old_log_prob, advantage):
         with tf.device(self.device):
+            a = self.action_one_hot(a)
             with tf.GradientTape() as tape:
                 if self.action_type == 'continuous':
                     mu, value = self.net(s, visual_s)
@@ -265,6 +239,7 @@ class PPO(Policy):
     @tf.function(experimental_relax_shapes=True)
     def train_actor(self, s, visual_s, a, old_log_prob, advantage):
         with tf.device(self.device):
+            a = self.action_one_hot(a)
             with tf.GradientTape() as tape:
                 if self.action_type == 'continuous':
                     mu = self.actor_net(s, visual_s)
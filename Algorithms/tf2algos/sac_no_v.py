@@ -2,8 +2,8 @@ import numpy as np
 import tensorflow as tf
 import tensorflow_probability as tfp
 import Nn
-from utils.sth import sth
 from .policy import Policy
+from .base import TargetSync
 
 
 class SAC_NO_V(Policy):
@@ -19,10 +19,16 @@ class SAC_NO_V(Policy):
                  buffer_size=10000,
                  use_priority=False,
                  n_step=False,
+                 fused_steps=1,
+                 xla=False,
+                 mixed_precision=False,
                  base_dir=None,
 
                  alpha=0.2,
                  ployak=0.995,
+                 assign_interval=1,
+                 ensemble_size=2,
+                 share_encoder=False,
                  discrete_tau=1.0,
                  log_std_bound=[-20, 2],
                  hidden_units={
@@ -53,31 +59,37 @@ class SAC_NO_V(Policy):
             batch_size=batch_size,
             buffer_size=buffer_size,
             use_priority=use_priority,
-            n_step=n_step)
+            n_step=n_step,
+            fused_steps=fused_steps,
+            xla=xla,
+            mixed_precision=mixed_precision)
         self.ployak = ployak
         self.discrete_tau = discrete_tau
+        self.q_hidden_units = hidden_units['q']
         self.log_std_min, self.log_std_max = log_std_bound[:]
         self.log_alpha = tf.math.log(alpha) if not auto_adaption else tf.Variable(initial_value=0.0, name='log_alpha', dtype=tf.float32, trainable=True)
         self.auto_adaption = auto_adaption
         if self.action_type == 'continuous':
-            self.actor_net = Nn.actor_continuous(self.s_dim, self.visual_dim, self.a_counts, 'actor_net', hidden_units['actor_continuous'])
+            self.actor_net = Nn.actor_continuous(self.s_dim, self.visual_dim, self.a_counts, 'actor_net', hidden_units['actor_continuous'], conv_dtype=self.conv_dtype)
         else:
-            self.actor_net = Nn.actor_discrete(self.s_dim, self.visual_dim, self.a_counts, 'actor_net', hidden_units['actor_discrete'])
+            self.actor_net = Nn.actor_discrete(self.s_dim, self.visual_dim, self.a_counts, 'actor_net', hidden_units['actor_discrete'], conv_dtype=self.conv_dtype)
             self.gumbel_dist = tfp.distributions.Gumbel(0, 1)
-        self.q1_net = Nn.critic_q_one(self.s_dim, self.visual_dim, self.a_counts, 'q1_net', hidden_units['q'])
-        self.q1_target_net = Nn.critic_q_one(self.s_dim, self.visual_dim, self.a_counts, 'q1_target_net', hidden_units['q'])
-        self.q2_net = Nn.critic_q_one(self.s_dim, self.visual_dim, self.a_counts, 'q2_net', hidden_units['q'])
-        self.q2_target_net = Nn.critic_q_one(self.s_dim, self.visual_dim, self.a_counts, 'q2_target_net', hidden_units['q'])
+        self.q_net = Nn.critic_q_one_ensemble(self.s_dim, self.visual_dim, self.a_counts, 'q_net', hidden_units['q'], ensemble_size, conv_dtype=self.conv_dtype, share_encoder=share_encoder)
+        self.q_target_net = Nn.critic_q_one_ensemble(self.s_dim, self.visual_dim, self.a_counts, 'q_target_net', hidden_units['q'], ensemble_size, conv_dtype=self.conv_dtype, share_encoder=share_encoder)
         self.update_target_net_weights(
-            self.q1_target_net.weights + self.q2_target_net.weights,
-            self.q1_net.weights + self.q2_net.weights
+            self.q_target_net.weights,
+            self.q_net.weights
         )
+        self.target_sync = TargetSync(
+            self.q_target_net.weights,
+            self.q_net.weights,
+            self.ployak, assign_interval)
         self.actor_lr = tf.keras.optimizers.schedules.PolynomialDecay(actor_lr, self.max_episode, 1e-10, power=1.0)
         self.critic_lr = tf.keras.optimizers.schedules.PolynomialDecay(critic_lr, self.max_episode, 1e-10, power=1.0)
         self.alpha_lr = tf.keras.optimizers.schedules.PolynomialDecay(alpha_lr, self.max_episode, 1e-10, power=1.0)
-        self.optimizer_critic = tf.keras.optimizers.Adam(learning_rate=self.critic_lr(self.episode))
-        self.optimizer_actor = tf.keras.optimizers.Adam(learning_rate=self.actor_lr(self.episode))
-        self.optimizer_alpha = tf.keras.optimizers.Adam(learning_rate=self.alpha_lr(self.episode))
+        self.optimizer_critic = self.init_optimizer(tf.keras.optimizers.Adam(learning_rate=self.critic_lr(self.episode)))
+        self.optimizer_actor = self.init_optimizer(tf.keras.optimizers.Adam(learning_rate=self.actor_lr(self.episode)))
+        self.optimizer_alpha = self.init_optimizer(tf.keras.optimizers.Adam(learning_rate=self.alpha_lr(self.episode)))
         self.generate_recorder(
             logger2file=logger2file,
             model=self
@@ -96,12 +108,10 @@ class SAC_NO_V(Policy):
         ''')
 
     def choose_action(self, s, visual_s):
-        a = self._get_action(s, visual_s)[-1].numpy()
-        return a if self.action_type == 'continuous' else sth.int2action_index(a, self.a_dim_or_list)
+        return self.call_action(self._get_action, s, visual_s)[-1]
 
     def choose_inference_action(self, s, visual_s):
-        a = self._get_action(s, visual_s)[0].numpy()
-        return a if self.action_type == 'continuous' else sth.int2action_index(a, self.a_dim_or_list)
+        return self.call_action(self._get_action, s, visual_s)[0]
 
     @tf.function
     def _get_action(self, vector_input, visual_input):
@@ -113,41 +123,43 @@ class SAC_NO_V(Policy):
                 mu = tf.tanh(mu) # squash mu
             else:
                 logits = self.actor_net(vector_input, visual_input)
-                mu = tf.argmax(logits, axis=1)
+                mu = self.action_index_decode(tf.argmax(logits, axis=1))
                 cate_dist = tfp.distributions.Categorical(logits)
-                pi = cate_dist.sample()
+                pi = self.action_index_decode(cate_dist.sample())
         return mu, pi
 
+    def init_or_restore(self, base_dir):
+        super().init_or_restore(base_dir)
+        self.restore_twin_critics(base_dir, {
+            self.q_net: ['q1_net', 'q2_net'],
+            self.q_target_net: ['q1_target_net', 'q2_target_net']
+        }, lambda name: Nn.critic_q_one(self.s_dim, self.visual_dim, self.a_counts, name, self.q_hidden_units, conv_dtype=self.conv_dtype))
+
     def store_data(self, s, visual_s, a, r, s_, visual_s_, done):
         self.off_store(s, visual_s, a, r[:, np.newaxis], s_, visual_s_, done[:, np.newaxis])
 
     def learn(self, **kwargs):
         self.episode = kwargs['episode']
-        for i in range(kwargs['step']):
-            if self.data.is_lg_batch_size:
-                s, visual_s, a, r, s_, visual_s_, done = self.data.sample()
-                if self.use_priority:
-                    self.IS_w = self.data.get_IS_w()
-                actor_loss, critic_loss, entropy, td_error = self.train(s, visual_s, a, r, s_, visual_s_, done)
-                if self.use_priority:
-                    self.data.update(td_error, self.episode)
-                self.update_target_net_weights(
-                    self.q1_target_net.weights + self.q2_target_net.weights,
-                    self.q1_net.weights + self.q2_net.weights,
-                    self.ployak)
-                tf.summary.experimental.set_step(self.global_step)
-                tf.summary.scalar('LOSS/actor_loss', actor_loss)
-                tf.summary.scalar('LOSS/critic_loss', critic_loss)
-                tf.summary.scalar('LOSS/alpha', tf.exp(self.log_alpha))
-                tf.summary.scalar('LOSS/entropy', entropy)
-                tf.summary.scalar('LEARNING_RATE/actor_lr', self.actor_lr(self.episode))
-                tf.summary.scalar('LEARNING_RATE/critic_lr', self.critic_lr(self.episode))
-                tf.summary.scalar('LEARNING_RATE/alpha_lr', self.alpha_lr(self.episode))
-                self.recorder.writer.flush()
+        return self.off_policy_learn(kwargs['step'], self._train_step, summaries={
+            'LEARNING_RATE/actor_lr': self.actor_lr(self.episode),
+            'LEARNING_RATE/critic_lr': self.critic_lr(self.episode),
+            'LEARNING_RATE/alpha_lr': self.alpha_lr(self.episode)
+        })
+
+    def _train_step(self, s, visual_s, a, r, s_, visual_s_, done):
+        actor_loss, critic_loss, entropy, td_error = self.train(s, visual_s, a, r, s_, visual_s_, done)
+        self.target_sync()
+        return td_error, {
+            'LOSS/actor_loss': actor_loss,
+            'LOSS/critic_loss': critic_loss,
+            'LOSS/alpha': tf.exp(self.log_alpha),
+            'LOSS/entropy': entropy
+        }
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, s, visual_s, a, r, s_, visual_s_, done):
         with tf.device(self.device):
+            a = self.action_one_hot(a)
             with tf.GradientTape() as tape:
                 if self.action_type == 'continuous':
                     target_mu, target_log_std = self.actor_net(s_, visual_s_)
@@ -159,20 +171,14 @@ class SAC_NO_V(Policy):
                     target_pi = target_cate_dist.sample()
                     target_log_pi = target_cate_dist.log_prob(target_pi)
                     target_pi = tf.one_hot(target_pi, self.a_counts, dtype=tf.float32)
-                q1 = self.q1_net(s, visual_s, a)
-                q1_target = self.q1_target_net(s_, visual_s_, target_pi)
-                q2 = self.q2_net(s, visual_s, a)
-                q2_target = self.q2_target_net(s_, visual_s_, target_pi)
-                dc_r_q1 = tf.stop_gradient(r + self.gamma * (1 - done) * (q1_target - tf.exp(self.log_alpha) * target_log_pi))
-                dc_r_q2 = tf.stop_gradient(r + self.gamma * (1 - done) * (q2_target - tf.exp(self.log_alpha) * target_log_pi))
-                td_error1 = q1 - dc_r_q1
-                td_error2 = q2 - dc_r_q2
-                q1_loss = tf.reduce_mean(tf.square(td_error1) * self.IS_w)
-                q2_loss = tf.reduce_mean(tf.square(td_error2) * self.IS_w)
-                critic_loss = 0.5 * q1_loss + 0.5 * q2_loss
-            critic_grads = tape.gradient(critic_loss, self.q1_net.trainable_variables + self.q2_net.trainable_variables)
+                q = self.q_net(s, visual_s, a)
+                q_target = self.q_target_net(s_, visual_s_, target_pi)
+                dc_r = tf.stop_gradient(r + self.gamma * (1 - done) * (q_target - tf.exp(self.log_alpha) * target_log_pi))   # every head has its own target
+                td_error = q - dc_r
+                critic_loss = 0.5 * tf.reduce_sum(tf.reduce_mean(tf.square(td_error) * self.IS_w, axis=[1, 2]))
+            critic_grads = self.gradient(tape, self.optimizer_critic, critic_loss, self.q_net.trainable_variables)
             self.optimizer_critic.apply_gradients(
-                zip(critic_grads, self.q1_net.trainable_variables + self.q2_net.trainable_variables)
+                zip(critic_grads, self.q_net.trainable_variables)
             )
 
             with tf.GradientTape() as tape:
@@ -191,10 +197,9 @@ class SAC_NO_V(Policy):
                     pi = _pi_diff + _pi
                     log_pi = tf.reduce_sum(tf.multiply(logp_all, pi), axis=1, keepdims=True)
                     entropy = -tf.reduce_mean(tf.reduce_sum(tf.exp(logp_all) * logp_all, axis=1, keepdims=True))
-                q1_s_pi = self.q1_net(s, visual_s, pi)
-                q2_s_pi = self.q2_net(s, visual_s, pi)
-                actor_loss = -tf.reduce_mean(tf.minimum(q1_s_pi, q2_s_pi) - tf.exp(self.log_alpha) * log_pi)
-            actor_grads = tape.gradient(actor_loss, self.actor_net.trainable_variables)
+                q_s_pi = self.q_net.min_q(self.q_net(s, visual_s, pi))
+                actor_loss = -tf.reduce_mean(q_s_pi - tf.exp(self.log_alpha) * log_pi)
+            actor_grads = self.gradient(tape, self.optimizer_actor, actor_loss, self.actor_net.trainable_variables)
             self.optimizer_actor.apply_gradients(
                 zip(actor_grads, self.actor_net.trainable_variables)
             )
@@ -211,16 +216,17 @@ class SAC_NO_V(Policy):
                         pi = cate_dist.sample()
                         log_pi = cate_dist.log_prob(pi)
                     alpha_loss = -tf.reduce_mean(self.log_alpha * tf.stop_gradient(log_pi - self.a_counts))
-                alpha_grads = tape.gradient(alpha_loss, [self.log_alpha])
+                alpha_grads = self.gradient(tape, self.optimizer_alpha, alpha_loss, [self.log_alpha])
                 self.optimizer_alpha.apply_gradients(
                     zip(alpha_grads, [self.log_alpha])
                 )
             self.global_step.assign_add(1)
-            return actor_loss, critic_loss, entropy, td_error1 + td_error2 / 2
+            return actor_loss, critic_loss, entropy, tf.reduce_mean(td_error, axis=0)
 
     @tf.function(experimental_relax_shapes=True)
     def train_persistent(self, s, visual_s, a, r, s_, visual_s_, done):
         with tf.device(self.device):
+            a = self.action_one_hot(a)
             with tf.GradientTape(persistent=True) as tape:
                 if self.action_type == 'continuous':
                     mu, log_std = self.actor_net(s, visual_s)
@@ -246,34 +252,27 @@ class SAC_NO_V(Policy):
                     target_pi = target_cate_dist.sample()
                     target_pi = tf.one_hot(target_pi, self.a_counts, dtype=tf.float32)
                     target_log_pi = target_cate_dist.log_prob(target_pi)
-                q1 = self.q1_net(s, visual_s, a)
-                q1_target = self.q1_target_net(s_, visual_s_, target_pi)
-                q2 = self.q2_net(s, visual_s, a)
-                q2_target = self.q2_target_net(s_, visual_s_, target_pi)
-                q1_s_pi = self.q1_net(s, visual_s, pi)
-                q2_s_pi = self.q2_net(s, visual_s, pi)
-                dc_r_q1 = tf.stop_gradient(r + self.gamma * (1 - done) * (q1_target - tf.exp(self.log_alpha) * target_log_pi))
-                dc_r_q2 = tf.stop_gradient(r + self.gamma * (1 - done) * (q2_target - tf.exp(self.log_alpha) * target_log_pi))
-                td_error1 = q1 - dc_r_q1
-                td_error2 = q2 - dc_r_q2
-                q1_loss = tf.reduce_mean(tf.square(td_error1) * self.IS_w)
-                q2_loss = tf.reduce_mean(tf.square(td_error2) * self.IS_w)
-                critic_loss = 0.5 * q1_loss + 0.5 * q2_loss
-                actor_loss = -tf.reduce_mean(tf.minimum(q1_s_pi, q2_s_pi) - tf.exp(self.log_alpha) * log_pi)
+                q = self.q_net(s, visual_s, a)
+                q_target = self.q_target_net(s_, visual_s_, target_pi)
+                q_s_pi = self.q_net.min_q(self.q_net(s, visual_s, pi))
+                dc_r = tf.stop_gradient(r + self.gamma * (1 - done) * (q_target - tf.exp(self.log_alpha) * target_log_pi))
+                td_error = q - dc_r
+                critic_loss = 0.5 * tf.reduce_sum(tf.reduce_mean(tf.square(td_error) * self.IS_w, axis=[1, 2]))
+                actor_loss = -tf.reduce_mean(q_s_pi - tf.exp(self.log_alpha) * log_pi)
                 if self.auto_adaption:
                     alpha_loss = -tf.reduce_mean(self.log_alpha * tf.stop_gradient(log_pi - self.a_counts))
-            critic_grads = tape.gradient(critic_loss, self.q1_net.trainable_variables + self.q2_net.trainable_variables)
+            critic_grads = self.gradient(tape, self.optimizer_critic, critic_loss, self.q_net.trainable_variables)
             self.optimizer_critic.apply_gradients(
-                zip(critic_grads, self.q1_net.trainable_variables + self.q2_net.trainable_variables)
+                zip(critic_grads, self.q_net.trainable_variables)
             )
-            actor_grads = tape.gradient(actor_loss, self.actor_net.trainable_variables)
+            actor_grads = self.gradient(tape, self.optimizer_actor, actor_loss, self.actor_net.trainable_variables)
             self.optimizer_actor.apply_gradients(
                 zip(actor_grads, self.actor_net.trainable_variables)
             )
             if self.auto_adaption:
-                alpha_grads = tape.gradient(alpha_loss, [self.log_alpha])
+                alpha_grads = self.gradient(tape, self.optimizer_alpha, alpha_loss, [self.log_alpha])
                 self.optimizer_alpha.apply_gradients(
                     zip(alpha_grads, [self.log_alpha])
                 )
             self.global_step.assign_add(1)
-            return actor_loss, critic_loss, entropy, td_error1 + td_error2 / 2
+            return actor_loss, critic_loss, entropy, tf.reduce_mean(td_error, axis=0)
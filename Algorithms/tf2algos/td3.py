@@ -2,8 +2,8 @@ import numpy as np
 import tensorflow as tf
 import tensorflow_probability as tfp
 import Nn
-from utils.sth import sth
 from .policy import Policy
+from .base import TargetSync
 
 
 class TD3(Policy):
@@ -19,9 +19,16 @@ class TD3(Policy):
                  buffer_size=10000,
                  use_priority=False,
                  n_step=False,
+                 fused_steps=1,
+                 xla=False,
+                 mixed_precision=False,
                  base_dir=None,
 
                  ployak=0.995,
+                 assign_interval=1,
+                 ensemble_size=2,
+                 share_encoder=False,
+                 target_heads=2,
                  actor_lr=5.0e-4,
                  critic_lr=1.0e-3,
                  discrete_tau=1.0,
@@ -45,30 +52,37 @@ class TD3(Policy):
             batch_size=batch_size,
             buffer_size=buffer_size,
             use_priority=use_priority,
-            n_step=n_step)
+            n_step=n_step,
+            fused_steps=fused_steps,
+            xla=xla,
+            mixed_precision=mixed_precision)
         self.ployak = ployak
         self.discrete_tau = discrete_tau
+        self.target_heads = target_heads  # the target is the minimum of this many random heads of the critic ensemble
+        self.q_hidden_units = hidden_units['q']
         if self.action_type == 'continuous':
-            self.actor_net = Nn.actor_dpg(self.s_dim, self.visual_dim, self.a_counts, 'actor_net', hidden_units['actor_continuous'])
-            self.actor_target_net = Nn.actor_dpg(self.s_dim, self.visual_dim, self.a_counts, 'actor_target_net', hidden_units['actor_continuous'])
+            self.actor_net = Nn.actor_dpg(self.s_dim, self.visual_dim, self.a_counts, 'actor_net', hidden_units['actor_continuous'], conv_dtype=self.conv_dtype)
+            self.actor_target_net = Nn.actor_dpg(self.s_dim, self.visual_dim, self.a_counts, 'actor_target_net', hidden_units['actor_continuous'], conv_dtype=self.conv_dtype)
             # self.action_noise = Nn.NormalActionNoise(mu=np.zeros(self.a_counts), sigma=1 * np.ones(self.a_counts))
             self.action_noise = Nn.OrnsteinUhlenbeckActionNoise(mu=np.zeros(self.a_counts), sigma=0.2 * np.exp(-self.episode / 10) * np.ones(self.a_counts))
         else:
-            self.actor_net = Nn.actor_discrete(self.s_dim, self.visual_dim, self.a_counts, 'actor_net', hidden_units['actor_discrete'])
-            self.actor_target_net = Nn.actor_discrete(self.s_dim, self.visual_dim, self.a_counts, 'actor_target_net', hidden_units['actor_discrete'])
+            self.actor_net = Nn.actor_discrete(self.s_dim, self.visual_dim, self.a_counts, 'actor_net', hidden_units['actor_discrete'], conv_dtype=self.conv_dtype)
+            self.actor_target_net = Nn.actor_discrete(self.s_dim, self.visual_dim, self.a_counts, 'actor_target_net', hidden_units['actor_discrete'], conv_dtype=self.conv_dtype)
             self.gumbel_dist = tfp.distributions.Gumbel(0, 1)
-        self.q1_net = Nn.critic_q_one(self.s_dim, self.visual_dim, self.a_counts, 'q1_net', hidden_units['q'])
-        self.q1_target_net = Nn.critic_q_one(self.s_dim, self.visual_dim, self.a_counts, 'q1_target_net', hidden_units['q'])
-        self.q2_net = Nn.critic_q_one(self.s_dim, self.visual_dim, self.a_counts, 'q2_net', hidden_units['q'])
-        self.q2_target_net = Nn.critic_q_one(self.s_dim, self.visual_dim, self.a_counts, 'q2_target_net', hidden_units['q'])
+        self.q_net = Nn.critic_q_one_ensemble(self.s_dim, self.visual_dim, self.a_counts, 'q_net', hidden_units['q'], ensemble_size, conv_dtype=self.conv_dtype, share_encoder=share_encoder)
+        self.q_target_net = Nn.critic_q_one_ensemble(self.s_dim, self.visual_dim, self.a_counts, 'q_target_net', hidden_units['q'], ensemble_size, conv_dtype=self.conv_dtype, share_encoder=share_encoder)
         self.update_target_net_weights(
-            self.actor_target_net.weights + self.q1_target_net.weights + self.q2_target_net.weights,
-            self.actor_net.weights + self.q1_net.weights + self.q2_net.weights
+            self.actor_target_net.weights + self.q_target_net.weights,
+            self.actor_net.weights + self.q_net.weights
         )
+        self.target_sync = TargetSync(
+            self.actor_target_net.weights + self.q_target_net.weights,
+            self.actor_net.weights + self.q_net.weights,
+            self.ployak, assign_interval)
         self.actor_lr = tf.keras.optimizers.schedules.PolynomialDecay(actor_lr, self.max_episode, 1e-10, power=1.0)
         self.critic_lr = tf.keras.optimizers.schedules.PolynomialDecay(critic_lr, self.max_episode, 1e-10, power=1.0)
-        self.optimizer_critic = tf.keras.optimizers.Adam(learning_rate=self.critic_lr(self.episode))
-        self.optimizer_actor = tf.keras.optimizers.Adam(learning_rate=self.actor_lr(self.episode))
+        self.optimizer_critic = self.init_optimizer(tf.keras.optimizers.Adam(learning_rate=self.critic_lr(self.episode)))
+        self.optimizer_actor = self.init_optimizer(tf.keras.optimizers.Adam(learning_rate=self.actor_lr(self.episode)))
         self.generate_recorder(
             logger2file=logger2file,
             model=self
@@ -86,12 +100,10 @@ class TD3(Policy):
         ''')
 
     def choose_action(self, s, visual_s):
-        a = self._get_action(s, visual_s)[-1].numpy()
-        return a if self.action_type == 'continuous' else sth.int2action_index(a, self.a_dim_or_list)
+        return self.call_action(self._get_action, s, visual_s)[-1]
 
     def choose_inference_action(self, s, visual_s):
-        a = self._get_action(s, visual_s)[0].numpy()
-        return a if self.action_type == 'continuous' else sth.int2action_index(a, self.a_dim_or_list)
+        return self.call_action(self._get_action, s, visual_s)[0]
 
     @tf.function
     def _get_action(self, vector_input, visual_input):
@@ -101,38 +113,40 @@ class TD3(Policy):
                 pi = tf.clip_by_value(mu + self.action_noise(), -1, 1)
             else:
                 logits = self.actor_net(vector_input, visual_input)
-                mu = tf.argmax(logits, axis=1)
+                mu = self.action_index_decode(tf.argmax(logits, axis=1))
                 cate_dist = tfp.distributions.Categorical(logits)
-                pi = cate_dist.sample()
+                pi = self.action_index_decode(cate_dist.sample())
         return mu, pi
 
+    def init_or_restore(self, base_dir):
+        super().init_or_restore(base_dir)
+        self.restore_twin_critics(base_dir, {
+            self.q_net: ['q1_net', 'q2_net'],
+            self.q_target_net: ['q1_target_net', 'q2_target_net']
+        }, lambda name: Nn.critic_q_one(self.s_dim, self.visual_dim, self.a_counts, name, self.q_hidden_units, conv_dtype=self.conv_dtype))
+
     def store_data(self, s, visual_s, a, r, s_, visual_s_, done):
         self.off_store(s, visual_s, a, r[:, np.newaxis], s_, visual_s_, done[:, np.newaxis])
 
     def learn(self, **kwargs):
         self.episode = kwargs['episode']
-        for i in range(kwargs['step']):
-            if self.data.is_lg_batch_size:
-                s, visual_s, a, r, s_, visual_s_, done = self.data.sample()
-                if self.use_priority:
-                    self.IS_w = self.data.get_IS_w()
-                actor_loss, critic_loss, td_error = self.train(s, visual_s, a, r, s_, visual_s_, done)
-                if self.use_priority:
-                    self.data.update(td_error, self.episode)
-                self.update_target_net_weights(
-                    self.actor_target_net.weights + self.q1_target_net.weights + self.q2_target_net.weights,
-                    self.actor_net.weights + self.q1_net.weights + self.q2_net.weights,
-                    self.ployak)
-                tf.summary.experimental.set_step(self.global_step)
-                tf.summary.scalar('LOSS/actor_loss', actor_loss)
-                tf.summary.scalar('LOSS/critic_loss', critic_loss)
-                tf.summary.scalar('LEARNING_RATE/actor_lr', self.actor_lr(self.episode))
-                tf.summary.scalar('LEARNING_RATE/critic_lr', self.critic_lr(self.episode))
-                self.recorder.writer.flush()
+        return self.off_policy_learn(kwargs['step'], self._train_step, summaries={
+            'LEARNING_RATE/actor_lr': self.actor_lr(self.episode),
+            'LEARNING_RATE/critic_lr': self.critic_lr(self.episode)
+        })
+
+    def _train_step(self, s, visual_s, a, r, s_, visual_s_, done):
+        actor_loss, critic_loss, td_error = self.train(s, visual_s, a, r, s_, visual_s_, done)
+        self.target_sync()
+        return td_error, {
+            'LOSS/actor_loss': actor_loss,
+            'LOSS/critic_loss': critic_loss
+        }
 
     @tf.function(experimental_relax_shapes=True)
     def train(self, s, visual_s, a, r, s_, visual_s_, done):
         with tf.device(self.device):
+            a = self.action_one_hot(a)
             for _ in range(2):
                 with tf.GradientTape() as tape:
                     if self.action_type == 'continuous':
@@ -143,20 +157,14 @@ class TD3(Policy):
                         target_cate_dist = tfp.distributions.Categorical(target_logits)
                         target_pi = target_cate_dist.sample()
                         action_target = tf.one_hot(target_pi, self.a_counts, dtype=tf.float32)
-                    q1 = self.q1_net(s, visual_s, a)
-                    q1_target = self.q1_target_net(s_, visual_s_, action_target)
-                    q2 = self.q2_net(s, visual_s, a)
-                    q2_target = self.q2_target_net(s_, visual_s_, action_target)
-                    q_target = tf.minimum(q1_target, q2_target)
+                    q = self.q_net(s, visual_s, a)
+                    q_target = self.q_target_net.random_min_q(self.q_target_net(s_, visual_s_, action_target), self.target_heads)
                     dc_r = tf.stop_gradient(r + self.gamma * q_target * (1 - done))
-                    td_error1 = q1 - dc_r
-                    td_error2 = q2 - dc_r
-                    q1_loss = tf.reduce_mean(tf.square(td_error1) * self.IS_w)
-                    q2_loss = tf.reduce_mean(tf.square(td_error2) * self.IS_w)
-                    critic_loss = 0.5 * (q1_loss + q2_loss)
-                critic_grads = tape.gradient(critic_loss, self.q1_net.trainable_variables + self.q2_net.trainable_variables)
+                    td_error = q - dc_r
+                    critic_loss = 0.5 * tf.reduce_sum(tf.reduce_mean(tf.square(td_error) * self.IS_w, axis=[1, 2]))
+                critic_grads = self.gradient(tape, self.optimizer_critic, critic_loss, self.q_net.trainable_variables)
                 self.optimizer_critic.apply_gradients(
-                    zip(critic_grads, self.q1_net.trainable_variables + self.q2_net.trainable_variables)
+                    zip(critic_grads, self.q_net.trainable_variables)
                 )
             with tf.GradientTape() as tape:
                 if self.action_type == 'continuous':
@@ -170,18 +178,19 @@ class TD3(Policy):
                     _pi_true_one_hot = tf.one_hot(tf.argmax(_pi, axis=-1), self.a_counts)
                     _pi_diff = tf.stop_gradient(_pi_true_one_hot - _pi)
                     pi = _pi_diff + _pi
-                q1_actor = self.q1_net(s, visual_s, pi)
+                q1_actor = self.q_net(s, visual_s, pi)[0]
                 actor_loss = -tf.reduce_mean(q1_actor)
-            actor_grads = tape.gradient(actor_loss, self.actor_net.trainable_variables)
+            actor_grads = self.gradient(tape, self.optimizer_actor, actor_loss, self.actor_net.trainable_variables)
             self.optimizer_actor.apply_gradients(
                 zip(actor_grads, self.actor_net.trainable_variables)
             )
             self.global_step.assign_add(1)
-            return actor_loss, critic_loss, td_error1 + td_error2 / 2
+            return actor_loss, critic_loss, tf.reduce_mean(td_error, axis=0)
 
     @tf.function(experimental_relax_shapes=True)
     def train_persistent(self, s, visual_s, a, r, s_, visual_s_, done):
         with tf.device(self.device):
+            a = self.action_one_hot(a)
             for _ in range(2):
                 with tf.GradientTape(persistent=True) as tape:
                     if self.action_type == 'continuous':
@@ -201,26 +210,20 @@ class TD3(Policy):
                         _pi_true_one_hot = tf.one_hot(tf.argmax(_pi, axis=-1), self.a_counts)
                         _pi_diff = tf.stop_gradient(_pi_true_one_hot - _pi)
                         pi = _pi_diff + _pi
-                    q1 = self.q1_net(s, visual_s, a)
-                    q1_target = self.q1_target_net(s_, visual_s_, action_target)
-                    q2 = self.q2_net(s, visual_s, a)
-                    q2_target = self.q2_target_net(s_, visual_s_, action_target)
-                    q1_actor = self.q1_net(s, visual_s, pi)
-                    q_target = tf.minimum(q1_target, q2_target)
+                    q = self.q_net(s, visual_s, a)
+                    q_target = self.q_target_net.random_min_q(self.q_target_net(s_, visual_s_, action_target), self.target_heads)
+                    q1_actor = self.q_net(s, visual_s, pi)[0]
                     dc_r = tf.stop_gradient(r + self.gamma * q_target * (1 - done))
-                    td_error1 = q1 - dc_r
-                    td_error2 = q2 - dc_r
-                    q1_loss = tf.reduce_mean(tf.square(td_error1) * self.IS_w)
-                    q2_loss = tf.reduce_mean(tf.square(td_error2) * self.IS_w)
-                    critic_loss = 0.5 * (q1_loss + q2_loss)
+                    td_error = q - dc_r
+                    critic_loss = 0.5 * tf.reduce_sum(tf.reduce_mean(tf.square(td_error) * self.IS_w, axis=[1, 2]))
                     actor_loss = -tf.reduce_mean(q1_actor)
-                critic_grads = tape.gradient(critic_loss, self.q1_net.trainable_variables + self.q2_net.trainable_variables)
+                critic_grads = self.gradient(tape, self.optimizer_critic, critic_loss, self.q_net.trainable_variables)
                 self.optimizer_critic.apply_gradients(
-                    zip(critic_grads, self.q1_net.trainable_variables + self.q2_net.trainable_variables)
+                    zip(critic_grads, self.q_net.trainable_variables)
                 )
-            actor_grads = tape.gradient(actor_loss, self.actor_net.trainable_variables)
+            actor_grads = self.gradient(tape, self.optimizer_actor, actor_loss, self.actor_net.trainable_variables)
             self.optimizer_actor.apply_gradients(
                 zip(actor_grads, self.actor_net.trainable_variables)
             )
             self.global_step.assign_add(1)
-            return actor_loss, critic_loss, td_error1 + td_error2 / 2
+            return actor_loss, critic_loss, tf.reduce_mean(td_error, axis=0)
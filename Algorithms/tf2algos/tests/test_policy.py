@@ -0,0 +1,104 @@
+import time
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+if not tf.__version__.startswith('2'):
+    pytest.skip('tf2algos need TensorFlow 2.x', allow_module_level=True)
+
+from Algorithms.tf2algos.dqn import DQN  # noqa: E402
+from Algorithms.tf2algos.sac import SAC  # noqa: E402
+import Nn  # noqa: E402
+from utils.learner import AsyncLearner  # noqa: E402
+
+
+def test_action_functions_are_traced_once(tmpdir):
+    model = DQN(s_dim=4, visual_sources=0, visual_resolution=[], a_dim_or_list=[2, 3], action_type='discrete',
+                base_dir=str(tmpdir) + '/', epsilon=0.)
+    for n in [1, 3, 7, 2]:
+        a = model.choose_action(np.random.rand(n, 4), np.zeros((n, 0)))
+        assert a.shape == (n, 2)
+    model.choose_inference_action(np.random.rand(5, 4), np.zeros((5, 0)))
+    assert model.trace_counts == {'_get_action': 1}
+    model.close()
+
+
+def test_visual_action_functions_are_traced_once(tmpdir):
+    model = SAC(s_dim=4, visual_sources=1, visual_resolution=[84, 84, 3], a_dim_or_list=[2], action_type='continuous',
+                base_dir=str(tmpdir) + '/')
+    for n in [1, 3, 2]:
+        visual_s = np.random.randint(0, 256, (n, 1, 84, 84, 3), dtype=np.uint8)
+        a = model.choose_action(np.random.rand(n, 4), visual_s)
+        assert a.shape == (n, 2)
+    assert model.trace_counts == {'_get_action': 1}
+    model.close()
+
+
+@pytest.mark.parametrize('share_encoder', [False, True])
+def test_twin_critics_load_into_visual_ensemble(share_encoder):
+    visual_dim = [1, 84, 84, 3]
+    nets = [Nn.critic_q_one(4, visual_dim, 2, f'q{i}_net', [16]) for i in range(2)]
+    ensemble = Nn.critic_q_one_ensemble(4, visual_dim, 2, 'q_net', [16], k=2, share_encoder=share_encoder)
+    s, a = np.random.rand(3, 4).astype(np.float32), np.random.rand(3, 2).astype(np.float32)
+    visual_s = np.random.randint(0, 256, (3, *visual_dim), dtype=np.uint8)
+    if share_encoder:
+        with pytest.raises(ValueError):
+            ensemble.load_heads(nets)
+        for name in ['conv1', 'conv2', 'conv3', 'fc']:
+            for t, w in zip(getattr(nets[1], name).weights, getattr(nets[0], name).weights):
+                t.assign(w)
+    else:
+        assert len(ensemble.encoders) == 2
+    ensemble.load_heads(nets)
+    q = ensemble(s, visual_s, a).numpy()
+    for i, net in enumerate(nets):
+        np.testing.assert_allclose(q[i], net(s, visual_s, a).numpy(), rtol=1e-5, atol=1e-5)
+
+
+def _fill(model, n):
+    s = np.random.rand(n, 4).astype(np.float32)
+    model.store_data(s=s, visual_s=np.zeros((n, 0)), a=model.random_action(n), r=np.random.rand(n), s_=s,
+                     visual_s_=np.zeros((n, 0)), done=np.zeros(n))
+
+
+def _wait_until(condition, timeout=30):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+
+
+def test_async_learner_counts_updates_and_syncs_the_actor(tmpdir):
+    model = DQN(s_dim=4, visual_sources=0, visual_resolution=[], a_dim_or_list=[3], action_type='discrete',
+                base_dir=str(tmpdir) + '/', epsilon=0., batch_size=8, buffer_size=64)
+    learner = AsyncLearner(model, update_ratio=1., chunk_steps=5, sync_interval=5)
+    learner.start()
+    model.choose_inference_action(np.random.rand(6, 4), np.zeros((6, 0)))
+    learner.add_steps(4)     # nothing to sample from yet
+    _wait_until(lambda: learner.pending == 0)
+    _fill(model, 16)
+    learner.add_steps(10)
+    _wait_until(lambda: learner.pending == 0)
+    learner.stop()
+    assert learner.updates == 10 and learner.skipped == 4
+    assert model.trace_counts == {'_get_action': 1}
+    for copy, source in zip(model._actor_view.q_net.weights, model.q_net.weights):
+        assert copy is not source and np.array_equal(copy.numpy(), source.numpy())
+    model.close()
+
+
+def test_async_learner_reraises_errors(tmpdir):
+    model = DQN(s_dim=4, visual_sources=0, visual_resolution=[], a_dim_or_list=[3], action_type='discrete',
+                base_dir=str(tmpdir) + '/', batch_size=8, buffer_size=64)
+
+    def learn(**kwargs):
+        raise ValueError('broken update')
+    model.learn = learn
+    learner = AsyncLearner(model)
+    learner.start()
+    learner.add_steps(1)
+    learner.join(30)
+    with pytest.raises(RuntimeError) as e:
+        learner.add_steps(1)
+    assert isinstance(e.value.__cause__, ValueError)
+    learner.stop()
+    model.close()
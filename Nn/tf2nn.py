@@ -1,3 +1,5 @@
+import functools
+import numpy as np
 import tensorflow as tf
 from .activations import swish, mish
 from tensorflow.keras import Sequential
@@ -28,6 +30,45 @@ class mlp(Sequential):
             self.add(Dense(output_shape, out_activation))
 
 
+class EnsembleDense(tf.keras.layers.Layer):
+    '''
+    k independent Dense layers whose kernels are stacked into [k, in, units], all of them run in one batched matmul.
+    input: [batch, in] shared by all members, or [k, batch, in]
+    output: [k, batch, units]
+    '''
+
+    def __init__(self, k, units, activation=None, **kwargs):
+        super().__init__(**kwargs)
+        self.k = k
+        self.units = units
+        self.activation = tf.keras.activations.get(activation)
+
+    def build(self, input_shape):
+        last_dim = tensor_shape.dimension_value(input_shape[-1])
+        limit = (6. / (last_dim + self.units)) ** 0.5    # glorot uniform of every member, like Dense
+        self.kernel = self.add_weight('kernel', shape=[self.k, last_dim, self.units], initializer=tf.random_uniform_initializer(-limit, limit), dtype=self.dtype, trainable=True)
+        self.bias = self.add_weight('bias', shape=[self.k, 1, self.units], initializer=tf.zeros_initializer(), dtype=self.dtype, trainable=True)
+        super().build(input_shape)
+
+    def call(self, inputs):
+        if inputs.shape.rank == 2:
+            outputs = tf.einsum('bi,kio->kbo', inputs, self.kernel)
+        else:
+            outputs = tf.matmul(inputs, self.kernel)
+        return self.activation(outputs + self.bias)
+
+
+class ensemble_mlp(Sequential):
+    def __init__(self, k, hidden_units, act_fn=activation_fn, output_shape=1, out_activation=None):
+        """
+        k mlps with the same layout as mlp(hidden_units, act_fn, output_shape, out_activation), evaluated together.
+        """
+        super().__init__()
+        for u in hidden_units:
+            self.add(EnsembleDense(k, u, act_fn))
+        self.add(EnsembleDense(k, output_shape, out_activation))
+
+
 class Noisy(Dense):
     def __init__(self, units, activation=None, **kwargs):
         super().__init__(units, activation=None, **kwargs)
@@ -70,27 +111,70 @@ class Noisy(Dense):
 
 
 class ImageNet(tf.keras.Model):
-    def __init__(self, name, visual_dim=[]):
+    '''
+    visual_dim: [cameras, H, W, C], or [cameras, frame_stack, H, W, C] for frame-stacked inputs.
+    visual input may be raw uint8 pixels, the cast to float, scaling to [0, 1] and folding of stacked frames into
+    channels are the first ops of the graph, so only uint8 frames are moved from the host.
+    conv_dtype is the dtype policy of the encoder, 'mixed_float16' computes it in float16 and returns float32 features.
+    '''
+
+    def __init__(self, name, visual_dim=[], conv_dtype='float32'):
         super().__init__(name=name)
-        if len(visual_dim) == 5:
-            self.conv1 = Conv3D(filters=32, kernel_size=[1, 8, 8], strides=[1, 4, 4], padding='valid', activation=activation_fn)
-            self.conv2 = Conv3D(filters=64, kernel_size=[1, 4, 4], strides=[1, 2, 2], padding='valid', activation=activation_fn)
-            self.conv3 = Conv3D(filters=64, kernel_size=[1, 3, 3], strides=[1, 1, 1], padding='valid', activation=activation_fn)
-            self.flatten = Flatten()
-            self.fc = Dense(128, activation_fn)
+        if len(visual_dim) in [4, 5]:
+            self.conv1 = Conv3D(filters=32, kernel_size=[1, 8, 8], strides=[1, 4, 4], padding='valid', activation=activation_fn, dtype=conv_dtype)
+            self.conv2 = Conv3D(filters=64, kernel_size=[1, 4, 4], strides=[1, 2, 2], padding='valid', activation=activation_fn, dtype=conv_dtype)
+            self.conv3 = Conv3D(filters=64, kernel_size=[1, 3, 3], strides=[1, 1, 1], padding='valid', activation=activation_fn, dtype=conv_dtype)
+            self.flatten = Flatten(dtype=conv_dtype)
+            self.fc = Dense(128, activation_fn, dtype=conv_dtype)
+
+    def __init_subclass__(cls, **kwargs):
+        '''
+        networks remember the arguments they are built with, so that clone can build another one with the same layout.
+        '''
+        super().__init_subclass__(**kwargs)
+        init = cls.__init__
+
+        @functools.wraps(init)
+        def __init__(self, *args, **kw):
+            init(self, *args, **kw)
+            object.__setattr__(self, '_init_args', (args, kw))   # not tracked by keras, so not saved in checkpoints
+        cls.__init__ = __init__
+
+    def clone(self):
+        '''
+        build a network with the layout of this one and copy its weights into it.
+        '''
+        args, kwargs = self._init_args
+        net = type(self)(*args, **kwargs)
+        for t, s in zip(net.weights, self.weights):
+            t.assign(s)
+        return net
 
     def call(self, vector_input, visual_input):
-        if visual_input is None or len(visual_input.shape) != 5:
+        if visual_input is None or len(visual_input.shape) not in [5, 6]:
             pass
         else:
+            if visual_input.dtype == tf.uint8:
+                visual_input = tf.cast(visual_input, tf.float32) / 255.    # raw frames are normalized on device
+            if len(visual_input.shape) == 6:
+                visual_input = self.stack_frames(visual_input)
             features = self.conv1(visual_input)
             features = self.conv2(features)
             features = self.conv3(features)
             features = self.flatten(features)
-            features = self.fc(features)
+            features = tf.cast(self.fc(features), tf.float32)
             vector_input = tf.concat((features, vector_input), axis=-1)
         return vector_input
 
+    @staticmethod
+    def stack_frames(visual_input):
+        '''
+        [B, cameras, frame_stack, H, W, C] => [B, cameras, H, W, frame_stack * C]
+        '''
+        shape = visual_input.shape
+        visual_input = tf.transpose(visual_input, [0, 1, 3, 4, 2, 5])
+        return tf.reshape(visual_input, [-1, shape[1], shape[3], shape[4], shape[2] * shape[5]])
+
 
 class actor_dpg(ImageNet):
     '''
@@ -99,8 +183,8 @@ class actor_dpg(ImageNet):
     output: deterministic action(mu) and disturbed action(action) given a state
     '''
 
-    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units):
-        super().__init__(name=name, visual_dim=visual_dim)
+    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units, conv_dtype='float32'):
+        super().__init__(name=name, visual_dim=visual_dim, conv_dtype=conv_dtype)
         self.net = mlp(hidden_units, output_shape=output_shape, out_activation=tf.keras.activations.tanh)
         self(tf.keras.Input(shape=vector_dim), tf.keras.Input(shape=visual_dim))
 
@@ -116,8 +200,8 @@ class actor_mu(ImageNet):
     output: stochastic action(mu), normally is the mean of a Normal distribution
     '''
 
-    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units):
-        super().__init__(name=name, visual_dim=visual_dim)
+    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units, conv_dtype='float32'):
+        super().__init__(name=name, visual_dim=visual_dim, conv_dtype=conv_dtype)
         self.net = mlp(hidden_units, output_shape=output_shape, out_activation=None)
         self(tf.keras.Input(shape=vector_dim), tf.keras.Input(shape=visual_dim))
 
@@ -133,8 +217,8 @@ class actor_continuous(ImageNet):
     output: mean(mu) and log_variance(log_std) of Gaussian Distribution of actions given a state
     '''
 
-    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units):
-        super().__init__(name=name, visual_dim=visual_dim)
+    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units, conv_dtype='float32'):
+        super().__init__(name=name, visual_dim=visual_dim, conv_dtype=conv_dtype)
         self.share = mlp(hidden_units['share'], out_layer=False)
         self.mu = mlp(hidden_units['mu'], output_shape=output_shape, out_activation=None)
         self.log_std = mlp(hidden_units['log_std'], output_shape=output_shape, out_activation=tf.keras.activations.tanh)
@@ -154,8 +238,8 @@ class actor_discrete(ImageNet):
     output: probability distribution of actions given a state
     '''
 
-    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units):
-        super().__init__(name=name, visual_dim=visual_dim)
+    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units, conv_dtype='float32'):
+        super().__init__(name=name, visual_dim=visual_dim, conv_dtype=conv_dtype)
         self.logits = mlp(hidden_units, output_shape=output_shape, out_activation=None)
         self(tf.keras.Input(shape=vector_dim), tf.keras.Input(shape=visual_dim))
 
@@ -171,8 +255,8 @@ class critic_q_one(ImageNet):
     output: q(s,a)
     '''
 
-    def __init__(self, vector_dim, visual_dim, action_dim, name, hidden_units):
-        super().__init__(name=name, visual_dim=visual_dim)
+    def __init__(self, vector_dim, visual_dim, action_dim, name, hidden_units, conv_dtype='float32'):
+        super().__init__(name=name, visual_dim=visual_dim, conv_dtype=conv_dtype)
         self.net = mlp(hidden_units, output_shape=1, out_activation=None)
         self(tf.keras.Input(shape=vector_dim), tf.keras.Input(shape=visual_dim), tf.keras.Input(shape=action_dim))
 
@@ -189,8 +273,8 @@ class critic_v(ImageNet):
     output: v(s)
     '''
 
-    def __init__(self, vector_dim, visual_dim, name, hidden_units):
-        super().__init__(name=name, visual_dim=visual_dim)
+    def __init__(self, vector_dim, visual_dim, name, hidden_units, conv_dtype='float32'):
+        super().__init__(name=name, visual_dim=visual_dim, conv_dtype=conv_dtype)
         self.net = mlp(hidden_units, output_shape=1, out_activation=None)
         self(tf.keras.Input(shape=vector_dim), tf.keras.Input(shape=visual_dim))
 
@@ -206,8 +290,8 @@ class critic_q_all(ImageNet):
     output: q(s, *)
     '''
 
-    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units):
-        super().__init__(name=name, visual_dim=visual_dim)
+    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units, conv_dtype='float32'):
+        super().__init__(name=name, visual_dim=visual_dim, conv_dtype=conv_dtype)
         self.net = mlp(hidden_units, output_shape=output_shape, out_activation=None)
         self(tf.keras.Input(shape=vector_dim), tf.keras.Input(shape=visual_dim))
 
@@ -216,9 +300,108 @@ class critic_q_all(ImageNet):
         return q
 
 
+class critic_ensemble(ImageNet):
+    '''
+    base of Q-ensembles: the mlps of k heads are stacked by ensemble_mlp.
+    with visual input every head has its own visual encoder like separate critics, share_encoder=True lets all
+    heads use one encoder, which is cheaper but no longer the same algorithm.
+    outputs of the heads have shape [k, batch, ...], reduce them with min_q, mean_q or random_min_q.
+    '''
+
+    def __init__(self, name, visual_dim, k, hidden_units, output_shape, conv_dtype='float32', share_encoder=False):
+        share_encoder = share_encoder or len(visual_dim) not in [4, 5]
+        super().__init__(name=name, visual_dim=visual_dim if share_encoder else [], conv_dtype=conv_dtype)
+        self.share_encoder = share_encoder
+        self.k = k
+        if not self.share_encoder:
+            self.encoders = [ImageNet(f'encoder{i}', visual_dim, conv_dtype=conv_dtype) for i in range(k)]
+        self.net = ensemble_mlp(k, hidden_units, output_shape=output_shape, out_activation=None)
+
+    def encode(self, vector_input, visual_input):
+        '''
+        features of the heads, [batch, ...] if the encoder is shared, else [k, batch, ...].
+        '''
+        if self.share_encoder:
+            return super().call(vector_input, visual_input)
+        return tf.stack([encoder(vector_input, visual_input) for encoder in self.encoders])
+
+    @staticmethod
+    def min_q(q):
+        return tf.reduce_min(q, axis=0)
+
+    @staticmethod
+    def mean_q(q):
+        return tf.reduce_mean(q, axis=0)
+
+    def random_min_q(self, q, m):
+        '''
+        minimum over m heads drawn without replacement for every call, the clipped target of REDQ. m=k is min_q.
+        '''
+        if m >= self.k:
+            return self.min_q(q)
+        return self.min_q(tf.gather(q, tf.random.shuffle(tf.range(self.k))[:m]))
+
+    def load_heads(self, nets):
+        '''
+        copy separate networks with the same layout, e.g. critic_q_one, into the first len(nets) heads.
+        visual encoders are copied head by head, a shared encoder can only hold them if they are identical,
+        otherwise ValueError is raised before anything is copied.
+        '''
+        assert len(nets) <= self.k, 'more networks than heads'
+        names = [name for name in ['conv1', 'conv2', 'conv3', 'fc'] if hasattr(nets[0], name)]
+        if self.share_encoder and names:
+            for net in nets[1:]:
+                for name in names:
+                    if not all(np.array_equal(a.numpy(), b.numpy()) for a, b in zip(getattr(nets[0], name).weights, getattr(net, name).weights)):
+                        raise ValueError(f'the visual encoders of {nets[0].name} and {net.name} differ, they can not share one encoder')
+        for layer, sources in zip(self.net.layers, zip(*[n.net.layers for n in nets])):
+            layer.kernel[:len(nets)].assign(tf.stack([l.kernel for l in sources]))
+            layer.bias[:len(nets)].assign(tf.stack([l.bias for l in sources])[:, tf.newaxis])
+        targets = [self] if self.share_encoder else self.encoders
+        for target, net in zip(targets, nets):
+            for name in names:
+                for t, s in zip(getattr(target, name).weights, getattr(net, name).weights):
+                    t.assign(s)
+
+
+class critic_q_one_ensemble(critic_ensemble):
+    '''
+    k heads of critic_q_one.
+    input: state, action
+    output: q(s,a) of every head, [k, batch, 1]
+    '''
+
+    def __init__(self, vector_dim, visual_dim, action_dim, name, hidden_units, k=2, conv_dtype='float32', share_encoder=False):
+        super().__init__(name=name, visual_dim=visual_dim, k=k, hidden_units=hidden_units, output_shape=1, conv_dtype=conv_dtype, share_encoder=share_encoder)
+        self(tf.keras.Input(shape=vector_dim), tf.keras.Input(shape=visual_dim), tf.keras.Input(shape=action_dim))
+
+    def call(self, vector_input, visual_input, action):
+        features = self.encode(vector_input, visual_input)
+        if not self.share_encoder:
+            action = tf.tile(action[tf.newaxis], [self.k, 1, 1])
+        q = self.net(tf.concat((features, action), axis=-1))
+        return q
+
+
+class critic_q_all_ensemble(critic_ensemble):
+    '''
+    k heads of critic_q_all. must be discrete action space.
+    input: state
+    output: q(s, *) of every head, [k, batch, output_shape]
+    '''
+
+    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units, k=2, conv_dtype='float32', share_encoder=False):
+        super().__init__(name=name, visual_dim=visual_dim, k=k, hidden_units=hidden_units, output_shape=output_shape, conv_dtype=conv_dtype, share_encoder=share_encoder)
+        self(tf.keras.Input(shape=vector_dim), tf.keras.Input(shape=visual_dim))
+
+    def call(self, vector_input, visual_input):
+        q = self.net(self.encode(vector_input, visual_input))
+        return q
+
+
 class critic_dueling(ImageNet):
-    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units):
-        super().__init__(name=name, visual_dim=visual_dim)
+    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units, conv_dtype='float32'):
+        super().__init__(name=name, visual_dim=visual_dim, conv_dtype=conv_dtype)
         self.share = mlp(hidden_units['share'], out_layer=False)
         self.v = mlp(hidden_units['v'], output_shape=1, out_activation=None)
         self.adv = mlp(hidden_units['adv'], output_shape=output_shape, out_activation=None)
@@ -238,8 +421,8 @@ class a_c_v_continuous(ImageNet):
     output: mean(mu) of Gaussian Distribution of actions given a state, v(s)
     '''
 
-    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units):
-        super().__init__(name=name, visual_dim=visual_dim)
+    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units, conv_dtype='float32'):
+        super().__init__(name=name, visual_dim=visual_dim, conv_dtype=conv_dtype)
         self.share = mlp(hidden_units['share'], out_layer=False)
         self.mu = mlp(hidden_units['mu'], output_shape=output_shape, out_activation=None)
         self.v = mlp(hidden_units['v'], output_shape=1, out_activation=None)
@@ -259,8 +442,8 @@ class a_c_v_discrete(ImageNet):
     output: probability distribution of actions given a state, v(s)
     '''
 
-    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units):
-        super().__init__(name=name, visual_dim=visual_dim)
+    def __init__(self, vector_dim, visual_dim, output_shape, name, hidden_units, conv_dtype='float32'):
+        super().__init__(name=name, visual_dim=visual_dim, conv_dtype=conv_dtype)
         self.share = mlp(hidden_units['share'], out_layer=False)
         self.logits = mlp(hidden_units['logits'], output_shape=output_shape, out_activation=None)
         self.v = mlp(hidden_units['v'], output_shape=1, out_activation=None)
@@ -271,3 +454,20 @@ class a_c_v_discrete(ImageNet):
         logits = self.logits(features)
         v = self.v(features)
         return logits, v
+
+
+def restore_twin_critics(checkpoint_path, ensemble, names, build_net):
+    '''
+    checkpoints saved before the critics became ensembles keep every head as its own network of the policy,
+    e.g. q1_net and q2_net. load those networks into the first heads of ensemble.
+    inputs:
+        build_net: build_net(name) returns a network with the layout of the old ones
+    return: whether checkpoint_path holds all of the networks in names
+    '''
+    keys = [k for k, _ in tf.train.list_variables(checkpoint_path)]
+    if not all(any(k.startswith(f'policy/{n}/') for k in keys) for n in names):
+        return False
+    nets = {n: build_net(n) for n in names}
+    tf.train.Checkpoint(policy=tf.train.Checkpoint(**nets)).restore(checkpoint_path).expect_partial()
+    ensemble.load_heads([nets[n] for n in names])
+    return True
@@ -40,6 +40,8 @@ train_config = {
         'base_dir': f'C:/RLData/{version}' if platform.system() == "Windows" else os.environ['HOME'] + f'/RLData/{version}',
         'logger2file': False,
         'out_graph': False,
+        'summary_interval': 10,     # tf2: reduce the scalars of this many training updates into one summary point.
+        'summary_reduce': 'mean',   # tf2: mean, min, max or last
         'ma': {
             'batch_size': 10,
             'capacity': 1000
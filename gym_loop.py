@@ -1,4 +1,5 @@
 import numpy as np
+from utils.learner import AsyncLearner
 
 
 def get_action_normalize_factor(space, action_type):
@@ -44,7 +45,7 @@ def init_variables(env, action_type):
         state: [vector_obs, visual_obs]
         newstate: [vector_obs, visual_obs]
     """
-    i = 1 if len(env.observation_space.shape) == 3 else 0
+    i = 1 if env.obs_type == 'visual' else 0
     mu, sigma = get_action_normalize_factor(env.action_space, action_type)
     return i, mu, sigma, [np.empty(env.n), np.array([[]] * env.n)], [np.empty(env.n), np.array([[]] * env.n)]
 
@@ -52,7 +53,7 @@ def init_variables(env, action_type):
 class Loop(object):
 
     @staticmethod
-    def train(env, gym_model, action_type, begin_episode, save_frequency, max_step, max_episode, eval_while_train, max_eval_episode, render, render_episode, policy_mode):
+    def train(env, gym_model, action_type, begin_episode, save_frequency, max_step, max_episode, eval_while_train, max_eval_episode, render, render_episode, policy_mode, update_ratio=0):
         """
         Inputs:
             env:                gym environment
@@ -64,69 +65,84 @@ class Loop(object):
             max_episode:        maximum number of episodes in this training task
             render:             specify whether render the env or not
             render_episode:     if 'render' is false, specify from which episode to render the env
+            update_ratio:       if larger than 0 and the model is off-policy, train it in a background thread with update_ratio updates per step
         """
         i, mu, sigma, state, new_state = init_variables(env, action_type)
-        for episode in range(begin_episode, max_episode):
-            obs = env.reset()
-            state[i] = maybe_one_hot(obs, env.observation_space, env.n)
-            dones_flag = np.full(env.n, False)
-            step = 0
-            r = np.zeros(env.n)
-            last_done_step = -1
-            while True:
-                step += 1
-                r_tem = np.zeros(env.n)
-                if render or episode > render_episode:
-                    env.render()
-                action = gym_model.choose_action(s=state[0], visual_s=state[1])
-                obs, reward, done, info = env.step(action * sigma + mu)
-                unfinished_index = np.where(dones_flag == False)[0]
-                dones_flag += done
-                new_state[i] = maybe_one_hot(obs, env.observation_space, env.n)
-                r_tem[unfinished_index] = reward[unfinished_index]
-                r += r_tem
-                gym_model.store_data(
-                    s=state[0],
-                    visual_s=state[1],
-                    a=action,
-                    r=reward,
-                    s_=new_state[0],
-                    visual_s_=new_state[1],
-                    done=done
-                )
-
-                if all(dones_flag):
-                    if last_done_step == -1:
-                        last_done_step = step
-                    if policy_mode == 'off-policy':
+        learner = None
+        if update_ratio > 0 and policy_mode == 'off-policy':
+            learner = AsyncLearner(gym_model, update_ratio)
+            learner.start()
+        try:
+            for episode in range(begin_episode, max_episode):
+                obs = env.reset()
+                state[i] = maybe_one_hot(obs, env.observation_space, env.n)
+                dones_flag = np.full(env.n, False)
+                step = 0
+                r = np.zeros(env.n)
+                last_done_step = -1
+                while True:
+                    step += 1
+                    r_tem = np.zeros(env.n)
+                    if render or episode > render_episode:
+                        env.render()
+                    action = gym_model.choose_action(s=state[0], visual_s=state[1])
+                    obs, reward, done, info = env.step(action * sigma + mu)
+                    unfinished_index = np.where(dones_flag == False)[0]
+                    dones_flag += done
+                    new_state[i] = maybe_one_hot(obs, env.observation_space, env.n)
+                    r_tem[unfinished_index] = reward[unfinished_index]
+                    r += r_tem
+                    gym_model.store_data(
+                        s=state[0],
+                        visual_s=state[1],
+                        a=action,
+                        r=reward,
+                        s_=new_state[0],
+                        visual_s_=new_state[1],
+                        done=done
+                    )
+                    if learner is not None:
+                        learner.add_steps(1, episode)
+
+                    if all(dones_flag):
+                        if last_done_step == -1:
+                            last_done_step = step
+                        if policy_mode == 'off-policy':
+                            break
+
+                    if step >= max_step:
                         break
 
-                if step >= max_step:
-                    break
-
-                if len(env.dones_index):    # 判断是否有线程中的环境需要局部reset
-                    new_episode_states = maybe_one_hot(env.patial_reset(), env.observation_space, len(env.dones_index))
-                    new_state[i][env.dones_index] = new_episode_states
-                state[i] = new_state[i]
-
-            gym_model.learn(episode=episode, step=step)
-            gym_model.writer_summary(
-                episode,
-                total_reward=r.mean(),
-                step=last_done_step
-            )
-            print('-' * 40)
-            print(f'Episode: {episode:3d} | step: {step:4d} | last_done_step {last_done_step:4d} | rewards: {r}')
-            if episode % save_frequency == 0:
-                gym_model.save_checkpoint(episode)
-
-            if eval_while_train and env.reward_threshold is not None:
-                if r.max() >= env.reward_threshold:
-                    ave_r, ave_step = Loop.evaluate(env, gym_model, action_type, max_step, max_eval_episode)
-                    solved = True if ave_r >= env.reward_threshold else False
-                    print(f'-------------------------------------------Evaluate episode: {episode:3d}--------------------------------------------------')
-                    print(f'evaluate number: {max_eval_episode:3d} | average step: {ave_step} | average reward: {ave_r} | SOLVED: {solved}')
-                    print('----------------------------------------------------------------------------------------------------------------------------')
+                    if len(env.dones_index):    # 判断是否有线程中的环境需要局部reset
+                        new_episode_states = maybe_one_hot(env.patial_reset(), env.observation_space, len(env.dones_index))
+                        new_state[i][env.dones_index] = new_episode_states
+                    state[i] = new_state[i]
+
+                gym_model.truncate()
+                if learner is None:
+                    gym_model.learn(episode=episode, step=step)
+                gym_model.writer_summary(
+                    episode,
+                    total_reward=r.mean(),
+                    step=last_done_step
+                )
+                print('-' * 40)
+                print(f'Episode: {episode:3d} | step: {step:4d} | last_done_step {last_done_step:4d} | env steps/s: {env.steps_per_second:.1f} | rewards: {r}')
+                if learner is not None:
+                    print(f'rollout steps/s: {learner.steps_per_second:.1f} | updates/s: {learner.updates_per_second:.1f} | updates: {learner.updates}')
+                if episode % save_frequency == 0:
+                    gym_model.save_checkpoint(episode)
+
+                if eval_while_train and env.reward_threshold is not None:
+                    if r.max() >= env.reward_threshold:
+                        ave_r, ave_step = Loop.evaluate(env, gym_model, action_type, max_step, max_eval_episode)
+                        solved = True if ave_r >= env.reward_threshold else False
+                        print(f'-------------------------------------------Evaluate episode: {episode:3d}--------------------------------------------------')
+                        print(f'evaluate number: {max_eval_episode:3d} | average step: {ave_step} | average reward: {ave_r} | SOLVED: {solved}')
+                        print('----------------------------------------------------------------------------------------------------------------------------')
+        finally:
+            if learner is not None:
+                learner.stop()
 
     @staticmethod
     def evaluate(env, gym_model, action_type, max_step, max_eval_episode):
@@ -208,3 +224,4 @@ class Loop(object):
                 new_episode_states = maybe_one_hot(env.patial_reset(), env.observation_space, len(env.dones_index))
                 new_state[i][env.dones_index] = new_episode_states
             state[i] = new_state[i]
+        gym_model.truncate()
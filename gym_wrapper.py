@@ -1,6 +1,9 @@
 import gym
+import time
+import traceback
 import numpy as np
 import threading
+import multiprocessing as mp
 
 
 class MyThread(threading.Thread):
@@ -26,7 +29,7 @@ class gym_envs(object):
         self.n = n
         self.envs = [gym.make(gym_env_name) for _ in range(self.n)]
         self.observation_space = self.envs[0].observation_space
-        self.obs_type = 'visual' if len(self.observation_space.shape) == 3 else 'vector'
+        self.obs_type = 'visual' if len(self.observation_space.shape) in [3, 4] else 'vector'
         self.reward_threshold = self.envs[0].env.spec.reward_threshold
         if type(self.envs[0].action_space) == gym.spaces.box.Box:
             self.a_type = 'continuous'
@@ -35,6 +38,15 @@ class gym_envs(object):
         else:
             self.a_type = 'discrete'
         self.action_space = self.envs[0].action_space
+        self._step_count = 0
+        self._step_time = 0.
+
+    @property
+    def steps_per_second(self):
+        '''
+        environment steps(summed over all envs) per second spent in step().
+        '''
+        return self._step_count / self._step_time if self._step_time > 0 else 0.
 
     def render(self):
         self.envs[0].render()
@@ -56,11 +68,12 @@ class gym_envs(object):
         for th in threadpool:
             threading.Thread.join(th)
         if self.obs_type == 'visual':
-            return np.array([threadpool[i].get_result()[np.newaxis, :] for i in range(self.n)])
+            return np.array([np.asarray(threadpool[i].get_result())[np.newaxis, :] for i in range(self.n)])
         else:
             return np.array([threadpool[i].get_result() for i in range(self.n)])
 
     def step(self, actions):
+        t = time.time()
         if self.a_type == 'discrete':
             actions = actions.reshape(-1,)
         elif self.a_type == 'Tuple(Discrete)':
@@ -75,12 +88,14 @@ class gym_envs(object):
             threading.Thread.join(th)
         if self.obs_type == 'visual':
             results = [
-                [threadpool[i].get_result()[0][np.newaxis, :], *threadpool[i].get_result()[1:]]
+                [np.asarray(threadpool[i].get_result()[0])[np.newaxis, :], *threadpool[i].get_result()[1:]]
                 for i in range(self.n)]
         else:
             results = [threadpool[i].get_result() for i in range(self.n)]
         obs, reward, done, info = [np.array(e) for e in zip(*results)]
         self.dones_index = np.where(done)[0]
+        self._step_count += self.n
+        self._step_time += time.time() - t
         return obs, reward, done, info
     
     def patial_reset(self):
@@ -93,7 +108,187 @@ class gym_envs(object):
         for th in threadpool:
             threading.Thread.join(th)
         if self.obs_type == 'visual':
-            return np.array([threadpool[i].get_result()[np.newaxis, :] for i in range(self.dones_index.shape[0])])
+            return np.array([np.asarray(threadpool[i].get_result())[np.newaxis, :] for i in range(self.dones_index.shape[0])])
         else:
             return np.array([threadpool[i].get_result() for i in range(self.dones_index.shape[0])])
 
+
+def _process_worker(remote, parent_remote, gym_env_name, start, end, obs_buffer, obs_shape, obs_dtype, n):
+    '''
+    run envs [start, end) in a child process. observations are written into a slot of the shared observation ring,
+    only rewards, dones and infos are sent back through the pipe.
+    '''
+    parent_remote.close()
+    envs = [gym.make(gym_env_name) for _ in range(end - start)]
+    ring = np.frombuffer(obs_buffer, dtype=obs_dtype).reshape(-1, n, *obs_shape)[:, start:end]
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                slot, actions = data
+                rewards, dones, infos = [], [], []
+                for i, env in enumerate(envs):
+                    o, r, d, info = env.step(actions[i])
+                    ring[slot, i] = o
+                    rewards.append(r)
+                    dones.append(d)
+                    infos.append(info)
+                remote.send((rewards, dones, infos))
+            elif cmd == 'reset':
+                slot, index = data
+                for i in index:
+                    ring[slot, i] = envs[i].reset()
+                remote.send(None)
+            elif cmd == 'sample':
+                remote.send([env.action_space.sample() for env in envs])
+            elif cmd == 'render':
+                envs[0].render()
+                remote.send(None)
+            elif cmd == 'close':
+                [env.close() for env in envs]
+                remote.close()
+                break
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        remote.send(('error', traceback.format_exc()))
+        remote.close()
+
+
+class gym_process_envs(object):
+    '''
+    Same interface as gym_envs, but envs live in persistent worker processes, each worker steps envs_per_worker envs.
+    Commands and rewards go through pipes. Workers write observations directly into a shared-memory ring of
+    ring_size slots with the dtype of the observation space, e.g. uint8 frames stay uint8.
+    reset() and step() return views of the newest slot without copying, a slot is overwritten ring_size steps later,
+    so anything that keeps observations longer(like replay buffers) must copy them.
+    An exception in a worker is sent back with its traceback and re-raised in the parent, a worker that does not
+    reply within timeout seconds raises TimeoutError.
+    '''
+
+    def __init__(self, gym_env_name, n, envs_per_worker=1, ring_size=8, timeout=60):
+        assert ring_size >= 2, 'ring_size must larger than 1, because state and next state are used together'
+        self.n = n
+        env = gym.make(gym_env_name)
+        self.observation_space = env.observation_space
+        self.obs_type = 'visual' if len(self.observation_space.shape) in [3, 4] else 'vector'
+        self.reward_threshold = env.env.spec.reward_threshold
+        if type(env.action_space) == gym.spaces.box.Box:
+            self.a_type = 'continuous'
+        elif type(env.action_space) == gym.spaces.tuple.Tuple:
+            self.a_type = 'Tuple(Discrete)'
+        else:
+            self.a_type = 'discrete'
+        self.action_space = env.action_space
+        env.close()
+
+        obs_shape = self.observation_space.shape
+        obs_dtype = np.dtype(self.observation_space.dtype)
+        obs_buffer = mp.RawArray('b', int(ring_size * n * np.prod(obs_shape, dtype=np.int64) * obs_dtype.itemsize))
+        self._ring = np.frombuffer(obs_buffer, dtype=obs_dtype).reshape(ring_size, n, *obs_shape)
+        self.ring_size = ring_size
+        self.timeout = timeout
+        self._slot = 0
+
+        self.ranges = [(i, min(i + envs_per_worker, n)) for i in range(0, n, envs_per_worker)]
+        self.remotes, self.processes = [], []
+        for start, end in self.ranges:
+            remote, work_remote = mp.Pipe()
+            p = mp.Process(target=_process_worker, args=(work_remote, remote, gym_env_name, start, end, obs_buffer, obs_shape, obs_dtype, n))
+            p.daemon = True
+            p.start()
+            work_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(p)
+        self.dones_index = []
+        self._step_count = 0
+        self._step_time = 0.
+
+    @property
+    def steps_per_second(self):
+        '''
+        environment steps(summed over all envs) per second spent in step().
+        '''
+        return self._step_count / self._step_time if self._step_time > 0 else 0.
+
+    def _recv(self, remote):
+        '''
+        receive the reply of a worker. waits at most timeout seconds, re-raises the exception of a failed worker
+        with its traceback instead of blocking forever.
+        '''
+        p = self.processes[self.remotes.index(remote)]
+        waited = 0.
+        while not remote.poll(1.):
+            waited += 1.
+            if not p.is_alive():
+                raise RuntimeError(f'gym worker {p.pid} exited with code {p.exitcode}')
+            if waited >= self.timeout:
+                raise TimeoutError(f'gym worker {p.pid} did not reply within {self.timeout} seconds')
+        result = remote.recv()
+        if isinstance(result, tuple) and len(result) == 2 and result[0] == 'error':
+            raise RuntimeError(f'gym worker {p.pid} failed:\n{result[1]}')
+        return result
+
+    def render(self):
+        self.remotes[0].send(('render', None))
+        self._recv(self.remotes[0])
+
+    def close(self):
+        for remote, p in zip(self.remotes, self.processes):
+            try:
+                remote.send(('close', None))
+            except (BrokenPipeError, EOFError):    # the worker has already exited after an exception
+                pass
+        for p in self.processes:
+            p.join()
+
+    def sample_action(self):
+        for remote in self.remotes:
+            remote.send(('sample', None))
+        return np.array([a for remote in self.remotes for a in self._recv(remote)])
+
+    def _format(self, obs):
+        return obs[:, np.newaxis] if self.obs_type == 'visual' else obs
+
+    def _reset(self, index):
+        '''
+        reset envs whose global indexs are in index into the current slot, wait until all observations are written.
+        '''
+        index = np.asarray(index, dtype=np.int64)
+        busy = []
+        for remote, (start, end) in zip(self.remotes, self.ranges):
+            local = index[(index >= start) & (index < end)] - start
+            if len(local):
+                remote.send(('reset', (self._slot, local.tolist())))
+                busy.append(remote)
+        for remote in busy:
+            self._recv(remote)
+
+    def reset(self):
+        self.dones_index = []
+        self._slot = (self._slot + 1) % self.ring_size
+        self._reset(np.arange(self.n))
+        return self._format(self._ring[self._slot])
+
+    def step(self, actions):
+        t = time.time()
+        if self.a_type == 'discrete':
+            actions = actions.reshape(-1,)
+        elif self.a_type == 'Tuple(Discrete)':
+            actions = actions.reshape(self.n, -1).tolist()
+        self._slot = (self._slot + 1) % self.ring_size
+        for remote, (start, end) in zip(self.remotes, self.ranges):
+            remote.send(('step', (self._slot, actions[start:end])))
+        results = [self._recv(remote) for remote in self.remotes]
+        reward, done, info = [np.array([x for result in results for x in result[i]]) for i in range(3)]
+        self.dones_index = np.where(done)[0]
+        self._step_count += self.n
+        self._step_time += time.time() - t
+        return self._format(self._ring[self._slot]), reward, done, info
+
+    def patial_reset(self):
+        '''
+        the reset observations overwrite the terminal observations of the current slot, they have been stored by then.
+        '''
+        self._reset(self.dones_index)
+        return self._format(self._ring[self._slot][self.dones_index])
@@ -1,4 +1,6 @@
+import time
 import numpy as np
+from utils.learner import AsyncLearner
 
 
 def get_visual_input(n, cameras, brain_obs):
@@ -9,20 +11,17 @@ def get_visual_input(n, cameras, brain_obs):
         brain_obs: observations of specified brain, include visual and vector observation.
     output:
         [vector_information, [visual_info0, visual_info1, visual_info2, ...]]
+        visual observations are stacked as [n, cameras, H, W, C] in one copy and keep their dtype, e.g. uint8 pixels.
     '''
-    ss = []
-    for j in range(n):
-        s = []
-        for k in range(cameras):
-            s.append(brain_obs.visual_observations[k][j])
-        ss.append(np.array(s))
-    return np.array(ss)
+    if cameras == 0:
+        return np.empty((n, 0), dtype=np.uint8)
+    return np.stack(brain_obs.visual_observations[:cameras], axis=1)
 
 
 class Loop(object):
 
     @staticmethod
-    def train(env, brain_names, models, begin_episode, save_frequency, reset_config, max_step, max_episode, sampler_manager, resampling_interval, policy_mode):
+    def train(env, brain_names, models, begin_episode, save_frequency, reset_config, max_step, max_episode, sampler_manager, resampling_interval, policy_mode, update_ratio=0):
         """
         Train loop. Execute until episode reaches its maximum or press 'ctrl+c' artificially.
         Inputs:
@@ -33,6 +32,7 @@ class Loop(object):
             max_step:               maximum number of steps for an episode.
             sampler_manager:        sampler configuration parameters for 'reset_config'.
             resampling_interval:    how often to resample parameters for env reset.
+            update_ratio:           if larger than 0 and models are off-policy, train them in background threads with update_ratio updates per step.
         Variables:
             brain_names:    a list of brain names set in Unity.
             state: store    a list of states for each brain. each item contain a list of states for each agents that controlled by the same brain.
@@ -49,62 +49,75 @@ class Loop(object):
         dones_flag = [0] * brains_num
         agents_num = [0] * brains_num
         rewards = [0] * brains_num
-        for episode in range(begin_episode, max_episode):
-            if episode % resampling_interval == 0:
-                reset_config.update(sampler_manager.sample_all())
-            obs = env.reset(config=reset_config, train_mode=True)
-            for i, brain_name in enumerate(brain_names):
-                agents_num[i] = len(obs[brain_name].agents)
-                dones_flag[i] = np.zeros(agents_num[i])
-                rewards[i] = np.zeros(agents_num[i])
-            step = 0
-            last_done_step = -1
-            while True:
-                step += 1
+        learners = []
+        if update_ratio > 0 and policy_mode == 'off-policy':
+            learners = [AsyncLearner(models[i], update_ratio) for i in range(brains_num)]
+            [learner.start() for learner in learners]
+        try:
+            for episode in range(begin_episode, max_episode):
+                if episode % resampling_interval == 0:
+                    reset_config.update(sampler_manager.sample_all())
+                obs = env.reset(config=reset_config, train_mode=True)
                 for i, brain_name in enumerate(brain_names):
-                    state[i] = obs[brain_name].vector_observations
-                    visual_state[i] = get_visual_input(agents_num[i], models[i].visual_sources, obs[brain_name])
-                    action[i] = models[i].choose_action(s=state[i], visual_s=visual_state[i])
-                actions = {f'{brain_name}': action[i] for i, brain_name in enumerate(brain_names)}
-                obs = env.step(vector_action=actions)
+                    agents_num[i] = len(obs[brain_name].agents)
+                    dones_flag[i] = np.zeros(agents_num[i])
+                    rewards[i] = np.zeros(agents_num[i])
+                step = 0
+                last_done_step = -1
+                start = time.time()
+                while True:
+                    step += 1
+                    for i, brain_name in enumerate(brain_names):
+                        state[i] = obs[brain_name].vector_observations
+                        visual_state[i] = get_visual_input(agents_num[i], models[i].visual_sources, obs[brain_name])
+                        action[i] = models[i].choose_action(s=state[i], visual_s=visual_state[i])
+                    actions = {f'{brain_name}': action[i] for i, brain_name in enumerate(brain_names)}
+                    obs = env.step(vector_action=actions)
 
-                for i, brain_name in enumerate(brain_names):
-                    unfinished_index = np.where(dones_flag[i] == False)[0]
-                    dones_flag[i] += obs[brain_name].local_done
-                    next_state = obs[brain_name].vector_observations
-                    next_visual_state = get_visual_input(agents_num[i], models[i].visual_sources, obs[brain_name])
-                    models[i].store_data(
-                        s=state[i],
-                        visual_s=visual_state[i],
-                        a=action[i],
-                        r=np.array(obs[brain_name].rewards),
-                        s_=next_state,
-                        visual_s_=next_visual_state,
-                        done=np.array(obs[brain_name].local_done)
-                    )
-                    rewards[i][unfinished_index] += np.array(obs[brain_name].rewards)[unfinished_index]
+                    for i, brain_name in enumerate(brain_names):
+                        unfinished_index = np.where(dones_flag[i] == False)[0]
+                        dones_flag[i] += obs[brain_name].local_done
+                        next_state = obs[brain_name].vector_observations
+                        next_visual_state = get_visual_input(agents_num[i], models[i].visual_sources, obs[brain_name])
+                        models[i].store_data(
+                            s=state[i],
+                            visual_s=visual_state[i],
+                            a=action[i],
+                            r=np.array(obs[brain_name].rewards),
+                            s_=next_state,
+                            visual_s_=next_visual_state,
+                            done=np.array(obs[brain_name].local_done)
+                        )
+                        rewards[i][unfinished_index] += np.array(obs[brain_name].rewards)[unfinished_index]
+                    [learner.add_steps(1, episode) for learner in learners]
 
-                if all([all(dones_flag[i]) for i in range(brains_num)]):
-                    if last_done_step == -1:
-                        last_done_step = step
-                    if policy_mode == 'off-policy':
-                        break
+                    if all([all(dones_flag[i]) for i in range(brains_num)]):
+                        if last_done_step == -1:
+                            last_done_step = step
+                        if policy_mode == 'off-policy':
+                            break
 
-                if step >= max_step:
-                    break
+                    if step >= max_step:
+                        break
 
-            for i in range(brains_num):
-                models[i].learn(episode=episode, step=step)
-                models[i].writer_summary(
-                    episode,
-                    total_reward=rewards[i].mean(),
-                    step=last_done_step
-                )
-            print('-' * 40)
-            print(f'episode {episode:3d} | step {step:4d} | last_done_step {last_done_step:4d}')
-            if episode % save_frequency == 0:
                 for i in range(brains_num):
-                    models[i].save_checkpoint(episode)
+                    models[i].truncate()
+                    if not learners:
+                        models[i].learn(episode=episode, step=step)
+                    models[i].writer_summary(
+                        episode,
+                        total_reward=rewards[i].mean(),
+                        step=last_done_step
+                    )
+                print('-' * 40)
+                print(f'episode {episode:3d} | step {step:4d} | last_done_step {last_done_step:4d} | steps/s {step / (time.time() - start):.1f}')
+                if learners:
+                    print(' | '.join(f'{brain_name} updates/s {learner.updates_per_second:.1f}' for brain_name, learner in zip(brain_names, learners)))
+                if episode % save_frequency == 0:
+                    for i in range(brains_num):
+                        models[i].save_checkpoint(episode)
+        finally:
+            [learner.stop() for learner in learners]
 
     @staticmethod
     def inference(env, brain_names, models, reset_config, sampler_manager, resampling_interval):
@@ -175,3 +188,5 @@ class Loop(object):
                     visual_s_=next_visual_state,
                     done=np.array(obs[brain_name].local_done)
                 )
+        for i in range(brains_num):
+            models[i].truncate()
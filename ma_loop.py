@@ -4,7 +4,10 @@ import numpy as np
 class Loop(object):
 
     @staticmethod
-    def train(env, brain_names, models, data, begin_episode, save_frequency, reset_config, max_step, max_episode, sampler_manager, resampling_interval, policy_mode):
+    def train(env, brain_names, models, data, begin_episode, save_frequency, reset_config, max_step, max_episode, sampler_manager, resampling_interval, policy_mode, learner=None):
+        '''
+        learner: a MultiAgentLearner that updates all agents in one step, otherwise every model learns separately.
+        '''
         assert policy_mode == 'off-policy', "multi-agents algorithms now support off-policy only."
         brains_num = len(brain_names)
         batch_size = data.batch_size
@@ -53,23 +56,26 @@ class Loop(object):
                 done = [np.array(e) for e in zip(*dones)]
                 data.add(s, a, r, s_, done)
                 s, a, r, s_, done = data.sample()
-                for i, brain_name in enumerate(brain_names):
-                    next_action[i] = models[i].get_target_action(s=s_[:, i])
-                    new_action[i] = models[i].choose_inference_action(s=s[:, i])
-                a_ = np.array([np.array(e) for e in zip(*next_action)])
-                if policy_mode == 'off-policy':
-                    for i in range(brains_num):
-                        models[i].learn(
-                            episode=episode,
-                            ap=np.array([np.array(e) for e in zip(*next_action[:i])]).reshape(batch_size, -1) if i != 0 else np.zeros((batch_size, 0)),
-                            al=np.array([np.array(e) for e in zip(*next_action[-(brains_num - i - 1):])]).reshape(batch_size, -1) if brains_num - i != 1 else np.zeros((batch_size, 0)),
-                            ss=s.reshape(batch_size, -1),
-                            ss_=s_.reshape(batch_size, -1),
-                            aa=a.reshape(batch_size, -1),
-                            aa_=a_.reshape(batch_size, -1),
-                            s=s[:, i],
-                            r=r[:, i]
-                        )
+                if learner is not None:
+                    learner.learn(episode, s, a, r, s_)
+                else:
+                    for i, brain_name in enumerate(brain_names):
+                        next_action[i] = models[i].get_target_action(s=s_[:, i])
+                        new_action[i] = models[i].choose_inference_action(s=s[:, i])
+                    a_ = np.array([np.array(e) for e in zip(*next_action)])
+                    if policy_mode == 'off-policy':
+                        for i in range(brains_num):
+                            models[i].learn(
+                                episode=episode,
+                                ap=np.array([np.array(e) for e in zip(*next_action[:i])]).reshape(batch_size, -1) if i != 0 else np.zeros((batch_size, 0)),
+                                al=np.array([np.array(e) for e in zip(*next_action[-(brains_num - i - 1):])]).reshape(batch_size, -1) if brains_num - i != 1 else np.zeros((batch_size, 0)),
+                                ss=s.reshape(batch_size, -1),
+                                ss_=s_.reshape(batch_size, -1),
+                                aa=a.reshape(batch_size, -1),
+                                aa_=a_.reshape(batch_size, -1),
+                                s=s[:, i],
+                                r=r[:, i]
+                            )
 
                 if all([all(dones_flag[i]) for i in range(brains_num)]):
                     if last_done_step == -1:
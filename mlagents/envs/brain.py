@@ -1,6 +1,10 @@
 import logging
 import numpy as np
 import io
+import itertools
+import os
+
+from concurrent.futures import ThreadPoolExecutor
 
 from mlagents.envs.communicator_objects.agent_info_proto_pb2 import AgentInfoProto
 from mlagents.envs.communicator_objects.brain_parameters_proto_pb2 import (
@@ -12,6 +16,16 @@ from PIL import Image
 
 logger = logging.getLogger("mlagents.envs")
 
+# PIL releases the GIL while decoding, so the images of different agents are decoded in parallel.
+_decode_pool: Optional[ThreadPoolExecutor] = None
+
+
+def get_decode_pool() -> ThreadPoolExecutor:
+    global _decode_pool
+    if _decode_pool is None:
+        _decode_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+    return _decode_pool
+
 
 class BrainParameters:
     def __init__(
@@ -112,7 +126,9 @@ class BrainInfo:
 
     def merge(self, other):
         for i in range(len(self.visual_observations)):
-            self.visual_observations[i].extend(other.visual_observations[i])
+            self.visual_observations[i] = np.append(
+                self.visual_observations[i], other.visual_observations[i], axis=0
+            )
         self.vector_observations = np.append(
             self.vector_observations, other.vector_observations, axis=0
         )
@@ -174,77 +190,168 @@ class BrainInfo:
             s = np.reshape(s, [s.shape[0], s.shape[1], 1])
         return s
 
+    @staticmethod
+    def decode_image(image_bytes: bytes, out: np.ndarray) -> None:
+        """
+        Decodes a compressed observation image into a preallocated uint8 array.
+        :param image_bytes: input byte array corresponding to image
+        :param out: uint8 array of shape [height, width, channels] to write the pixels to
+        """
+        image = Image.open(io.BytesIO(image_bytes))
+        image.load()
+        out[...] = np.asarray(image).reshape(out.shape)
+
+    @staticmethod
+    @timed
+    def process_visual_observations(
+        images: List[bytes], resolution: Dict, raw: bool = False
+    ) -> np.ndarray:
+        """
+        Converts the byte array observations of one camera of all agents into a single numpy array.
+        Images are decoded in parallel into one preallocated uint8 array, and converted to float
+        (and optionally grey scale) once for the whole batch.
+        :param images: input byte arrays of all agents
+        :param resolution: camera resolution, with keys height, width and blackAndWhite
+        :param raw: If true, the decoded uint8 pixels are returned without scaling.
+        :return: float32 array with shape [agents, height, width, channels] and values in [0, 1],
+        or uint8 array with values in [0, 255] if raw
+        """
+        if len(images) == 0:
+            channels = 1 if resolution["blackAndWhite"] else 3
+            return np.zeros(
+                (0, resolution["height"], resolution["width"], channels),
+                dtype=np.uint8 if raw else np.float32,
+            )
+        with hierarchical_timer("image_decompress"):
+            # The first image gives the decoded shape, the rest are written into the same array.
+            first = Image.open(io.BytesIO(images[0]))
+            first.load()
+            first = np.asarray(first)
+            first = first.reshape(first.shape[:2] + (-1,))
+            pixels = np.empty((len(images),) + first.shape, dtype=np.uint8)
+            pixels[0] = first
+            if len(images) > 1:
+                list(
+                    get_decode_pool().map(
+                        BrainInfo.decode_image, images[1:], pixels[1:]
+                    )
+                )
+        if raw:
+            if resolution["blackAndWhite"] and pixels.shape[3] != 1:
+                s = np.mean(pixels, axis=3, keepdims=True, dtype=np.float32)
+                s = np.rint(s, out=s).astype(np.uint8)
+            else:
+                s = pixels
+        elif resolution["blackAndWhite"]:
+            s = np.mean(pixels, axis=3, keepdims=True, dtype=np.float32)
+            s /= 255.0
+        else:
+            s = pixels.astype(np.float32)
+            s /= 255.0
+        return s
+
     @staticmethod
     def from_agent_proto(
         worker_id: int,
         agent_info_list: List[AgentInfoProto],
         brain_params: BrainParameters,
+        raw_visual: bool = False,
     ) -> "BrainInfo":
         """
         Converts list of agent infos to BrainInfo.
+        :param raw_visual: If true, visual observations are kept as uint8 pixels.
         """
         vis_obs: List[np.ndarray] = []
         for i in range(brain_params.number_visual_observations):
-            obs = [
-                BrainInfo.process_pixels(
-                    x.visual_observations[i],
-                    brain_params.camera_resolutions[i]["blackAndWhite"],
-                )
-                for x in agent_info_list
-            ]
-            vis_obs += [obs]
-        if len(agent_info_list) == 0:
-            memory_size = 0
-        else:
-            memory_size = max([len(x.memories) for x in agent_info_list])
-        if memory_size == 0:
-            memory = np.zeros((0, 0))
-        else:
-            [
-                x.memories.extend([0] * (memory_size - len(x.memories)))
-                for x in agent_info_list
-            ]
-            memory = np.array([list(x.memories) for x in agent_info_list])
-        total_num_actions = sum(brain_params.vector_action_space_size)
-        mask_actions = np.ones((len(agent_info_list), total_num_actions))
-        for agent_index, agent_info in enumerate(agent_info_list):
-            if agent_info.action_mask is not None:
-                if len(agent_info.action_mask) == total_num_actions:
-                    mask_actions[agent_index, :] = [
-                        0 if agent_info.action_mask[k] else 1
-                        for k in range(total_num_actions)
-                    ]
-        if any([np.isnan(x.reward) for x in agent_info_list]):
-            logger.warning(
-                "An agent had a NaN reward for brain " + brain_params.brain_name
+            obs = BrainInfo.process_visual_observations(
+                [x.visual_observations[i] for x in agent_info_list],
+                brain_params.camera_resolutions[i],
+                raw_visual,
             )
-        if any([np.isnan(x.stacked_vector_observation).any() for x in agent_info_list]):
+            vis_obs += [obs]
+        n_agents = len(agent_info_list)
+        vector_obs_size = (
+            brain_params.vector_observation_space_size
+            * brain_params.num_stacked_vector_observations
+        )
+        # Repeated fields of all agents are read into preallocated arrays in one pass each.
+        vector_obs = np.fromiter(
+            itertools.chain.from_iterable(
+                x.stacked_vector_observation for x in agent_info_list
+            ),
+            dtype=np.float32,
+            count=n_agents * vector_obs_size,
+        ).reshape(n_agents, vector_obs_size)
+        if np.isnan(vector_obs).any():
             logger.warning(
                 "An agent had a NaN observation for brain " + brain_params.brain_name
             )
+        np.nan_to_num(vector_obs, copy=False)
 
-        if len(agent_info_list) == 0:
-            vector_obs = np.zeros(
-                (
-                    0,
-                    brain_params.vector_observation_space_size
-                    * brain_params.num_stacked_vector_observations,
-                )
+        rewards = np.fromiter(
+            (x.reward for x in agent_info_list), dtype=np.float32, count=n_agents
+        )
+        nan_rewards = np.isnan(rewards)
+        if nan_rewards.any():
+            logger.warning(
+                "An agent had a NaN reward for brain " + brain_params.brain_name
             )
+            rewards[nan_rewards] = 0
+
+        memory_lengths = np.fromiter(
+            (len(x.memories) for x in agent_info_list), dtype=np.int64, count=n_agents
+        )
+        memory_size = memory_lengths.max() if n_agents > 0 else 0
+        if memory_size == 0:
+            memory = np.zeros((0, 0))
         else:
-            vector_obs = np.nan_to_num(
-                np.array([x.stacked_vector_observation for x in agent_info_list])
+            memory = np.zeros((n_agents, memory_size))
+            memory[np.arange(memory_size) < memory_lengths[:, np.newaxis]] = np.fromiter(
+                itertools.chain.from_iterable(x.memories for x in agent_info_list),
+                dtype=np.float32,
+                count=memory_lengths.sum(),
             )
+
+        total_num_actions = sum(brain_params.vector_action_space_size)
+        mask_actions = np.ones((n_agents, total_num_actions))
+        has_mask = np.fromiter(
+            (len(x.action_mask) == total_num_actions for x in agent_info_list),
+            dtype=bool,
+            count=n_agents,
+        )
+        if has_mask.any():
+            masked = [x.action_mask for x, m in zip(agent_info_list, has_mask) if m]
+            mask_actions[has_mask] = 1 - np.fromiter(
+                itertools.chain.from_iterable(masked),
+                dtype=bool,
+                count=len(masked) * total_num_actions,
+            ).reshape(-1, total_num_actions)
+
+        action_lengths = np.fromiter(
+            (len(x.stored_vector_actions) for x in agent_info_list),
+            dtype=np.int64,
+            count=n_agents,
+        )
+        if n_agents > 0 and (action_lengths == action_lengths[0]).all():
+            vector_action = np.fromiter(
+                itertools.chain.from_iterable(
+                    x.stored_vector_actions for x in agent_info_list
+                ),
+                dtype=np.float64,
+                count=action_lengths.sum(),
+            ).reshape(n_agents, action_lengths[0])
+        else:
+            vector_action = np.array([x.stored_vector_actions for x in agent_info_list])
         agents = [f"${worker_id}-{x.id}" for x in agent_info_list]
         brain_info = BrainInfo(
             visual_observation=vis_obs,
             vector_observation=vector_obs,
             text_observations=[x.text_observation for x in agent_info_list],
             memory=memory,
-            reward=[x.reward if not np.isnan(x.reward) else 0 for x in agent_info_list],
+            reward=rewards.tolist(),
             agents=agents,
             local_done=[x.done for x in agent_info_list],
-            vector_action=np.array([x.stored_vector_actions for x in agent_info_list]),
+            vector_action=vector_action,
             text_action=[list(x.stored_text_actions) for x in agent_info_list],
             max_reached=[x.max_step_reached for x in agent_info_list],
             custom_observations=[x.custom_observation for x in agent_info_list],
@@ -4,7 +4,7 @@ import logging
 import numpy as np
 import os
 import subprocess
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Union
 
 from mlagents.envs.base_unity_environment import BaseUnityEnvironment
 from mlagents.envs.timers import timed, hierarchical_timer
@@ -18,7 +18,6 @@ from .exception import (
 
 from mlagents.envs.communicator_objects.unity_rl_input_pb2 import UnityRLInput
 from mlagents.envs.communicator_objects.unity_rl_output_pb2 import UnityRLOutput
-from mlagents.envs.communicator_objects.agent_action_proto_pb2 import AgentActionProto
 from mlagents.envs.communicator_objects.environment_parameters_proto_pb2 import (
     EnvironmentParametersProto,
 )
@@ -53,6 +52,7 @@ class UnityEnvironment(BaseUnityEnvironment):
         no_graphics: bool = False,
         timeout_wait: int = 30,
         args: Optional[List[str]] = None,
+        raw_visual: bool = False,
     ):
         """
         Starts a new unity environment and establishes a connection with the environment.
@@ -67,6 +67,7 @@ class UnityEnvironment(BaseUnityEnvironment):
         :int timeout_wait: Time (in seconds) to wait for connection from environment.
         :bool train_mode: Whether to run in training mode, speeding up the simulation, by default.
         :list args: Addition Unity command line arguments
+        :bool raw_visual: Whether to return visual observations as uint8 pixels instead of floats in [0, 1].
         """
         args = args or []
         atexit.register(self._close)
@@ -81,6 +82,7 @@ class UnityEnvironment(BaseUnityEnvironment):
         )  # The process that is started. If None, no process was started
         self.communicator = self.get_communicator(worker_id, base_port, timeout_wait)
         self.worker_id = worker_id
+        self.raw_visual = raw_visual
 
         # If the environment name is None, a new environment will not be launched
         # and the communicator will directly try to connect to an existing unity environment.
@@ -586,12 +588,16 @@ class UnityEnvironment(BaseUnityEnvironment):
             self.proc1.kill()
 
     @classmethod
-    def _flatten(cls, arr: Any) -> List[float]:
+    def _flatten(cls, arr: Any) -> Union[List[float], np.ndarray]:
         """
         Converts arrays to list.
+        Numpy arrays are only reshaped into a contiguous float32 vector, which is the type of the
+        repeated float fields they are written to.
         :param arr: numpy vector.
         :return: flattened list.
         """
+        if isinstance(arr, np.ndarray) and arr.dtype != object:
+            return np.ascontiguousarray(arr, dtype=np.float32).reshape(-1)
         if isinstance(arr, cls.SCALAR_ACTION_TYPES):
             arr = [float(arr)]
         if isinstance(arr, np.ndarray):
@@ -614,7 +620,10 @@ class UnityEnvironment(BaseUnityEnvironment):
         for brain_name in output.agentInfos:
             agent_info_list = output.agentInfos[brain_name].value
             _data[brain_name] = BrainInfo.from_agent_proto(
-                self.worker_id, agent_info_list, self.brains[brain_name]
+                self.worker_id,
+                agent_info_list,
+                self.brains[brain_name],
+                self.raw_visual,
             )
         return _data
 
@@ -627,26 +636,42 @@ class UnityEnvironment(BaseUnityEnvironment):
         value: Dict[str, np.ndarray],
         custom_action: Dict[str, list],
     ) -> UnityInput:
-        rl_in = UnityRLInput()
+        # Fill the rl_input of the message in place instead of copying it over in wrap_unity_input.
+        unity_input = UnityInput()
+        rl_in = unity_input.rl_input
         for b in vector_action:
             n_agents = self._n_agents[b]
             if n_agents == 0:
                 continue
-            _a_s = len(vector_action[b]) // n_agents
-            _m_s = len(memory[b]) // n_agents
+            # Split the flat inputs into one python list per agent with a single conversion per brain,
+            # so that every repeated field below is filled by one extend.
+            actions = (
+                np.asarray(vector_action[b], dtype=np.float32)
+                .reshape(n_agents, -1)
+                .tolist()
+            )
+            memories = (
+                np.asarray(memory[b], dtype=np.float32).reshape(n_agents, -1).tolist()
+            )
+            values = (
+                np.asarray(value[b], dtype=np.float32).reshape(-1).tolist()
+                if value.get(b) is not None
+                else None
+            )
+            agent_actions = rl_in.agent_actions[b].value
             for i in range(n_agents):
-                action = AgentActionProto(
-                    vector_actions=vector_action[b][i * _a_s : (i + 1) * _a_s],
-                    memories=memory[b][i * _m_s : (i + 1) * _m_s],
-                    text_actions=text_action[b][i],
-                    custom_action=custom_action[b][i],
-                )
-                if b in value:
-                    if value[b] is not None:
-                        action.value = float(value[b][i])
-                rl_in.agent_actions[b].value.extend([action])
-                rl_in.command = 0
-        return self.wrap_unity_input(rl_in)
+                action = agent_actions.add()
+                action.vector_actions.extend(actions[i])
+                if memories[i]:
+                    action.memories.extend(memories[i])
+                if text_action[b][i]:
+                    action.text_actions = text_action[b][i]
+                if custom_action[b][i] is not None:
+                    action.custom_action.CopyFrom(custom_action[b][i])
+                if values is not None:
+                    action.value = values[i]
+            rl_in.command = 0
+        return unity_input
 
     def _generate_reset_input(
         self, training: bool, config: Dict, custom_reset_parameters: Any
@@ -0,0 +1,61 @@
+"""
+Microbenchmark of UnityEnvironment._generate_step_input versus agent count.
+
+    python -m mlagents.envs.tests.benchmark_step_input
+"""
+import timeit
+
+import numpy as np
+
+from mlagents.envs.environment import UnityEnvironment
+from mlagents.envs.communicator_objects.agent_action_proto_pb2 import AgentActionProto
+from mlagents.envs.communicator_objects.unity_rl_input_pb2 import UnityRLInput
+
+BRAIN = "Brain"
+ACTION_SIZE = 2
+
+
+def per_agent_messages(env, vector_action, memory, text_action, value, custom_action):
+    """
+    The former encoding: one AgentActionProto per agent built from python lists.
+    """
+    rl_in = UnityRLInput()
+    for b in vector_action:
+        n_agents = env._n_agents[b]
+        _a_s = len(vector_action[b]) // n_agents
+        _m_s = len(memory[b]) // n_agents
+        for i in range(n_agents):
+            action = AgentActionProto(
+                vector_actions=vector_action[b][i * _a_s : (i + 1) * _a_s],
+                memories=memory[b][i * _m_s : (i + 1) * _m_s],
+                text_actions=text_action[b][i],
+                custom_action=custom_action[b][i],
+            )
+            rl_in.agent_actions[b].value.extend([action])
+        rl_in.command = 0
+    return env.wrap_unity_input(rl_in)
+
+
+def main(agent_counts=(1, 10, 100, 500, 2000), number=100):
+    env = UnityEnvironment.__new__(UnityEnvironment)
+    print(f"{'agents':>8} {'flatten+messages(ms)':>22} {'bulk(ms)':>10} {'speedup':>8}")
+    for n in agent_counts:
+        env._n_agents = {BRAIN: n}
+        actions = np.random.uniform(-1, 1, (n, ACTION_SIZE)).astype(np.float32)
+        args = ({BRAIN: []}, {BRAIN: [""] * n}, {}, {BRAIN: [None] * n})
+
+        def old():
+            # the former _flatten turned every element into a python float
+            flat = [float(x) for row in actions.tolist() for x in row]
+            per_agent_messages(env, {BRAIN: flat}, *args)
+
+        def new():
+            env._generate_step_input({BRAIN: env._flatten(actions)}, *args)
+
+        t_old = timeit.timeit(old, number=number) / number * 1e3
+        t_new = timeit.timeit(new, number=number) / number * 1e3
+        print(f"{n:>8} {t_old:>22.3f} {t_new:>10.3f} {t_old / t_new:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from mlagents.envs.brain import BrainInfo
+
+
+def encode_png(pixels: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_process_visual_observations():
+    pixels = np.random.randint(0, 256, size=(5, 8, 6, 3), dtype=np.uint8)
+    images = [encode_png(p) for p in pixels]
+
+    resolution = {"height": 8, "width": 6, "blackAndWhite": False}
+    obs = BrainInfo.process_visual_observations(images, resolution)
+    assert obs.shape == (5, 8, 6, 3)
+    assert obs.dtype == np.float32
+    np.testing.assert_allclose(obs, pixels / 255.0, rtol=1e-6)
+    for i, image in enumerate(images):
+        np.testing.assert_allclose(
+            obs[i], BrainInfo.process_pixels(image, False), rtol=1e-6
+        )
+
+    resolution["blackAndWhite"] = True
+    obs = BrainInfo.process_visual_observations(images, resolution)
+    assert obs.shape == (5, 8, 6, 1)
+    for i, image in enumerate(images):
+        np.testing.assert_allclose(
+            obs[i], BrainInfo.process_pixels(image, True), rtol=1e-6
+        )
+
+
+def test_process_visual_observations_no_agents():
+    resolution = {"height": 8, "width": 6, "blackAndWhite": True}
+    obs = BrainInfo.process_visual_observations([], resolution)
+    assert obs.shape == (0, 8, 6, 1)
+
+
+def test_process_visual_observations_raw():
+    pixels = np.random.randint(0, 256, size=(4, 8, 6, 3), dtype=np.uint8)
+    images = [encode_png(p) for p in pixels]
+
+    resolution = {"height": 8, "width": 6, "blackAndWhite": False}
+    obs = BrainInfo.process_visual_observations(images, resolution, raw=True)
+    assert obs.dtype == np.uint8
+    np.testing.assert_array_equal(obs, pixels)
+
+    resolution["blackAndWhite"] = True
+    obs = BrainInfo.process_visual_observations(images, resolution, raw=True)
+    assert obs.shape == (4, 8, 6, 1)
+    assert obs.dtype == np.uint8
+    np.testing.assert_allclose(
+        obs / 255.0,
+        BrainInfo.process_visual_observations(images, resolution),
+        atol=0.5 / 255.0 + 1e-6,
+    )
+
+    obs = BrainInfo.process_visual_observations([], resolution, raw=True)
+    assert obs.shape == (0, 8, 6, 1)
+    assert obs.dtype == np.uint8
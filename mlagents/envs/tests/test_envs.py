@@ -110,3 +110,31 @@ def test_close(mock_communicator, mock_launcher):
 
 if __name__ == "__main__":
     pytest.main()
+
+
+@mock.patch("mlagents.envs.environment.UnityEnvironment.executable_launcher")
+@mock.patch("mlagents.envs.environment.UnityEnvironment.get_communicator")
+def test_generate_step_input(mock_communicator, mock_launcher):
+    mock_communicator.return_value = MockCommunicator(
+        discrete_action=False, visual_inputs=0
+    )
+    env = UnityEnvironment(" ")
+    n_agents = 3
+    env._n_agents["RealFakeBrain"] = n_agents
+    actions = np.arange(n_agents * 2, dtype=np.float64).reshape(n_agents, 2)
+    memories = np.ones((n_agents, 4), dtype=np.float32)
+    step_input = env._generate_step_input(
+        {"RealFakeBrain": env._flatten(actions)},
+        {"RealFakeBrain": env._flatten(memories)},
+        {"RealFakeBrain": ["", "a", ""]},
+        {"RealFakeBrain": np.array([0.5, 1.5, 2.5])},
+        {"RealFakeBrain": [None] * n_agents},
+    )
+    env.close()
+    agent_actions = step_input.rl_input.agent_actions["RealFakeBrain"].value
+    assert len(agent_actions) == n_agents
+    for i, action in enumerate(agent_actions):
+        assert list(action.vector_actions) == actions[i].tolist()
+        assert list(action.memories) == memories[i].tolist()
+        assert action.value == 0.5 + i
+    assert agent_actions[1].text_actions == "a"
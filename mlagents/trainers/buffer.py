@@ -24,49 +24,124 @@ class Buffer(dict):
         The keys correspond to the name of the field. Example: state, action
         """
 
-        class AgentBufferField(list):
+        class AgentBufferField(object):
             """
-            AgentBufferField is a list of numpy arrays. When an agent collects a field, you can add it to his
-            AgentBufferField with the append method.
+            AgentBufferField stores the elements an agent collects for one field in a growable
+            float32 ndarray. Appends are amortized O(1) and slicing returns views of the storage.
+            All elements of a field must have the same shape.
             """
 
             def __init__(self):
                 self.padding_value = 0
-                super(Buffer.AgentBuffer.AgentBufferField, self).__init__()
+                self._data = None
+                self._size = 0
 
             def __str__(self):
-                return str(np.array(self).shape)
+                return str(self.view().shape)
+
+            def __len__(self):
+                return self._size
+
+            def __iter__(self):
+                return iter(self.view())
+
+            def __getitem__(self, index):
+                return self.view()[index]
+
+            def __setitem__(self, index, value):
+                self.view()[index] = value
+
+            def __array__(self, dtype=None, copy=None):
+                data = self.view() if dtype is None else self.view().astype(dtype)
+                return data.copy() if copy and data.base is not None else data
+
+            def view(self):
+                """
+                Returns the stored elements as an ndarray, without copying.
+                """
+                if self._data is None:
+                    return np.zeros((0,), dtype=np.float32)
+                return self._data[: self._size]
+
+            def _reserve(self, element_shape, length):
+                if self._data is None or self._size == 0:
+                    if self._data is None or self._data.shape[1:] != element_shape:
+                        self._data = np.empty(
+                            (max(length, 16),) + element_shape, dtype=np.float32
+                        )
+                elif self._data.shape[1:] != element_shape:
+                    raise BufferException(
+                        "Cannot add elements of shape {0} to a field of shape {1}".format(
+                            element_shape, self._data.shape[1:]
+                        )
+                    )
+                if length > len(self._data):
+                    data = np.empty(
+                        (max(length, 2 * len(self._data)),) + element_shape,
+                        dtype=np.float32,
+                    )
+                    data[: self._size] = self._data[: self._size]
+                    self._data = data
 
             def append(self, element, padding_value=0):
                 """
-                Adds an element to this list. Also lets you change the padding
+                Adds an element to this field. Also lets you change the padding
                 type, so that it can be set on append (e.g. action_masks should
                 be padded with 1.)
                 :param element: The element to append to the list.
                 :param padding_value: The value used to pad when get_batch is called.
                 """
-                super(Buffer.AgentBuffer.AgentBufferField, self).append(element)
+                if self._size == 0 or self._size == len(self._data):
+                    element = np.asarray(element, dtype=np.float32)
+                    self._reserve(element.shape, self._size + 1)
+                self._data[self._size] = element
+                self._size += 1
                 self.padding_value = padding_value
 
             def extend(self, data):
                 """
-                Adds a list of np.arrays to the end of the list of np.arrays.
+                Adds a list of np.arrays to the end of the field.
                 :param data: The np.array list to append.
                 """
-                self += list(np.array(data))
+                data = np.asarray(data, dtype=np.float32)
+                if len(data) == 0:
+                    return
+                self._reserve(data.shape[1:], self._size + len(data))
+                self._data[self._size : self._size + len(data)] = data
+                self._size += len(data)
 
             def set(self, data):
                 """
-                Sets the list of np.array to the input data
+                Sets the field to the input data
                 :param data: The np.array list to be set.
                 """
-                self[:] = []
-                self[:] = list(np.array(data))
+                self._size = 0
+                self.extend(data)
+
+            def permute(self, index):
+                """
+                Reorders the field in place, keeping only the elements in index.
+                :param index: Positions of the elements to keep, in their new order.
+                """
+                index = np.asarray(index, dtype=np.int64)
+                if self._data is not None:
+                    self._data[: len(index)] = self._data[index]
+                self._size = len(index)
+
+            def truncate(self, max_length):
+                """
+                Keeps only the last max_length elements of the field.
+                """
+                if self._size > max_length:
+                    self._data[:max_length] = self._data[
+                        self._size - max_length : self._size
+                    ]
+                    self._size = max_length
 
             def get_batch(self, batch_size=None, training_length=1, sequential=True):
                 """
                 Retrieve the last batch_size elements of length training_length
-                from the list of np.array
+                from the field
                 :param batch_size: The number of elements to retrieve. If None:
                 All elements will be retrieved.
                 :param training_length: The length of the sequence to be retrieved. If
@@ -76,6 +151,7 @@ class Buffer(dict):
                 sequential=True gives [[0,a],[b,c],[d,e]]. If sequential=False gives
                 [[a,b],[b,c],[c,d],[d,e]]
                 """
+                data = self.view()
                 if sequential:
                     # The sequences will not have overlapping elements (this involves padding)
                     leftover = len(self) % training_length
@@ -93,16 +169,12 @@ class Buffer(dict):
                             " too large given the current number of data points."
                         )
                     if batch_size * training_length > len(self):
-                        padding = np.array(self[-1]) * self.padding_value
-                        return np.array(
-                            [padding] * (training_length - leftover) + self[:],
-                            dtype=np.float32,
+                        padding = data[-1:] * self.padding_value
+                        return np.concatenate(
+                            [padding] * (training_length - leftover) + [data]
                         )
                     else:
-                        return np.array(
-                            self[len(self) - batch_size * training_length :],
-                            dtype=np.float32,
-                        )
+                        return data[len(self) - batch_size * training_length :].copy()
                 else:
                     # The sequences will have overlapping elements
                     if batch_size is None:
@@ -115,16 +187,23 @@ class Buffer(dict):
                             "The batch size and training length requested for get_batch where"
                             " too large given the current number of data points."
                         )
-                    tmp_list = []
-                    for end in range(len(self) - batch_size + 1, len(self) + 1):
-                        tmp_list += self[end - training_length : end]
-                    return np.array(tmp_list, dtype=np.float32)
+                    # Overlapping windows are strided views of the storage, reshape copies them once.
+                    windows = np.lib.stride_tricks.as_strided(
+                        data,
+                        shape=(len(self) - training_length + 1, training_length)
+                        + data.shape[1:],
+                        strides=(data.strides[0],) + data.strides,
+                        writeable=False,
+                    )
+                    return np.array(windows[len(windows) - batch_size :]).reshape(
+                        (batch_size * training_length,) + data.shape[1:]
+                    )
 
             def reset_field(self):
                 """
-                Resets the AgentBufferField
+                Resets the AgentBufferField. The allocated storage is kept.
                 """
-                self[:] = []
+                self._size = 0
 
         def __init__(self):
             self.last_brain_info = None
@@ -145,9 +224,8 @@ class Buffer(dict):
             self.last_brain_info = None
             self.last_take_action_outputs = None
 
-        def __getitem__(self, key):
-            if key not in self.keys():
-                self[key] = self.AgentBufferField()
+        def __missing__(self, key):
+            self[key] = self.AgentBufferField()
             return super(Buffer.AgentBuffer, self).__getitem__(key)
 
         def check_length(self, key_list):
@@ -182,11 +260,9 @@ class Buffer(dict):
                 )
             s = np.arange(len(self[key_list[0]]) // sequence_length)
             np.random.shuffle(s)
+            index = (s[:, None] * sequence_length + np.arange(sequence_length)).ravel()
             for key in key_list:
-                tmp = []
-                for i in s:
-                    tmp += self[key][i * sequence_length : (i + 1) * sequence_length]
-                self[key][:] = tmp
+                self[key].permute(index)
 
         def make_mini_batch(self, start, end):
             """
@@ -215,9 +291,9 @@ class Buffer(dict):
                 np.random.randint(num_sequences_in_buffer, size=num_seq_to_sample)
                 * sequence_length
             )  # Sample random sequence starts
-            for i in start_idxes:
-                for key in self:
-                    mini_batch[key].extend(self[key][i : i + sequence_length])
+            index = (start_idxes[:, None] + np.arange(sequence_length)).ravel()
+            for key in self:
+                mini_batch[key].extend(self[key][index])
             return mini_batch
 
         def save_to_file(self, file_object):
@@ -252,9 +328,8 @@ class Buffer(dict):
             ),
         )
 
-    def __getitem__(self, key):
-        if key not in self.keys():
-            self[key] = self.AgentBuffer()
+    def __missing__(self, key):
+        self[key] = self.AgentBuffer()
         return super(Buffer, self).__getitem__(key)
 
     def reset_update_buffer(self):
@@ -276,9 +351,7 @@ class Buffer(dict):
         max_length -= max_length % sequence_length
         if current_length > max_length:
             for _key in self.update_buffer.keys():
-                self.update_buffer[_key] = self.update_buffer[_key][
-                    current_length - max_length :
-                ]
+                self.update_buffer[_key].truncate(max_length)
 
     def reset_local_buffers(self):
         """
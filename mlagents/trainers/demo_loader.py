@@ -1,7 +1,11 @@
 import pathlib
 import logging
+import mmap
 import os
-from typing import List, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
 from mlagents.trainers.buffer import Buffer
 from mlagents.envs.brain import BrainParameters, BrainInfo
 from mlagents.envs.communicator_objects.agent_info_proto_pb2 import AgentInfoProto
@@ -13,69 +17,121 @@ from mlagents.envs.communicator_objects.demonstration_meta_proto_pb2 import (
 )
 from google.protobuf.internal.decoder import _DecodeVarint32  # type: ignore
 
-
 logger = logging.getLogger("mlagents.trainers")
 
+# First 32 bytes of file dedicated to meta-data.
+INITIAL_POS = 33
+# Number of agent records decoded together by BrainInfo.from_agent_proto.
+DECODE_CHUNK_SIZE = 256
+# Bumped whenever the layout of the .npz cache changes.
+CACHE_VERSION = 1
+
 
 def make_demo_buffer(
     brain_infos: List[BrainInfo], brain_params: BrainParameters, sequence_length: int
 ) -> Buffer:
-    # Create and populate buffer using experiences
-    demo_buffer = Buffer()
-    for idx, experience in enumerate(brain_infos):
-        if idx > len(brain_infos) - 2:
-            break
-        current_brain_info = brain_infos[idx]
-        next_brain_info = brain_infos[idx + 1]
-        demo_buffer[0].last_brain_info = current_brain_info
-        demo_buffer[0]["done"].append(next_brain_info.local_done[0])
-        demo_buffer[0]["rewards"].append(next_brain_info.rewards[0])
-        for i in range(brain_params.number_visual_observations):
-            demo_buffer[0]["visual_obs%d" % i].append(
-                current_brain_info.visual_observations[i][0]
-            )
-        if brain_params.vector_observation_space_size > 0:
-            demo_buffer[0]["vector_obs"].append(
-                current_brain_info.vector_observations[0]
-            )
-        demo_buffer[0]["actions"].append(next_brain_info.previous_vector_actions[0])
-        demo_buffer[0]["prev_action"].append(
-            current_brain_info.previous_vector_actions[0]
+    """
+    Creates and populates a training buffer from a list of single agent BrainInfos.
+    :param brain_infos: BrainInfos of consecutive demonstration steps.
+    :param brain_params: BrainParameters of the demonstration.
+    :param sequence_length: Length of trajectories to fill buffer.
+    """
+    if not brain_infos:
+        return Buffer()
+    steps = {
+        "rewards": np.array([x.rewards[0] for x in brain_infos], dtype=np.float32),
+        "local_done": np.array([x.local_done[0] for x in brain_infos]),
+        "previous_vector_actions": np.stack(
+            [x.previous_vector_actions[0] for x in brain_infos]
+        ),
+    }
+    if brain_params.vector_observation_space_size > 0:
+        steps["vector_observations"] = np.stack(
+            [x.vector_observations[0] for x in brain_infos]
+        )
+    for i in range(brain_params.number_visual_observations):
+        steps["visual_observations%d" % i] = np.stack(
+            [x.visual_observations[i][0] for x in brain_infos]
         )
-        if next_brain_info.local_done[0]:
-            demo_buffer.append_update_buffer(
-                0, batch_size=None, training_length=sequence_length
+    demo_buffer = make_demo_buffer_from_arrays(steps, brain_params, sequence_length)
+    if len(brain_infos) > 1:
+        demo_buffer[0].last_brain_info = brain_infos[-2]
+    return demo_buffer
+
+
+def make_demo_buffer_from_arrays(
+    steps: Dict[str, np.ndarray], brain_params: BrainParameters, sequence_length: int
+) -> Buffer:
+    """
+    Creates and populates a training buffer from columnar demonstration arrays.
+    Step t and t + 1 form one experience. Every episode is front padded with zeros
+    to a multiple of sequence_length, like Buffer.append_update_buffer does.
+    :param steps: Per step arrays, see load_demonstration_arrays.
+    :param brain_params: BrainParameters of the demonstration.
+    :param sequence_length: Length of trajectories to fill buffer.
+    """
+    demo_buffer = Buffer()
+    num_experiences = len(steps["rewards"]) - 1
+    if num_experiences < 1:
+        return demo_buffer
+
+    done = np.asarray(steps["local_done"][1:], dtype=bool)
+    fields = {
+        "done": done,
+        "rewards": steps["rewards"][1:],
+        "actions": steps["previous_vector_actions"][1:],
+        "prev_action": steps["previous_vector_actions"][:-1],
+    }
+    for i in range(brain_params.number_visual_observations):
+        fields["visual_obs%d" % i] = steps["visual_observations%d" % i][:-1]
+    if brain_params.vector_observation_space_size > 0:
+        fields["vector_obs"] = steps["vector_observations"][:-1]
+
+    # Index of every row of the update buffer, -1 marks a padding row.
+    ends = np.flatnonzero(done) + 1
+    if len(ends) == 0 or ends[-1] != num_experiences:
+        ends = np.append(ends, num_experiences)
+    starts = np.concatenate(([0], ends[:-1]))
+    index = np.concatenate(
+        [
+            np.concatenate(
+                (np.full((start - end) % sequence_length, -1), np.arange(start, end))
             )
-            demo_buffer.reset_local_buffers()
-    demo_buffer.append_update_buffer(
-        0, batch_size=None, training_length=sequence_length
-    )
+            for start, end in zip(starts, ends)
+        ]
+    ).astype(np.int64)
+
+    needs_padding = len(index) != num_experiences
+    for key, data in fields.items():
+        data = np.asarray(data, dtype=np.float32)
+        if needs_padding:
+            data = np.concatenate((data, np.zeros((1,) + data.shape[1:], np.float32)))
+            data = data[index]
+        demo_buffer.update_buffer[key].extend(data)
     return demo_buffer
 
 
 def demo_to_buffer(
-    file_path: str, sequence_length: int
+    file_path: str, sequence_length: int, use_cache: bool = True
 ) -> Tuple[BrainParameters, Buffer]:
     """
     Loads demonstration file and uses it to fill training buffer.
     :param file_path: Location of demonstration file (.demo).
     :param sequence_length: Length of trajectories to fill buffer.
+    :param use_cache: Whether to use the decoded .npz cache next to each file.
     :return:
     """
-    brain_params, brain_infos, _ = load_demonstration(file_path)
-    demo_buffer = make_demo_buffer(brain_infos, brain_params, sequence_length)
+    brain_params, steps, _ = load_demonstration_arrays(file_path, use_cache)
+    demo_buffer = make_demo_buffer_from_arrays(steps, brain_params, sequence_length)
     return brain_params, demo_buffer
 
 
-def load_demonstration(file_path: str) -> Tuple[BrainParameters, List[BrainInfo], int]:
+def get_demo_files(file_path: str) -> List[str]:
     """
-    Loads and parses a demonstration file.
-    :param file_path: Location of demonstration file (.demo).
-    :return: BrainParameter and list of BrainInfos containing demonstration data.
+    Retrieves the demonstration files at a location.
+    :param file_path: Location of demonstration file (.demo) or of a directory of them.
+    :return: Paths of the demonstration files.
     """
-
-    # First 32 bytes of file dedicated to meta-data.
-    INITIAL_POS = 33
     file_paths = []
     if os.path.isdir(file_path):
         all_files = os.listdir(file_path)
@@ -96,32 +152,231 @@ def load_demonstration(file_path: str) -> Tuple[BrainParameters, List[BrainInfo]
         raise FileNotFoundError(
             "The demonstration file or directory {} does not exist.".format(file_path)
         )
+    return file_paths
+
+
+def iterate_demo_records(data) -> Iterator[bytes]:
+    """
+    Lazily yields the varint-delimited records of a demonstration file.
+    The first record is the DemonstrationMetaProto, the second the BrainParametersProto
+    and every following one an AgentInfoProto.
+    :param data: Content of the file, e.g. a mmap.
+    """
+    pos, obs_decoded = 0, 0
+    while pos < len(data):
+        next_pos, pos = _DecodeVarint32(data, pos)
+        yield data[pos : pos + next_pos]
+        pos = INITIAL_POS if obs_decoded == 0 else pos + next_pos
+        obs_decoded += 1
+
+
+def _read_demo_file(
+    file_path: str,
+) -> Tuple[Optional[DemonstrationMetaProto], Optional[BrainParametersProto], Iterator]:
+    """
+    Opens a demonstration file and decodes its header records.
+    :return: Meta data, brain parameters and the lazy iterator over the AgentInfoProtos.
+    """
+    if os.path.getsize(file_path) == 0:
+        return None, None, iter(())
+    with open(file_path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    records = iterate_demo_records(data)
+    meta_data_proto = DemonstrationMetaProto()
+    meta_data_proto.ParseFromString(next(records))
+    brain_param_proto = None
+    for record in records:
+        brain_param_proto = BrainParametersProto()
+        brain_param_proto.ParseFromString(record)
+        break
+    return meta_data_proto, brain_param_proto, records
 
+
+def _cache_path(file_path: str) -> str:
+    return file_path + ".npz"
+
+
+def _load_cache(file_path: str) -> Optional[Dict[str, np.ndarray]]:
+    cache_path = _cache_path(file_path)
+    if not os.path.isfile(cache_path):
+        return None
+    stat = os.stat(file_path)
+    try:
+        with np.load(cache_path) as cache:
+            if (
+                int(cache["cache_version"]) != CACHE_VERSION
+                or int(cache["source_size"]) != stat.st_size
+                or int(cache["source_mtime_ns"]) != stat.st_mtime_ns
+            ):
+                return None
+            return {key: cache[key] for key in cache.files}
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(
+            "Ignoring unreadable demonstration cache {}: {}".format(cache_path, e)
+        )
+        return None
+
+
+def _save_cache(file_path: str, arrays: Dict[str, np.ndarray]) -> None:
+    cache_path = _cache_path(file_path)
+    stat = os.stat(file_path)
+    tmp_path = cache_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                cache_version=CACHE_VERSION,
+                source_size=stat.st_size,
+                source_mtime_ns=stat.st_mtime_ns,
+                **arrays
+            )
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(
+            "Could not write demonstration cache {}: {}".format(cache_path, e)
+        )
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _decode_demo_file(file_path: str) -> Dict[str, np.ndarray]:
+    """
+    Decodes a demonstration file into columnar arrays with one row per step.
+    Agent records are parsed in chunks and written into arrays preallocated
+    from the number of steps announced in the meta data.
+    """
+    meta_data_proto, brain_param_proto, records = _read_demo_file(file_path)
+    arrays = {}  # type: Dict[str, np.ndarray]
+    if meta_data_proto is None or brain_param_proto is None:
+        return arrays
+    brain_params = BrainParameters.from_proto(brain_param_proto)
+    arrays["meta_data"] = np.frombuffer(meta_data_proto.SerializeToString(), np.uint8)
+    arrays["brain_parameters"] = np.frombuffer(
+        brain_param_proto.SerializeToString(), np.uint8
+    )
+    capacity = meta_data_proto.number_steps
+    size = 0
+
+    def write(chunk):
+        nonlocal capacity
+        brain_info = BrainInfo.from_agent_proto(0, chunk, brain_params)
+        columns = {
+            "rewards": np.asarray(brain_info.rewards, dtype=np.float32),
+            "local_done": np.asarray(brain_info.local_done, dtype=bool),
+            "previous_vector_actions": brain_info.previous_vector_actions,
+            "vector_observations": brain_info.vector_observations,
+        }
+        for i, obs in enumerate(brain_info.visual_observations):
+            columns["visual_observations%d" % i] = obs
+        if size + len(chunk) > capacity:
+            # The file holds more records than its meta data announced.
+            capacity = max(2 * capacity, size + len(chunk))
+            for key in columns:
+                if key in arrays:
+                    arrays[key] = np.resize(
+                        arrays[key], (capacity,) + arrays[key].shape[1:]
+                    )
+        for key, value in columns.items():
+            if key not in arrays:
+                arrays[key] = np.empty((capacity,) + value.shape[1:], dtype=value.dtype)
+            arrays[key][size : size + len(chunk)] = value
+
+    chunk = []  # type: List[AgentInfoProto]
+    for record in records:
+        if size + len(chunk) == meta_data_proto.number_steps > 0:
+            break
+        agent_info = AgentInfoProto()
+        agent_info.ParseFromString(record)
+        chunk.append(agent_info)
+        if len(chunk) == DECODE_CHUNK_SIZE:
+            write(chunk)
+            size += len(chunk)
+            chunk = []
+    if chunk:
+        write(chunk)
+        size += len(chunk)
+    if size == 0:
+        return {}
+    for key in arrays:
+        if key not in ("meta_data", "brain_parameters"):
+            arrays[key] = arrays[key][:size]
+    return arrays
+
+
+def load_demo_file_arrays(
+    file_path: str, use_cache: bool = True
+) -> Dict[str, np.ndarray]:
+    """
+    Decodes a single demonstration file, going through its .npz cache when allowed.
+    :param file_path: Location of demonstration file (.demo).
+    :param use_cache: Whether to read and write the decoded .npz cache next to the file.
+    """
+    arrays = _load_cache(file_path) if use_cache else None
+    if arrays is None:
+        arrays = _decode_demo_file(file_path)
+        if use_cache and arrays:
+            _save_cache(file_path, arrays)
+    for key in ("cache_version", "source_size", "source_mtime_ns"):
+        arrays.pop(key, None)
+    return arrays
+
+
+def load_demonstration_arrays(
+    file_path: str, use_cache: bool = True
+) -> Tuple[BrainParameters, Dict[str, np.ndarray], int]:
+    """
+    Loads and parses demonstration files into columnar arrays.
+    :param file_path: Location of demonstration file (.demo) or of a directory of them.
+    :param use_cache: Whether to use the decoded .npz cache next to each file.
+    :return: BrainParameters, dict of arrays with one row per step (rewards, local_done,
+    previous_vector_actions, vector_observations, visual_observations%d) and the number
+    of steps announced by the meta data.
+    """
+    brain_params = None
+    total_expected = 0
+    per_file = []
+    for _file_path in get_demo_files(file_path):
+        arrays = load_demo_file_arrays(_file_path, use_cache)
+        if not arrays:
+            continue
+        meta_data_proto = DemonstrationMetaProto()
+        meta_data_proto.ParseFromString(arrays.pop("meta_data").tobytes())
+        total_expected += meta_data_proto.number_steps
+        brain_param_proto = BrainParametersProto()
+        brain_param_proto.ParseFromString(arrays.pop("brain_parameters").tobytes())
+        brain_params = BrainParameters.from_proto(brain_param_proto)
+        per_file.append(arrays)
+    if len(per_file) == 1:
+        steps = per_file[0]
+    else:
+        steps = {
+            key: np.concatenate([arrays[key] for arrays in per_file])
+            for key in (per_file[0] if per_file else ())
+        }
+    return brain_params, steps, total_expected
+
+
+def load_demonstration(file_path: str) -> Tuple[BrainParameters, List[BrainInfo], int]:
+    """
+    Loads and parses a demonstration file.
+    :param file_path: Location of demonstration file (.demo).
+    :return: BrainParameter and list of BrainInfos containing demonstration data.
+    """
     brain_params = None
     brain_infos = []
     total_expected = 0
-    for _file_path in file_paths:
-        data = open(_file_path, "rb").read()
-        next_pos, pos, obs_decoded = 0, 0, 0
-        while pos < len(data):
-            next_pos, pos = _DecodeVarint32(data, pos)
-            if obs_decoded == 0:
-                meta_data_proto = DemonstrationMetaProto()
-                meta_data_proto.ParseFromString(data[pos : pos + next_pos])
-                total_expected += meta_data_proto.number_steps
-                pos = INITIAL_POS
-            if obs_decoded == 1:
-                brain_param_proto = BrainParametersProto()
-                brain_param_proto.ParseFromString(data[pos : pos + next_pos])
-                brain_params = BrainParameters.from_proto(brain_param_proto)
-                pos += next_pos
-            if obs_decoded > 1:
-                agent_info = AgentInfoProto()
-                agent_info.ParseFromString(data[pos : pos + next_pos])
-                brain_info = BrainInfo.from_agent_proto(0, [agent_info], brain_params)
-                brain_infos.append(brain_info)
-                if len(brain_infos) == total_expected:
-                    break
-                pos += next_pos
-            obs_decoded += 1
+    for _file_path in get_demo_files(file_path):
+        meta_data_proto, brain_param_proto, records = _read_demo_file(_file_path)
+        if meta_data_proto is None:
+            continue
+        total_expected += meta_data_proto.number_steps
+        if brain_param_proto is not None:
+            brain_params = BrainParameters.from_proto(brain_param_proto)
+        for record in records:
+            agent_info = AgentInfoProto()
+            agent_info.ParseFromString(record)
+            brain_info = BrainInfo.from_agent_proto(0, [agent_info], brain_params)
+            brain_infos.append(brain_info)
+            if len(brain_infos) == total_expected:
+                break
     return brain_params, brain_infos, total_expected
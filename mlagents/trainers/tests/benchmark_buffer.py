@@ -0,0 +1,105 @@
+"""
+Benchmark of update buffer assembly with the array backed AgentBufferField against
+the former list of ndarrays, at 100k steps.
+
+    python -m mlagents.trainers.tests.benchmark_buffer
+"""
+
+import time
+
+import numpy as np
+
+from mlagents.trainers.buffer import Buffer
+
+FIELDS = {"vector_obs": (8,), "actions": (2,), "action_probs": (2,), "rewards": ()}
+
+
+class ListField(list):
+    """
+    The former AgentBufferField: a list of np.arrays, batches are rebuilt with np.array.
+    """
+
+    def get_batch(self, training_length=1):
+        leftover = len(self) % training_length
+        padding = [np.array(self[-1]) * 0] * (
+            (training_length - leftover) % training_length
+        )
+        return np.array(padding + self[:], dtype=np.float32)
+
+
+class ListBuffer(object):
+    """
+    Collection, update buffer assembly, shuffle and mini-batches of the former Buffer.
+    """
+
+    def __init__(self, n_agents):
+        self.local = [{k: ListField() for k in FIELDS} for _ in range(n_agents)]
+        self.update = {k: ListField() for k in FIELDS}
+
+    def collect(self, agent, elements):
+        for k, element in elements.items():
+            self.local[agent][k].append(element)
+
+    def assemble(self, sequence_length, batch_size):
+        for fields in self.local:
+            for k in FIELDS:
+                self.update[k].extend(list(fields[k].get_batch(sequence_length)))
+        s = np.arange(len(self.update["actions"]) // sequence_length)
+        np.random.shuffle(s)
+        for k in FIELDS:
+            tmp = []
+            for i in s:
+                tmp += self.update[k][i * sequence_length : (i + 1) * sequence_length]
+            self.update[k][:] = tmp
+        for start in range(0, len(self.update["actions"]) - batch_size + 1, batch_size):
+            [np.array(self.update[k][start : start + batch_size]) for k in FIELDS]
+
+
+class ArrayBuffer(object):
+    """
+    The same steps through Buffer.
+    """
+
+    def __init__(self, n_agents):
+        self.buffer = Buffer()
+
+    def collect(self, agent, elements):
+        for k, element in elements.items():
+            self.buffer[agent][k].append(element)
+
+    def assemble(self, sequence_length, batch_size):
+        self.buffer.append_all_agent_batch_to_update_buffer(
+            training_length=sequence_length
+        )
+        update = self.buffer.update_buffer
+        update.shuffle(sequence_length)
+        for start in range(0, len(update["actions"]) - batch_size + 1, batch_size):
+            [
+                np.array(v)
+                for v in update.make_mini_batch(start, start + batch_size).values()
+            ]
+
+
+def main(steps=100000, n_agents=100, batch_size=1024):
+    steps_per_agent = steps // n_agents
+    data = {
+        k: np.random.randn(steps_per_agent, n_agents, *shape).astype(np.float32)
+        for k, shape in FIELDS.items()
+    }
+    print(f"{'seq_len':>8} {'buffer':>8} {'collect(s)':>11} {'assemble(s)':>12}")
+    for sequence_length in (1, 16, 64):
+        for name, buffer_type in (("lists", ListBuffer), ("arrays", ArrayBuffer)):
+            buffer = buffer_type(n_agents)
+            start = time.perf_counter()
+            for t in range(steps_per_agent):
+                for agent in range(n_agents):
+                    buffer.collect(agent, {k: v[t, agent] for k, v in data.items()})
+            collect = time.perf_counter() - start
+            start = time.perf_counter()
+            buffer.assemble(sequence_length, batch_size)
+            assemble = time.perf_counter() - start
+            print(f"{sequence_length:>8} {name:>8} {collect:>11.3f} {assemble:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
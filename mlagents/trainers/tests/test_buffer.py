@@ -114,3 +114,34 @@ def test_buffer_truncate():
     # Test LSTM, truncate should be some multiple of sequence_length
     b.truncate_update_buffer(4, sequence_length=3)
     assert len(b.update_buffer["action"]) == 3
+
+
+def test_buffer_field():
+    field = Buffer.AgentBuffer.AgentBufferField()
+    for i in range(100):
+        field.append([i, 1], padding_value=1)
+    assert len(field) == 100
+    assert np.array(field).shape == (100, 2)
+    assert_array(field[98:], np.array([[98, 1], [99, 1]]))
+    field[-1] = [0, 0]
+    assert_array(field[-1], np.array([0, 0]))
+    # the first sequence is padded with the last element times padding_value
+    a = field.get_batch(batch_size=None, training_length=3)
+    assert a.shape == (102, 2)
+    assert_array(a[:3], np.array([[0, 0], [0, 0], [0, 1]]))
+    field.truncate(4)
+    assert_array(np.array(field), np.array([[96, 1], [97, 1], [98, 1], [0, 0]]))
+    field.reset_field()
+    assert len(field) == 0
+
+
+def test_buffer_shuffle():
+    b = construct_fake_buffer()
+    b.append_update_buffer(3, batch_size=None, training_length=3)
+    b.update_buffer.shuffle(sequence_length=3)
+    observations = np.array(b.update_buffer["vector_observation"])
+    actions = np.array(b.update_buffer["action"])
+    # sequences are moved as a whole and fields stay aligned
+    assert sorted(observations[::3, 0]) == [301, 331, 361]
+    assert_array(actions[:, 0], observations[:, 0] + 3)
+    assert_array(observations[1::3, 0], observations[::3, 0] + 10)
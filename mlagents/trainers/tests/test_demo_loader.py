@@ -1,6 +1,16 @@
 import os
+import shutil
+import unittest.mock as mock
 
-from mlagents.trainers.demo_loader import load_demonstration, make_demo_buffer
+import numpy as np
+
+from mlagents.trainers.buffer import Buffer
+from mlagents.trainers.demo_loader import (
+    demo_to_buffer,
+    load_demonstration,
+    load_demonstration_arrays,
+    make_demo_buffer,
+)
 
 
 def test_load_demo():
@@ -27,3 +37,85 @@ def test_load_demo_dir():
 
     demo_buffer = make_demo_buffer(brain_infos, brain_parameters, 1)
     assert len(demo_buffer.update_buffer["actions"]) == total_expected - 1
+
+
+def _append_update_buffer_demo(brain_infos, brain_params, sequence_length):
+    # Reference: the per-BrainInfo loop that filled demo buffers before the
+    # columnar path, one append_update_buffer per episode.
+    demo_buffer = Buffer()
+    for current_brain_info, next_brain_info in zip(brain_infos[:-1], brain_infos[1:]):
+        demo_buffer[0]["done"].append(next_brain_info.local_done[0])
+        demo_buffer[0]["rewards"].append(next_brain_info.rewards[0])
+        for i in range(brain_params.number_visual_observations):
+            demo_buffer[0]["visual_obs%d" % i].append(
+                current_brain_info.visual_observations[i][0]
+            )
+        if brain_params.vector_observation_space_size > 0:
+            demo_buffer[0]["vector_obs"].append(
+                current_brain_info.vector_observations[0]
+            )
+        demo_buffer[0]["actions"].append(next_brain_info.previous_vector_actions[0])
+        demo_buffer[0]["prev_action"].append(
+            current_brain_info.previous_vector_actions[0]
+        )
+        if next_brain_info.local_done[0]:
+            demo_buffer.append_update_buffer(
+                0, batch_size=None, training_length=sequence_length
+            )
+            demo_buffer.reset_local_buffers()
+    demo_buffer.append_update_buffer(
+        0, batch_size=None, training_length=sequence_length
+    )
+    return demo_buffer
+
+
+def test_demo_to_buffer_matches_append_update_buffer(tmpdir):
+    path_prefix = os.path.dirname(os.path.abspath(__file__))
+    demo_path = shutil.copy(path_prefix + "/testdcvis.demo", str(tmpdir))
+    brain_parameters, brain_infos, _ = load_demonstration(demo_path)
+    for sequence_length in [1, 16]:
+        expected = _append_update_buffer_demo(
+            brain_infos, brain_parameters, sequence_length
+        ).update_buffer
+        _, demo_buffer = demo_to_buffer(demo_path, sequence_length, use_cache=False)
+        from_brain_infos = make_demo_buffer(
+            brain_infos, brain_parameters, sequence_length
+        )
+        for update_buffer in [
+            demo_buffer.update_buffer,
+            from_brain_infos.update_buffer,
+        ]:
+            assert set(update_buffer.keys()) == set(expected.keys())
+            for key in expected:
+                np.testing.assert_array_equal(
+                    np.array(update_buffer[key]), np.array(expected[key])
+                )
+    # Every episode is front padded with zero rows to a multiple of sequence_length.
+    assert len(expected["actions"]) % 16 == 0
+    assert len(expected["actions"]) > len(brain_infos) - 1
+
+
+def test_demo_cache(tmpdir):
+    path_prefix = os.path.dirname(os.path.abspath(__file__))
+    demo_path = shutil.copy(path_prefix + "/test.demo", str(tmpdir))
+    brain_parameters, steps, total_expected = load_demonstration_arrays(demo_path)
+    assert os.path.isfile(demo_path + ".npz")
+    assert brain_parameters.brain_name == "Ball3DBrain"
+    assert steps["vector_observations"].shape == (total_expected, 8)
+
+    with mock.patch(
+        "mlagents.trainers.demo_loader._decode_demo_file"
+    ) as mock_decode_demo_file:
+        cached_parameters, cached_steps, _ = load_demonstration_arrays(demo_path)
+        mock_decode_demo_file.assert_not_called()
+    assert cached_parameters.brain_name == brain_parameters.brain_name
+    for key in steps:
+        np.testing.assert_array_equal(cached_steps[key], steps[key])
+
+    # A modified demonstration file invalidates its cache.
+    os.utime(demo_path, ns=(0, 0))
+    with mock.patch(
+        "mlagents.trainers.demo_loader._decode_demo_file", return_value={}
+    ) as mock_decode_demo_file:
+        load_demonstration_arrays(demo_path)
+        mock_decode_demo_file.assert_called_once_with(demo_path)
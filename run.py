@@ -20,8 +20,11 @@ Options:
     --load=<name>               指定载入model的训练名称 [default: None]
     --fill-in                   指定是否预填充经验池至batch_size [default: False]
     --noop-choose               指定no_op操作时随机选择动作，或者置0 [default: False]
+    --save-replay               保存模型时同时保存off-policy算法的经验池，--load时自动恢复 [default: False]
+    --async-ratio=<n>           off-policy算法在后台线程异步训练，指定每个环境步的梯度更新次数，为0时在回合结束后训练 [default: 0]
     --gym                       是否使用gym训练环境 [default: False]
     --gym-agents=<n>            指定并行训练的数量 [default: 1]
+    --gym-workers=<n>           指定运行gym环境的进程数量，为0时使用线程 [default: 0]
     --gym-env=<name>            指定gym环境的名字 [default: CartPole-v0]
     --render-episode=<n>        指定gym环境从何时开始渲染 [default: None]
 Example:
@@ -30,7 +33,10 @@ Example:
     python run.py -ui -a td3 -n inference_in_unity
     python run.py -gi -a dddqn -n inference_with_build -e my_executable_file.exe
     python run.py --gym -a ppo -n train_using_gym --gym-env MountainCar-v0 --render-episode 1000 --gym-agents 4
+    python run.py --gym -a sac -n train_using_processes --gym-env Pendulum-v0 --gym-agents 32 --gym-workers 8
+    python run.py --gym -a sac -n train_with_async_learner --gym-env Pendulum-v0 --gym-agents 8 --async-ratio 1
     python run.py -u -a ddpg -n pre_fill--fill-in --noop-choose
+    python run.py --gym -a sac -n resume_with_replay --gym-env Pendulum-v0 --save-replay --load last_train_name
 """
 import os
 os.environ["CUDA_VISIBLE_DEVICES"] = "0, 1"
@@ -90,7 +96,7 @@ def unity_run(default_args, share_args, options, max_step, max_episode, save_fre
 
     reset_config = default_args['reset_config']
     if options['--unity']:
-        env = UnityEnvironment()
+        env = UnityEnvironment(raw_visual=tf_version == 'tf2')
         env_name = 'unity'
     else:
         file_name = default_args['exe_file'] if options['--env'] == 'None' else options['--env']
@@ -98,7 +104,8 @@ def unity_run(default_args, share_args, options, max_step, max_episode, save_fre
             env = UnityEnvironment(
                 file_name=file_name,
                 base_port=int(options['--port']),
-                no_graphics=False if options['--inference'] else not options['--graphic']
+                no_graphics=False if options['--inference'] else not options['--graphic'],
+                raw_visual=tf_version == 'tf2'   # tf2 policies take uint8 frames and normalize them on device
             )
             env_dir = os.path.split(file_name)[0]
             env_name = os.path.join(*env_dir.replace('\\', '/').replace(r'//', r'/').split('/')[-2:])
@@ -160,6 +167,9 @@ def unity_run(default_args, share_args, options, max_step, max_episode, save_fre
             **model_params[i],
             **algorithm_config
         ) for i in range(brain_num)]
+        if tf_version == 'tf2':
+            from Algorithms.tf2algos.ma_learner import MultiAgentLearner
+            extra_params['learner'] = MultiAgentLearner(models)
     else:
         extra_params = {}
         models = [model(
@@ -169,6 +179,10 @@ def unity_run(default_args, share_args, options, max_step, max_episode, save_fre
             **algorithm_config
         ) for index, i in enumerate(brain_names)]
 
+    if tf_version == 'tf2':
+        [m.recorder.set_summary(share_args['summary_interval'], share_args['summary_reduce']) for m in models]
+        for m in models:
+            m.save_replay = options['--save-replay']
     [models[index].init_or_restore(os.path.join(_base_dir, name if options['--load'] == 'None' else options['--load'], i)) for index, i in enumerate(brain_names)]
     begin_episode = models[0].get_init_episode()
 
@@ -189,6 +203,8 @@ def unity_run(default_args, share_args, options, max_step, max_episode, save_fre
         steps = algorithm_config['batch_size']
     else:
         steps = default_args['no_op_steps']
+    if tf_version == 'tf2' and not ma and all(m.policy_mode == 'OFF' and not m.data.is_empty() for m in models):
+        steps = 0   # replay buffers were restored from snapshots
     no_op_params = {
         'env': env,
         'brain_names': brain_names,
@@ -197,6 +213,9 @@ def unity_run(default_args, share_args, options, max_step, max_episode, save_fre
         'steps': steps,
         'choose': options['--noop-choose']
     }
+    if float(options['--async-ratio']) > 0:
+        assert tf_version == 'tf2' and not ma, 'asynchronous training only supports single-agent tf2 algorithms'
+        params['update_ratio'] = float(options['--async-ratio'])
     params.update(extra_params)
     no_op_params.update(extra_params)
 
@@ -222,7 +241,7 @@ def unity_run(default_args, share_args, options, max_step, max_episode, save_fre
 def gym_run(default_args, share_args, options, max_step, max_episode, save_frequency, name):
     from gym_loop import Loop
     from gym.spaces import Box, Discrete, Tuple
-    from gym_wrapper import gym_envs
+    from gym_wrapper import gym_envs, gym_process_envs
 
     try:
         tf_version, (model, policy_mode, _) = get_model_info(options['--algorithm'])
@@ -234,7 +253,11 @@ def gym_run(default_args, share_args, options, max_step, max_episode, save_frequ
     render_episode = int(options['--render-episode']) if options['--render-episode'] != 'None' else default_args['render_episode']
 
     try:
-        env = gym_envs(options['--gym-env'], int(options['--gym-agents']))
+        gym_agents, gym_workers = int(options['--gym-agents']), int(options['--gym-workers'])
+        if gym_workers > 0:
+            env = gym_process_envs(options['--gym-env'], gym_agents, envs_per_worker=-(-gym_agents // gym_workers))
+        else:
+            env = gym_envs(options['--gym-env'], gym_agents)
         assert type(env.observation_space) in available_type and type(env.action_space) in available_type, 'action_space and observation_space must be one of available_type'
     except Exception as e:
         print(e)
@@ -250,7 +273,7 @@ def gym_run(default_args, share_args, options, max_step, max_episode, save_frequ
     else:
         s_dim = int(env.observation_space.n)
 
-    if len(env.observation_space.shape) == 3:
+    if len(env.observation_space.shape) in [3, 4]:    # [H, W, C], or [frame_stack, H, W, C] of frame-stacked envs
         visual_sources = 1
         visual_resolution = list(env.observation_space.shape)
     else:
@@ -281,6 +304,9 @@ def gym_run(default_args, share_args, options, max_step, max_episode, save_frequ
         out_graph=share_args['out_graph'],
         **algorithm_config
     )
+    if tf_version == 'tf2':
+        gym_model.recorder.set_summary(share_args['summary_interval'], share_args['summary_reduce'])
+        gym_model.save_replay = options['--save-replay']
     gym_model.init_or_restore(os.path.join(_base_dir, name if options['--load'] == 'None' else options['--load']))
     begin_episode = gym_model.get_init_episode()
     params = {
@@ -297,10 +323,15 @@ def gym_run(default_args, share_args, options, max_step, max_episode, save_frequ
         'render_episode': render_episode,
         'policy_mode': policy_mode
     }
+    if float(options['--async-ratio']) > 0:
+        assert tf_version == 'tf2', 'asynchronous training only supports tf2 algorithms'
+        params['update_ratio'] = float(options['--async-ratio'])
     if 'batch_size' in algorithm_config.keys() and options['--fill-in']:
         steps = algorithm_config['batch_size']
     else:
         steps = default_args['random_steps']
+    if tf_version == 'tf2' and gym_model.policy_mode == 'OFF' and not gym_model.data.is_empty():
+        steps = 0   # the replay buffer was restored from a snapshot
     if options['--inference']:
         Loop.inference(env, gym_model, action_type)
     else:
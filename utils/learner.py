@@ -0,0 +1,100 @@
+import time
+import threading
+from utils.replay_buffer import LockedReplayBuffer
+
+
+class AsyncLearner(threading.Thread):
+    '''
+    Train an off-policy model in a background thread while the environment keeps stepping.
+    The rollout reports every environment step by add_steps, and the learner performs update_ratio gradient updates
+    per reported step, calling model.learn with at most chunk_steps updates at a time.
+    Actions are computed from a copy of the networks, the learner copies the trained weights into it every
+    sync_interval updates while it holds model.weights_lock, the lock it also holds while updating the weights.
+    Steps reported while the replay buffer is too small to sample from are skipped instead of being made up later.
+    An exception in the learner thread is re-raised by the next add_steps or by stop.
+    '''
+
+    def __init__(self, model, update_ratio=1., chunk_steps=10, sync_interval=10):
+        assert update_ratio > 0, 'update_ratio must be larger than 0'
+        assert type(chunk_steps) == int and chunk_steps > 0, 'chunk_steps must be int and larger than 0'
+        assert type(sync_interval) == int and sync_interval > 0, 'sync_interval must be int and larger than 0'
+        super().__init__(daemon=True)
+        self.model = model
+        self.update_ratio = update_ratio
+        self.chunk_steps = chunk_steps
+        self.sync_interval = sync_interval
+        self.episode = 0
+        self.env_steps = 0
+        self.updates = 0    # updates that really ran
+        self.skipped = 0    # updates given up because the replay buffer was not large enough yet
+        self.error = None
+        self._synced = 0
+        self._raised = False
+        self._start_time = None
+        self._cond = threading.Condition()
+        self._stopped = False
+        if not isinstance(model.data, LockedReplayBuffer):
+            model.data = LockedReplayBuffer(model.data)     # store_data and learn now run in different threads
+        model.act_with_copies()
+
+    @property
+    def pending(self):
+        return int(self.env_steps * self.update_ratio) - self.updates - self.skipped
+
+    @property
+    def steps_per_second(self):
+        '''
+        environment steps reported per second since the first add_steps.
+        '''
+        elapsed = time.time() - self._start_time if self._start_time is not None else 0.
+        return self.env_steps / elapsed if elapsed > 0 else 0.
+
+    @property
+    def updates_per_second(self):
+        elapsed = time.time() - self._start_time if self._start_time is not None else 0.
+        return self.updates / elapsed if elapsed > 0 else 0.
+
+    def _raise_error(self):
+        if self.error is not None and not self._raised:
+            self._raised = True
+            raise RuntimeError('the asynchronous learner failed') from self.error
+
+    def add_steps(self, n=1, episode=None):
+        self._raise_error()
+        with self._cond:
+            if self._start_time is None:
+                self._start_time = time.time()
+            self.env_steps += n
+            if episode is not None:
+                self.episode = episode
+            self._cond.notify()
+
+    def run(self):
+        try:
+            # summary writers are set per thread, so the model's writer has to be entered again here.
+            with self.model.recorder.writer.as_default():
+                while True:
+                    with self._cond:
+                        self._cond.wait_for(lambda: self._stopped or self.pending > 0)
+                        if self._stopped:
+                            break
+                        steps = min(self.pending, self.chunk_steps)
+                        episode = self.episode
+                    with self.model.weights_lock:
+                        updates = self.model.learn(episode=episode, step=steps)
+                        if self.updates + updates - self._synced >= self.sync_interval:
+                            self.model.sync_actor()
+                            self._synced = self.updates + updates
+                    with self._cond:
+                        self.updates += updates
+                        self.skipped += steps - updates
+        except Exception as e:
+            self.error = e
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self.join()
+        self._raise_error()
+        self.model.sync_actor()     # evaluation after training acts with the final weights
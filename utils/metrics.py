@@ -0,0 +1,111 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+class MetricsWriter(object):
+    '''
+    Append-only columnar sink of training metrics, e.g. one row per episode.
+    Rows are buffered and written as one Arrow record batch every flush_rows rows into an IPC stream file.
+    Every session, and every change of the columns, starts a new segment file in metrics_dir, nothing is rewritten.
+    All columns are stored as float64, missing values as NaN.
+    '''
+
+    def __init__(self, metrics_dir, flush_rows=20):
+        assert type(flush_rows) == int and flush_rows > 0, 'flush_rows must be int and larger than 0'
+        self.metrics_dir = metrics_dir
+        self.flush_rows = flush_rows
+        self._rows = []
+        self._names = None
+        self._sink = None
+        self._writer = None
+
+    def add(self, **row):
+        self._rows.append(row)
+        if len(self._rows) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        names = list(self._names or [])
+        for row in self._rows:
+            names.extend(k for k in row if k not in names)
+        if names != self._names:
+            self._close_segment()
+            self._open_segment(names)
+        batch = pa.RecordBatch.from_arrays(
+            [pa.array(np.array([row.get(k, np.nan) for row in self._rows], dtype=np.float64)) for k in names],
+            names=names
+        )
+        self._writer.write_batch(batch)
+        self._sink.flush()
+        self._rows = []
+
+    def _open_segment(self, names):
+        index = len(segment_files(self.metrics_dir))
+        self._sink = pa.OSFile(os.path.join(self.metrics_dir, f'segment_{index:05d}.arrows'), 'wb')
+        self._writer = pa.ipc.new_stream(self._sink, pa.schema([(k, pa.float64()) for k in names]))
+        self._names = names
+
+    def _close_segment(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+            self._writer = self._sink = None
+
+    def close(self):
+        self.flush()
+        self._close_segment()
+
+
+def segment_files(metrics_dir):
+    if not os.path.isdir(metrics_dir):
+        return []
+    return sorted(os.path.join(metrics_dir, f) for f in os.listdir(metrics_dir) if f.endswith('.arrows'))
+
+
+def load_metrics(metrics_dir):
+    '''
+    read all segments written by MetricsWriter into one DataFrame, in the order they were written.
+    a segment cut off by a crash is read up to its last complete record batch.
+    '''
+    batches = []
+    for f in segment_files(metrics_dir):
+        with pa.memory_map(f) as source:
+            try:
+                reader = pa.ipc.open_stream(source)
+                for batch in reader:
+                    batches.append(batch.to_pandas())
+            except (pa.ArrowInvalid, OSError):
+                pass
+    if not batches:
+        return pd.DataFrame()
+    return pd.concat(batches, ignore_index=True, sort=False)
+
+
+def compare_runs(runs, column='total_reward', index='episode'):
+    '''
+    inputs:
+        runs: {run name: metrics directory}
+    return: DataFrame indexed by `index` with one column per run holding `column`.
+            if a run was continued from a checkpoint, the rows written last win.
+    '''
+    series = {}
+    for name, metrics_dir in runs.items():
+        df = load_metrics(metrics_dir)
+        if column not in df or index not in df:
+            continue
+        df = df.drop_duplicates(index, keep='last').set_index(index)
+        df.index = df.index.astype(np.int64)
+        series[name] = df[column]
+    return pd.DataFrame(series).sort_index()
+
+
+if __name__ == '__main__':
+    # python -m utils.metrics run_dir/metrics other_run_dir/metrics ...
+    df = compare_runs({d: d for d in sys.argv[1:]})
+    print(df.describe().T[['count', 'mean', 'max']])
+    print(df.tail())
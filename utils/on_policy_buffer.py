@@ -0,0 +1,103 @@
+import numpy as np
+
+
+class OnPolicyBuffer(object):
+    '''
+    Rollout storage for on-policy algorithms.
+    Every field is kept in its own typed array with layout [T, n_agents, ...], T is the number of environment steps.
+    Arrays are allocated on the first add and grow by doubling, so appending one step is O(1) amortized.
+    Fields are stored with dtype, except uint8 fields like raw image frames, which keep uint8.
+    '''
+
+    def __init__(self, init_steps=256, dtype=np.float32):
+        assert type(init_steps) == int and init_steps > 0, 'init_steps must be int and larger than 0'
+        self.init_steps = init_steps
+        self.dtype = dtype
+        self._data = {}
+        self._size = 0
+        self._capacity = 0
+
+    def _allocate(self, key, value):
+        dtype = np.uint8 if value.dtype == np.uint8 else self.dtype
+        self._data[key] = np.empty((max(self._capacity, self.init_steps),) + value.shape, dtype=dtype)
+
+    def _grow(self):
+        self._capacity = max(2 * self._capacity, self.init_steps)
+        for key, buf in self._data.items():
+            new_buf = np.empty((self._capacity,) + buf.shape[1:], dtype=buf.dtype)
+            new_buf[:self._size] = buf[:self._size]
+            self._data[key] = new_buf
+
+    def add(self, **kwargs):
+        '''
+        input: s=[n_agents, ...], a=[n_agents, ...], r=[n_agents,], ...
+        store the data of one environment step.
+        '''
+        if self._size == self._capacity:
+            self._grow()
+        for key, value in kwargs.items():
+            value = np.asarray(value)
+            if key not in self._data or (self._size == 0 and self._data[key].shape[1:] != value.shape):
+                self._allocate(key, value)   # the number of agents may change between episodes
+            self._data[key][self._size] = value
+        self._size += 1
+
+    def __getitem__(self, key):
+        '''
+        return a view with shape [T, n_agents, ...]
+        '''
+        return self._data[key][:self._size]
+
+    def __setitem__(self, key, value):
+        '''
+        add or overwrite a whole column, e.g. statistics computed after an episode. value: [T, n_agents, ...]
+        '''
+        value = np.asarray(value, dtype=self.dtype)
+        assert value.shape[0] == self._size, 'the first dimension of value must equal to the number of stored steps'
+        if key not in self._data or self._data[key].shape[1:] != value.shape[1:]:
+            self._allocate(key, value[0])
+        self._data[key][:self._size] = value
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def n_agents(self):
+        return next(iter(self._data.values())).shape[1] if self._data else 0
+
+    def flatten(self, key):
+        '''
+        merge the first two dimensions without copying: [T, n_agents, ...] -> [T * n_agents, ...]
+        fields without extra dimensions, like rewards, are returned as [T * n_agents, 1]
+        '''
+        x = self[key]
+        return x.reshape((x.shape[0] * x.shape[1],) + (x.shape[2:] or (1,)))
+
+    def sample_generator(self, batch_size, keys, shuffle=False):
+        '''
+        inputs:
+            batch_size: number of steps per minibatch, every minibatch holds batch_size * n_agents transitions
+            keys: which fields to return, in order
+            shuffle: whether to draw transitions in a random order
+        yield: [field0, field1, ...], every field has shape [batch_size * n_agents, ...]
+        without shuffle every item is a view of the underlying storage.
+        '''
+        data = [self.flatten(key) for key in keys]
+        count = data[0].shape[0]
+        mb_size = batch_size * self.n_agents
+        idxs = np.random.permutation(count) if shuffle else None
+        for start in range(0, count, mb_size):
+            if shuffle:
+                mb_idxs = idxs[start:start + mb_size]
+                yield [d[mb_idxs] for d in data]
+            else:
+                yield [d[start:start + mb_size] for d in data]
+
+    def clear(self):
+        '''
+        drop all stored steps but keep the allocated memory for the next episode.
+        '''
+        self._size = 0
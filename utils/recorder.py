@@ -1,17 +1,20 @@
 import sys
+import queue
 import logging
+import threading
+import numpy as np
 import tensorflow as tf
-import pandas as pd
+from utils.metrics import MetricsWriter
 
 
 class Recorder(object):
     '''
     TF 1.x Recorder
     '''
-    def __init__(self, log_dir, excel_dir, logger2file, graph=None):
+    def __init__(self, log_dir, metrics_dir, logger2file, graph=None):
         self.saver = tf.train.Saver(max_to_keep=5, pad_step_number=True)
         self.writer = tf.summary.FileWriter(log_dir, graph=graph)
-        self.excel_writer = pd.ExcelWriter(excel_dir + '/data.xlsx')
+        self.metrics = MetricsWriter(metrics_dir)
         self.logger = self.create_logger(
             name='logger',
             console_level=logging.INFO,
@@ -42,16 +45,39 @@ class Recorder(object):
                     tf.Summary.Value(tag=y['tag'], simple_value=y['value']) for y in ys
                 ]), x)
 
+    def close(self):
+        self.metrics.close()
+
+
 class RecorderTf2(object):
     '''
     TF 2.0 Recorder
+    scalars of the training hot path are collected in memory by add_scalars, every summary_interval calls they are
+    reduced by summary_reduce(mean/min/max/last) and handed to a background thread, which writes and flushes them.
+    the reduced values of the last summary point of add_scalars are kept, get_last_scalars returns a copy of them.
     '''
-    def __init__(self, cp_dir, log_dir, excel_dir, logger2file, model=None):
+    reducers = {
+        'mean': np.mean,
+        'min': np.min,
+        'max': np.max,
+        'last': lambda x: x[-1]
+    }
+
+    def __init__(self, cp_dir, log_dir, metrics_dir, logger2file, model=None, summary_interval=1, summary_reduce='mean'):
         self.writer = tf.summary.create_file_writer(log_dir)
         self.writer.set_as_default()
+        self.set_summary(summary_interval, summary_reduce)
+        self._scalars = {}
+        self._calls = 0
+        self._step = 0
+        self._last_scalars = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._summary_thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._summary_thread.start()
         self.checkpoint = tf.train.Checkpoint(policy=model)
         self.saver = tf.train.CheckpointManager(self.checkpoint, directory=cp_dir, max_to_keep=5, checkpoint_name='rb')
-        self.excel_writer = pd.ExcelWriter(excel_dir + '/data.xlsx')
+        self.metrics = MetricsWriter(metrics_dir)
         self.logger = self.create_logger(
             name='logger',
             console_level=logging.INFO,
@@ -74,3 +100,72 @@ class RecorderTf2(object):
             logfile_handle.setFormatter(logging.Formatter(file_format))
             logger.addHandler(logfile_handle)
         return logger
+
+    def set_summary(self, interval=1, reduce='mean'):
+        assert type(interval) == int and interval > 0, 'summary_interval must be int and larger than 0'
+        assert reduce in self.reducers, f'summary_reduce must be one of {list(self.reducers.keys())}'
+        self.summary_interval = interval
+        self.summary_reduce = reduce
+
+    def add_scalars(self, step, scalars):
+        '''
+        collect scalars of one training step, values may be python numbers, np.ndarray or eager tensors.
+        only the step of the last call before a write is recorded.
+        '''
+        for k, v in scalars.items():
+            self._scalars.setdefault(k, []).append(v)
+        self._step = step
+        self._calls += 1
+        if self._calls >= self.summary_interval:
+            self.flush_scalars()
+
+    def write_scalars(self, step, scalars):
+        '''
+        write scalars at step without reduction, e.g. the statistics of an episode.
+        '''
+        self._queue.put((int(step), {k: [v] for k, v in scalars.items()}, 'last', False))
+
+    def flush_scalars(self):
+        '''
+        hand the collected scalars to the writer thread.
+        '''
+        if self._scalars:
+            self._queue.put((int(self._step), self._scalars, self.summary_reduce, True))
+            self._scalars = {}
+        self._calls = 0
+
+    def _write_loop(self):
+        with self.writer.as_default():
+            while True:
+                item = self._queue.get()
+                while item is not None:
+                    step, scalars, reduce, keep = item
+                    values = {k: float(self.reducers[reduce](np.asarray(v, dtype=np.float32))) for k, v in scalars.items()}
+                    for k, v in values.items():
+                        tf.summary.scalar(k, v, step=step)
+                    if keep:
+                        with self._lock:
+                            self._last_scalars.update(values)
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                self.writer.flush()
+                if item is None:
+                    break
+
+    def get_last_scalars(self):
+        '''
+        return a copy of the reduced scalars of the last summary point written by the writer thread.
+        '''
+        with self._lock:
+            return dict(self._last_scalars)
+
+    def close(self):
+        '''
+        write the remaining scalars and stop the writer thread.
+        '''
+        self.flush_scalars()
+        self._queue.put(None)
+        self._summary_thread.join()
+        self.metrics.close()
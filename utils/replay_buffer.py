@@ -1,7 +1,13 @@
+import os
+import json
+import shutil
+import threading
 import numpy as np
 from .sum_tree import Sum_Tree
 from abc import ABC, abstractmethod
 
+_rng = np.random.default_rng()  # Generator.choice draws indexes without replacement without permuting the whole buffer
+
 # [s, visual_s, a, r, s_, visual_s_, done] must be this format.
 
 er_config = {
@@ -17,6 +23,10 @@ er_config = {
         'global_v': False
     },
 
+    'ver_config': {
+        'extra_frames_ratio': 0.125
+    },
+
     'ner_config': {
         'n': 4,
         'max_agents': 20
@@ -55,6 +65,54 @@ class ReplayBuffer(ABC):
     def update(self, *args) -> None:
         pass
 
+    def truncate(self, index=None) -> None:
+        '''
+        episodes of the specified agents(all agents if index is None) are cut off without done, e.g. by max_step.
+        '''
+        pass
+
+    @abstractmethod
+    def get_state(self) -> dict:
+        '''
+        return everything needed to rebuild the buffer, np.ndarray values are saved as .npy files, others as json.
+        '''
+        pass
+
+    @abstractmethod
+    def set_state(self, state) -> None:
+        pass
+
+    def save(self, path):
+        '''
+        write a snapshot into the directory path, which must not exist yet.
+        the snapshot is written into path.tmp first and renamed when complete, so path is either complete or missing.
+        '''
+        tmp = path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        meta = {'class': self.__class__.__name__}
+        for k, v in self.get_state().items():
+            if isinstance(v, np.ndarray):
+                np.save(os.path.join(tmp, k + '.npy'), v)
+            else:
+                meta[k] = v
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        os.rename(tmp, path)
+
+    def load(self, path):
+        '''
+        restore a snapshot written by save. arrays are memory-mapped copy-on-write, so they are read lazily
+        and new data never changes the files of the snapshot.
+        '''
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            state = json.load(f)
+        assert state.pop('class') == self.__class__.__name__, 'the snapshot was saved by another type of replay buffer'
+        for f in os.listdir(path):
+            if f.endswith('.npy'):
+                state[f[:-4]] = np.load(os.path.join(path, f), mmap_mode='c').view(np.ndarray)
+        self.set_state(state)
+
 
 class EpisodeExperienceReplay(ReplayBuffer):
     # TODO: implement padding so that makes each episode has the same length.
@@ -105,6 +163,29 @@ class EpisodeExperienceReplay(ReplayBuffer):
         t = np.random.choice(self._buffer[:self._size], size=n_sample, replace=False)
         return [i.get_all() for i in t]
 
+    def get_state(self):
+        '''
+        states of the episode buffers and of the unfinished episodes, keys are prefixed by episode{i}_ and tmp{i}_.
+        '''
+        state = {'size': self._size, 'data_pointer': self._data_pointer, 'capacity': self.capacity,
+                 'agents_num': self.agents_num, 'tmp_num': len(self._tmp_bf)}
+        for name, buffers in [('episode', self._buffer), ('tmp', self._tmp_bf)]:
+            for i, buf in enumerate(buffers):
+                state.update({f'{name}{i}_{k}': v for k, v in buf.get_state().items()})
+        return state
+
+    def set_state(self, state):
+        assert state['capacity'] == self.capacity, 'capacity of the snapshot is different from this buffer'
+        self._size = state['size']
+        self._data_pointer = state['data_pointer']
+        self.agents_num = state['agents_num']
+        self._tmp_bf = np.empty(state['tmp_num'], dtype=object)
+        for name, buffers in [('episode', self._buffer), ('tmp', self._tmp_bf)]:
+            for i in range(len(buffers)):
+                prefix = f'{name}{i}_'
+                buffers[i] = ExperienceReplay(self.sub_capacity, self.sub_capacity)
+                buffers[i].set_state({k[len(prefix):]: v for k, v in state.items() if k.startswith(prefix)})
+
     @property
     def is_full(self):
         return self._size == self.capacity
@@ -126,35 +207,68 @@ class EpisodeExperienceReplay(ReplayBuffer):
 
 
 class ExperienceReplay(ReplayBuffer):
+    '''
+    Columnar replay buffer. Every field of [s, visual_s, a, r, s_, visual_s_, done] is kept in its own
+    contiguous array of shape [capacity, *field_shape], allocated lazily on the first add.
+    Fields are stored as float32, except uint8 fields like raw image frames, which keep uint8.
+    '''
+
     def __init__(self, batch_size, capacity):
         super().__init__(batch_size, capacity)
         self._data_pointer = 0
-        self._buffer = np.empty(capacity, dtype=object)
+        self._buffer = None
+
+    def _allocate(self, data):
+        '''
+        allocate one array per field according to the shape of a single transition.
+        '''
+        self._buffer = [np.empty((self.capacity,) + np.shape(d), dtype=np.uint8 if np.asarray(d).dtype == np.uint8 else np.float32) for d in data]
 
     def add(self, *args):
         '''
-        change [s, s],[a, a],[r, r] to [s, a, r],[s, a, r] and store every item in it.
+        input: [ss, visual_ss, as, rs, s_s, visual_s_s, dones], the first dimension of every item is the number of agents.
         '''
         if hasattr(args[0], '__len__') or hasattr(args[1], '__len__'):
-            for i in range(len(args[0])):
-                self._store_op(list(arg[i] for arg in args))
+            self._store_batch([np.asarray(arg) for arg in args])
         else:
             self._store_op(args)
 
     def _store_op(self, data):
-        self._buffer[self._data_pointer] = data
+        if self._buffer is None:
+            self._allocate(data)
+        for buf, d in zip(self._buffer, data):
+            buf[self._data_pointer] = d
         self.update_rb_after_add()
 
+    def _store_batch(self, data):
+        '''
+        write a batch of transitions with at most two slice assignments per field.
+        '''
+        n = len(data[0])
+        if n == 0:
+            return
+        if self._buffer is None:
+            self._allocate([d[0] for d in data])
+        if n > self.capacity:
+            data = [d[-self.capacity:] for d in data]
+            n = self.capacity
+        first = min(n, self.capacity - self._data_pointer)
+        for buf, d in zip(self._buffer, data):
+            buf[self._data_pointer:self._data_pointer + first] = d[:first]
+            buf[:n - first] = d[first:]
+        self._data_pointer = (self._data_pointer + n) % self.capacity
+        self._size = min(self._size + n, self.capacity)
+
     def sample(self):
         '''
-        change [[s, a, r],[s, a, r]] to [[s, s],[a, a],[r, r]]
+        output: [ss, visual_ss, as, rs, s_s, visual_s_s, dones]
         '''
         n_sample = self.batch_size if self.is_lg_batch_size else self._size
-        t = np.random.choice(self._buffer[:self._size], size=n_sample, replace=False)
-        return [np.array(e) for e in zip(*t)]
+        idxs = _rng.choice(self._size, n_sample, replace=False)
+        return [buf[idxs] for buf in self._buffer]
 
     def get_all(self):
-        return [np.array(e) for e in zip(*self._buffer[:self._size])]
+        return [buf[:self._size] for buf in self._buffer]
 
     def update_rb_after_add(self):
         self._data_pointer += 1
@@ -163,6 +277,19 @@ class ExperienceReplay(ReplayBuffer):
         if self._size < self.capacity:
             self._size += 1
 
+    def get_state(self):
+        state = {'size': self._size, 'data_pointer': self._data_pointer, 'capacity': self.capacity}
+        if self._buffer is not None:
+            state.update({f'buffer_{i}': buf for i, buf in enumerate(self._buffer)})
+        return state
+
+    def set_state(self, state):
+        assert state['capacity'] == self.capacity, 'capacity of the snapshot is different from this buffer'
+        self._size = state['size']
+        self._data_pointer = state['data_pointer']
+        keys = sorted((k for k in state if k.startswith('buffer_')), key=lambda k: int(k[len('buffer_'):]))
+        self._buffer = [state[k] for k in keys] if keys else None
+
     @property
     def is_full(self):
         return self._size == self.capacity
@@ -179,12 +306,127 @@ class ExperienceReplay(ReplayBuffer):
     def show_rb(self):
         print('RB size: ', self._size)
         print('RB capacity: ', self.capacity)
-        print(self._buffer[:, np.newaxis])
+        if self._buffer is not None:
+            for buf in self._buffer:
+                print(buf[:self._size])
+
+
+class VisualExperienceReplay(ExperienceReplay):
+    '''
+    Visual-aware replay buffer. Consecutive transitions of an agent share frames(visual_s_ of step t is visual_s of step t+1),
+    so every frame is written only once into a circular frame array, transitions keep the global ids of their two frames.
+    The frame array holds capacity * (1 + extra_frames_ratio) frames: one next frame per transition plus some room for the
+    first frame of every episode, which takes about half the memory of storing visual_s and visual_s_ separately.
+    Transitions may carry extra items between visual_s and s_, e.g. old_log_prob of AC, visual_s_ and done are always last.
+    '''
+
+    def __init__(self, batch_size, capacity, extra_frames_ratio=0.125):
+        super().__init__(batch_size, capacity)
+        self.frame_capacity = capacity + max(int(capacity * extra_frames_ratio), 1)
+        self._frames = None
+        self._frame_total = 0   # number of frames that have been written
+        self._last_next_ids = None  # global ids of the latest next frame of every agent
+        self._continues = None  # [agents], whether the next visual_s of every agent is its latest visual_s_
+
+    @property
+    def _next_index(self):
+        return len(self._buffer) - 2    # position of visual_s_
+
+    def _allocate(self, data):
+        super()._allocate(data)
+        self._buffer[1] = np.empty(self.capacity, dtype=np.int64)
+        self._buffer[self._next_index] = np.empty(self.capacity, dtype=np.int64)
+
+    def _write_frames(self, frames):
+        ids = self._frame_total + np.arange(len(frames))
+        self._frames[ids % self.frame_capacity] = frames
+        self._frame_total += len(frames)
+        return ids
+
+    def add(self, *args):
+        '''
+        input: [ss, visual_ss, as, rs, s_s, visual_s_s, dones], the first dimension of every item is the number of agents.
+        visual_s of an agent is only written at the beginning of an episode, i.e. when its last transition ended with done
+        or its episode was cut off by truncate(), otherwise it is the visual_s_ of its last transition.
+        '''
+        args = [np.asarray(arg) for arg in args]
+        s, visual_s, visual_s_, done = args[0], args[1], args[-2], args[-1]
+        n = len(s)
+        assert 2 * n <= self.frame_capacity, 'frame capacity is too small for the number of agents'
+        if self._frames is None:
+            self._frames = np.empty((self.frame_capacity,) + visual_s.shape[1:], dtype=np.uint8 if visual_s.dtype == np.uint8 else np.float32)
+        if self._continues is not None and len(self._continues) == n:
+            alive = self._last_next_ids >= self._frame_total - self.frame_capacity
+            same = alive & self._continues
+            s_ids = self._last_next_ids.copy()
+        else:
+            same = np.zeros(n, dtype=bool)
+            s_ids = np.empty(n, dtype=np.int64)
+        new = np.where(~same)[0]
+        s_ids[new] = self._write_frames(visual_s[new])
+        self._last_next_ids = self._write_frames(visual_s_)
+        self._continues = done.reshape(n) == 0
+        self._store_batch([s, s_ids, *args[2:-2], self._last_next_ids, done])
+
+    def truncate(self, index=None):
+        if self._continues is not None:
+            self._continues[slice(None) if index is None else index] = False
+
+    def _to_frames(self, data):
+        data[1] = self._frames[data[1] % self.frame_capacity]
+        data[self._next_index] = self._frames[data[self._next_index] % self.frame_capacity]
+        return data
+
+    def sample(self):
+        '''
+        output: [ss, visual_ss, as, rs, s_s, visual_s_s, dones]
+        transitions whose first frame has been overwritten are never drawn.
+        '''
+        n_sample = self.batch_size if self.is_lg_batch_size else self._size
+        oldest = self._frame_total - self.frame_capacity
+        idxs = _rng.choice(self._size, n_sample, replace=False)
+        if (self._buffer[1][idxs] < oldest).any():
+            valid = np.flatnonzero(self._buffer[1][:self._size] >= oldest)
+            idxs = _rng.choice(valid, min(n_sample, len(valid)), replace=False)
+        return self._to_frames([buf[idxs] for buf in self._buffer])
+
+    def get_all(self):
+        valid = self._buffer[1][:self._size] >= self._frame_total - self.frame_capacity
+        return self._to_frames([buf[:self._size][valid] for buf in self._buffer])
+
+    def get_state(self):
+        state = super().get_state()
+        state.update(frame_capacity=self.frame_capacity, frame_total=self._frame_total)
+        if self._frames is not None:
+            state['frames'] = self._frames
+        if self._last_next_ids is not None:
+            state['last_next_ids'] = self._last_next_ids
+            state['continues'] = self._continues
+        return state
+
+    def set_state(self, state):
+        assert state['frame_capacity'] == self.frame_capacity, 'frame capacity of the snapshot is different from this buffer'
+        super().set_state(state)
+        self._frame_total = state['frame_total']
+        self._frames = state.get('frames')
+        self._last_next_ids = state.get('last_next_ids')
+        self._continues = state.get('continues')
+        if self._last_next_ids is not None:
+            self._last_next_ids = np.array(self._last_next_ids)
+        if self._continues is not None:
+            self._continues = np.array(self._continues, dtype=bool)
+
+    @property
+    def show_rb(self):
+        print('RB size: ', self._size)
+        print('RB capacity: ', self.capacity)
+        print('RB frames: ', min(self._frame_total, self.frame_capacity))
 
 
-class PrioritizedExperienceReplay(ReplayBuffer):
+class PrioritizedExperienceReplay(ExperienceReplay):
     '''
-    This PER will introduce some bias, 'cause when the experience with the minimum probability has been collected, the min_p that be updated may become inaccuracy.
+    Transitions are stored in the same columnar arrays as ExperienceReplay, priorities are kept in a Sum_Tree
+    whose leaves are aligned with the rows of those arrays.
     '''
 
     def __init__(self, batch_size, capacity, max_episode, alpha, beta, epsilon, global_v):
@@ -204,24 +446,20 @@ class PrioritizedExperienceReplay(ReplayBuffer):
         self.tree = Sum_Tree(capacity)
         self.epsilon = epsilon
         self.IS_w = 1   # weights of variables by using Importance Sampling
-        self.min_p = 1
         self.max_p = epsilon
         self.global_v = global_v
 
-    def add(self, *args):
-        '''
-        input: [ss, visual_ss, as, rs, s_s, visual_s_s, dones]
-        '''
-        if hasattr(args[0], '__len__') or hasattr(args[1], '__len__'):
-            for i in range(len(args[0])):
-                self._store_op(list(arg[i] for arg in args))
-        else:
-            self._store_op(args)
+    @property
+    def min_p(self):
+        return self.tree.min
 
     def _store_op(self, data):
-        self.tree.add(self.max_p, data)
-        if self._size < self.capacity:
-            self._size += 1
+        self.tree.add(self.max_p)
+        super()._store_op(data)
+
+    def _store_batch(self, data):
+        self.tree.add(self.max_p, min(len(data[0]), self.capacity))
+        super()._store_batch(data)
 
     def sample(self):
         '''
@@ -229,17 +467,11 @@ class PrioritizedExperienceReplay(ReplayBuffer):
         '''
         n_sample = self.batch_size if self.is_lg_batch_size else self._size
         interval = self.tree.total / n_sample
-        segment = [self.tree.total - i * interval for i in range(n_sample + 1)]
-        t = [self.tree.get(np.random.uniform(segment[i], segment[i + 1], 1)) for i in range(n_sample)]
-        t = [np.array(e) for e in zip(*t)]
-        d = [np.array(e) for e in zip(*t[-1])]
-        self.last_indexs = t[0]
-        self.IS_w = np.power(self.min_p / t[-2], self.beta) if self.global_v else np.power(t[-2].min() / t[-2], self.beta)
-        return d
-
-    @property
-    def is_lg_batch_size(self):
-        return self._size > self.batch_size
+        values = (np.arange(n_sample) + np.random.uniform(size=n_sample)) * interval
+        self.last_indexs, p = self.tree.get(values)
+        self.IS_w = np.power(self.min_p / p, self.beta) if self.global_v else np.power(p.min() / p, self.beta)
+        self.IS_w = self.IS_w[:, np.newaxis].astype(np.float32)
+        return [buf[self.last_indexs] for buf in self._buffer]
 
     def update(self, priority, episode):
         '''
@@ -248,15 +480,132 @@ class PrioritizedExperienceReplay(ReplayBuffer):
         assert hasattr(priority, '__len__'), 'priority must have attribute of len()'
         assert len(priority) == len(self.last_indexs), 'length between priority and last_indexs must equal'
         self.beta += self.beta_interval * episode
-        priority = np.power(np.abs(priority) + self.epsilon, self.alpha)
-        self.min_p = min(self.min_p, priority.min())
+        priority = np.power(np.abs(np.ravel(priority)) + self.epsilon, self.alpha)
         self.max_p = max(self.max_p, priority.max())
-        for i in range(len(priority)):
-            self.tree._updatetree(self.last_indexs[i], priority[i])
+        self.tree.update(self.last_indexs, priority)
 
     def get_IS_w(self):
         return self.IS_w
 
+    def get_state(self):
+        state = super().get_state()
+        state.update(tree_now=self.tree.now, max_p=float(self.max_p), beta=float(self.beta), tree=self.tree.tree, min_tree=self.tree.min_tree)
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.tree.now = state['tree_now']
+        self.max_p = state['max_p']
+        self.beta = state['beta']
+        self.tree.tree = np.array(state['tree'])    # small next to the transitions, and updated on every learn step
+        self.tree.min_tree = np.array(state['min_tree'])
+
+
+class NStepBuffer(object):
+    '''
+    Assemble n-step transitions for all agents at once.
+    s, visual_s and a of the latest n steps are kept in arrays of shape [n, agents, ...], used as a ring indexed by step,
+    together with the discounted sum of rewards since every step. A transition is emitted when it has collected n rewards,
+    when its episode ends with done, or when its episode is cut off by truncate().
+    '''
+
+    def __init__(self, n, gamma):
+        assert type(n) == int and n > 0, 'n must be int and larger than 0'
+        self.n = n
+        self.gamma = gamma
+        self._discounts = np.power(gamma, np.arange(n), dtype=np.float32)
+        self._ring = None
+        self._ret = None    # [n, agents], discounted sum of rewards since the step in every slot
+        self._count = None  # [agents], number of pending steps of every agent
+        self._last = None   # [s_, visual_s_, done] of the latest step
+        self._r_shape = None
+        self._t = 0
+
+    def _allocate(self, data):
+        n_agents = len(data[0])
+        self._ring = [np.empty((self.n,) + d.shape, dtype=d.dtype) for d in data]
+        self._ret = np.zeros((self.n, n_agents), dtype=np.float32)
+        self._count = np.zeros(n_agents, dtype=np.int64)
+
+    def _ages(self, latest_slot):
+        return (latest_slot - np.arange(self.n)) % self.n
+
+    def add(self, s, visual_s, a, r, s_, visual_s_, done):
+        '''
+        input: [ss, visual_ss, as, rs, s_s, visual_s_s, dones] of one environment step
+        return: completed n-step transitions with the same format, or None
+        when the number of agents changes, pending steps are emitted first as shorter-horizon transitions like truncate().
+        '''
+        s, visual_s, a, r, s_, visual_s_, done = [np.asarray(x) for x in (s, visual_s, a, r, s_, visual_s_, done)]
+        n_agents = len(s)
+        flushed = None
+        if self._ring is None or self._ring[0].shape[1:] != s.shape or self._ring[1].shape[1:] != visual_s.shape or self._ring[2].shape[1:] != a.shape:
+            flushed = self.truncate()
+            if flushed is not None:
+                assert all(x.shape[1:] == y.shape[1:] for x, y in zip(flushed, (s, visual_s, a, r, s_, visual_s_, done))), \
+                    'only the number of agents can change between two steps'
+            self._allocate([s, visual_s, a])
+        slot = self._t % self.n
+        self._t += 1
+        for buf, d in zip(self._ring, (s, visual_s, a)):
+            buf[slot] = d
+        self._r_shape = r.shape[1:]
+        self._last = [s_.copy(), visual_s_.copy(), done.copy()]
+        self._count += 1
+        ages = self._ages(slot)
+        pending = ages[:, np.newaxis] < self._count
+        self._ret[slot] = 0.
+        self._ret += pending * self._discounts[ages][:, np.newaxis] * r.reshape(n_agents)
+        ended = done.reshape(n_agents) > 0
+        full = ~ended & (self._count == self.n)
+        data = self._emit(pending & (ended | (full & (ages[:, np.newaxis] == self.n - 1))))
+        if flushed is None or data is None:
+            return data if flushed is None else flushed
+        return [np.concatenate([x, y]) for x, y in zip(flushed, data)]
+
+    def truncate(self, index=None):
+        '''
+        emit all pending transitions of the specified agents, bootstrapping from the latest s_.
+        '''
+        if self._last is None:
+            return None
+        agents = np.zeros(len(self._count), dtype=bool)
+        agents[slice(None) if index is None else index] = True
+        ages = self._ages((self._t - 1) % self.n)
+        return self._emit((ages[:, np.newaxis] < self._count) & agents)
+
+    def get_state(self, prefix='nstep_'):
+        '''
+        pending steps of the latest episodes, empty if nothing has been added yet.
+        '''
+        if self._ring is None or self._last is None:
+            return {}
+        state = {f'{prefix}t': self._t, f'{prefix}r_shape': list(self._r_shape)}
+        for k, v in zip(['s', 'visual_s', 'a', 'ret', 'count', 's_', 'visual_s_', 'done'], self._ring + [self._ret, self._count] + self._last):
+            state[prefix + k] = v
+        return state
+
+    def set_state(self, state, prefix='nstep_'):
+        if prefix + 't' not in state:
+            return
+        s, visual_s, a, self._ret, self._count, s_, visual_s_, done = [
+            np.array(state[prefix + k]) for k in ['s', 'visual_s', 'a', 'ret', 'count', 's_', 'visual_s_', 'done']]
+        assert len(self._discounts) == len(s), 'n of the snapshot is different from this buffer'
+        self._ring = [s, visual_s, a]
+        self._last = [s_, visual_s_, done]
+        self._r_shape = tuple(state[prefix + 'r_shape'])
+        self._t = state[prefix + 't']
+
+    def _emit(self, mask):
+        slots, agents = np.nonzero(mask)
+        if len(slots) == 0:
+            return None
+        self._count -= mask.sum(axis=0)
+        s_, visual_s_, done = self._last
+        s, visual_s, a = [buf[slots, agents] for buf in self._ring]
+        r = self._ret[slots, agents].reshape((-1,) + self._r_shape)
+        return [s, visual_s, a, r, s_[agents], visual_s_[agents], done[agents]]
+
 
 class NStepExperienceReplay(ExperienceReplay):
     '''
@@ -267,58 +616,27 @@ class NStepExperienceReplay(ExperienceReplay):
         super().__init__(batch_size, capacity)
         self.n = n
         self.gamma = gamma
-        self.exps_pointer = np.zeros(agents_num, dtype=np.int32)
-        self.exps = [[()] * n for i in range(agents_num)]
+        self.nstep = NStepBuffer(n, gamma)
 
     def add(self, *args):
         '''
-        change [s, s],[a, a],[r, r] to [s, a, r],[s, a, r] and store every item in it.
+        input: [ss, visual_ss, as, rs, s_s, visual_s_s, dones] of one environment step
         '''
-        if hasattr(args[0], '__len__') or hasattr(args[1], '__len__'):
-            for i in range(len(args[0])):
-                self._store_op(list(arg[i] for arg in args), i)
+        data = self.nstep.add(*args)
+        if data is not None:
+            super().add(*data)
 
-        else:
-            self._store_op(args)
+    def truncate(self, index=None):
+        data = self.nstep.truncate(index)
+        if data is not None:
+            super().add(*data)
 
-    def _store_op(self, data, i=0):
-        '''
-        这段代码真是烂透了啊啊啊啊！！！！
-        '''
-        # if self.exps_pointer[i] > 0 and self.exps[i][self.exps_pointer[i] - 1][3] != data[0]:
-        if self.exps_pointer[i] > 0 and ((data[0] != self.exps[i][self.exps_pointer[i] - 1][4]).any() or data[1] != self.exps[i][self.exps_pointer[i] - 1][5]):
-            # if self.exps_pointer[i] > 0 and all([(val == data[0][i]).all() for i, val in enumerate(self.exps[i][self.exps_pointer[i] - 1][3])]):  # 因为data[0]代表状态s，由列表[np.array, np.array]组成，所以比较这样一个列表十分麻烦
-            # 判断是因为done结束的episode，还是因为超过了max_step。如果是达到了max_step就执行下边的程序
-            # 通过判断经验是不是第一个，而且判断上一条经验的下一个状态与该条经验的状态是否相同，如果不同，说明episode断了，就将临时经验池中的先存入
-            for k in range(self.exps_pointer[i]):
-                self.exps[i][k][-3:] = self.exps[i][self.exps_pointer[i] - 1][-3:]
-                self._buffer[self._data_pointer] = self.exps[i][k]
-                self.update_rb_after_add()
-            self.exps[i] = [()] * self.n
-            self.exps_pointer[i] = 0
-        self.exps[i][self.exps_pointer[i]] = data  # 存入临时经验池
-        for j in range(self.exps_pointer[i]):
-            # 根据n_step和折扣因子gamma给之前经验的奖励进行加和
-            self.exps[i][j][3] += pow(self.gamma, self.exps_pointer[i] - j) * data[3]
-        if data[-1]:
-            # 判断该经验的done_flag是True还是False，如果是True，就执行下边的程序
-            # 把临时经验池中所有的经验都存入
-            for k in range(self.exps_pointer[i] + 1):
-                self.exps[i][k][-3:] = data[-3:]
-                self._buffer[self._data_pointer] = self.exps[i][k]
-                self.update_rb_after_add()
-            self.exps[i] = [()] * self.n
-            self.exps_pointer[i] = 0
-        elif self.exps_pointer[i] == self.n - 1:
-            # 如果没done，但是达到了临时经验池的长度，即n，则把最前边的经验存入， 并把之后的经验向前移动一位
-            self.exps[i][0][-3:] = data[-3:]
-            self._buffer[self._data_pointer] = self.exps[i][0]
-            self.update_rb_after_add()
-            del self.exps[i][0]
-            self.exps[i].append(())
-        else:
-            # 如果没done，临时经验池也没满，就把指针后移
-            self.exps_pointer[i] += 1
+    def get_state(self):
+        return {**super().get_state(), **self.nstep.get_state()}
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.nstep.set_state(state)
 
 
 class NStepPrioritizedExperienceReplay(PrioritizedExperienceReplay):
@@ -330,55 +648,62 @@ class NStepPrioritizedExperienceReplay(PrioritizedExperienceReplay):
         super().__init__(batch_size, capacity, max_episode, alpha, beta, epsilon, global_v)
         self.n = n
         self.gamma = gamma
-        self.exps_pointer = np.zeros(agents_num, dtype=np.int32)
-        self.exps = [[()] * n for i in range(agents_num)]
+        self.nstep = NStepBuffer(n, gamma)
 
     def add(self, *args):
         '''
-        input: [ss, visual_ss, as, rs, s_s, visual_s_s, dones]
+        input: [ss, visual_ss, as, rs, s_s, visual_s_s, dones] of one environment step
         '''
-        if hasattr(args[0], '__len__') or hasattr(args[1], '__len__'):
-            for i in range(len(args[0])):
-                self._store_op(list(arg[i] for arg in args), i)
-        else:
-            self._store_op(args)
+        data = self.nstep.add(*args)
+        if data is not None:
+            super().add(*data)
 
-    def _store_op(self, data, i=0):
-        '''
-        这段代码真是烂透了啊啊啊啊！！！！
-        '''
-        if self.exps_pointer[i] > 0 and ((data[0] != self.exps[i][self.exps_pointer[i] - 1][4]).any() or data[1] != self.exps[i][self.exps_pointer[i] - 1][5]):
-            # 判断是因为done结束的episode，还是因为超过了max_step。如果是达到了max_step就执行下边的程序
-            # 通过判断经验是不是第一个，而且判断上一条经验的下一个状态与该条经验的状态是否相同，如果不同，说明episode断了，就将临时经验池中的先存入
-            for k in range(self.exps_pointer[i]):
-                self.exps[i][k][-3:] = self.exps[i][self.exps_pointer[i] - 1][-3:]
-                self.tree.add(self.max_p, self.exps[i][k])
-                if self._size < self.capacity:
-                    self._size += 1
-            self.exps[i] = [()] * self.n
-            self.exps_pointer[i] = 0
-        self.exps[i][self.exps_pointer[i]] = data  # 存入临时经验池
-        for j in range(self.exps_pointer[i]):
-            # 根据n_step和折扣因子gamma给之前经验的奖励进行加和
-            self.exps[i][j][3] += pow(self.gamma, self.exps_pointer[i] - j) * data[3]
-        if data[-1]:
-            # 判断该经验的done_flag是True还是False，如果是True，就执行下边的程序
-            # 把临时经验池中所有的经验都存入
-            for k in range(self.exps_pointer[i] + 1):
-                self.exps[i][k][-3:] = data[-3:]
-                self.tree.add(self.max_p, self.exps[i][k])
-                if self._size < self.capacity:
-                    self._size += 1
-            self.exps[i] = [()] * self.n
-            self.exps_pointer[i] = 0
-        elif self.exps_pointer[i] == self.n - 1:
-            # 如果没done，但是达到了临时经验池的长度，即n，则把最前边的经验存入， 并把之后的经验向前移动一位
-            self.exps[i][0][-3:] = data[-3:]
-            self.tree.add(self.max_p, self.exps[i][0])
-            if self._size < self.capacity:
-                self._size += 1
-            del self.exps[i][0]
-            self.exps[i].append(())
-        else:
-            # 如果没done，临时经验池也没满，就把指针后移
-            self.exps_pointer[i] += 1
+    def truncate(self, index=None):
+        data = self.nstep.truncate(index)
+        if data is not None:
+            super().add(*data)
+
+    def get_state(self):
+        return {**super().get_state(), **self.nstep.get_state()}
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.nstep.set_state(state)
+
+
+class LockedReplayBuffer(object):
+    '''
+    Guard a replay buffer with a lock, so that an environment thread can add data while a learner thread samples and
+    updates priorities. Other attributes are read from the wrapped buffer directly.
+    '''
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.buffer, name)
+
+    def add(self, *args):
+        with self.lock:
+            self.buffer.add(*args)
+
+    def sample(self):
+        with self.lock:
+            return self.buffer.sample()
+
+    def update(self, *args):
+        with self.lock:
+            self.buffer.update(*args)
+
+    def truncate(self, index=None):
+        with self.lock:
+            self.buffer.truncate(index)
+
+    def save(self, path):
+        with self.lock:
+            self.buffer.save(path)
+
+    def load(self, path):
+        with self.lock:
+            self.buffer.load(path)
@@ -8,25 +8,58 @@ class sth(object):
     def discounted_sum(x, gamma, init_value, dones):
         assert isinstance(x, np.ndarray), 'type of sth.discounted_sum.x must be np.ndarray'
         assert isinstance(dones, np.ndarray), 'type of sth.discounted_sum.done must be np.ndarray'
-
-        y = []
-        for i in reversed(range(len(x))):
-            init_value = gamma * (1 - dones[i]) * init_value + x[i]
-            y.insert(0, init_value)
-        return y
+        return list(sth.discounted_returns(x, gamma, init_value, dones))
 
     @staticmethod
     def discounted_sum_minus(x, gamma, init_value, dones, z):
         assert isinstance(x, np.ndarray), 'type of sth.discounted_sum_minus.x must be np.ndarray'
         assert isinstance(dones, np.ndarray), 'type of sth.discounted_sum_minus.dones must be np.ndarray'
         assert isinstance(z, np.ndarray), 'type of sth.discounted_sum_minus.z must be np.ndarray'
+        return list(sth.td_residual(x, gamma, init_value, dones, z))
 
-        y = []
-        for i in reversed(range(len(x))):
-            y.insert(0, gamma * (1 - dones[i]) * init_value + x[i] - z[i])
-            init_value = z[i]
+    @staticmethod
+    def time_major(x):
+        '''
+        turn an object array of per-step arrays into a [T, n_agents, ...] array.
+        '''
+        x = np.asarray(x)
+        return np.stack(x) if x.dtype == object else x
+
+    @staticmethod
+    def discounted_returns(x, gamma, init_value, dones):
+        '''
+        input: x [T, n_agents], dones [T, n_agents], init_value [n_agents,] or scalar
+        output: y [T, n_agents], y[t] = x[t] + gamma * (1 - dones[t]) * y[t+1], y[T] = init_value
+        one reverse scan over T, every step is vectorized over agents.
+        '''
+        x, dones = sth.time_major(x), sth.time_major(dones)
+        y = np.empty(x.shape, dtype=np.result_type(x.dtype, np.float32))
+        discount = gamma * (1 - dones)
+        running = np.broadcast_to(init_value, x.shape[1:]).astype(y.dtype)
+        for t in reversed(range(x.shape[0])):
+            running = x[t] + discount[t] * running
+            y[t] = running
         return y
 
+    @staticmethod
+    def td_residual(x, gamma, init_value, dones, z):
+        '''
+        input: x(rewards) [T, n_agents], dones [T, n_agents], z(values) [T, n_agents], init_value(value of the last next state) [n_agents,] or scalar
+        output: x[t] + gamma * (1 - dones[t]) * z[t+1] - z[t], z[T] = init_value
+        '''
+        x, dones, z = sth.time_major(x), sth.time_major(dones), sth.time_major(z)
+        next_z = np.concatenate([z[1:], np.broadcast_to(init_value, z.shape[1:])[np.newaxis].astype(z.dtype)], axis=0)
+        return x + gamma * (1 - dones) * next_z - z
+
+    @staticmethod
+    def gae(x, gamma, lambda_, init_value, dones, z):
+        '''
+        Generalized Advantage Estimation, https://arxiv.org/abs/1506.02438
+        input: x(rewards) [T, n_agents], dones [T, n_agents], z(values) [T, n_agents], init_value(value of the last next state) [n_agents,] or scalar
+        output: advantages [T, n_agents]
+        '''
+        return sth.discounted_returns(sth.td_residual(x, gamma, init_value, dones, z), gamma * lambda_, 0, dones)
+
     @staticmethod
     def save_config(dicpath, config):
         if not os.path.exists(dicpath):
@@ -5,78 +5,79 @@ class Sum_Tree(object):
     def __init__(self, capacity):
         """
         capacity = 5，设置经验池大小
-        tree = [0,1,2,3,4,5,6,7,8,9,10,11,12] 8-12存放叶子结点p值，1-7存放父节点、根节点p值的和，0存放树节点的数量
-        data = [0,1,2,3,4,5] 1-5存放数据， 0存放capacity
+        tree = [0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15] 8-12存放叶子结点p值，1-7存放父节点、根节点p值的和，13-15为补齐的空叶子
         Tree structure and array storage:
         Tree index:
                     1         -> storing priority sum
-              /          \ 
+              /          \
              2            3
             / \          / \
           4     5       6   7
          / \   / \     / \  / \
-        8   9 10   11 12                   -> storing priority for transitions
+        8   9 10   11 12 13 14 15   -> storing priority for transitions, data index = tree index - 8
+        A companion min-tree with the same layout keeps the exact minimum priority.
         """
         assert capacity > 0, 'capacity must larger than zero'
+        self.capacity = capacity
         self.now = 0
-        self.parent_node_count = self.get_parent_node_count(capacity)
-        # print(self.parent_node_count)
-        self.tree = np.zeros(self.parent_node_count + capacity + 1)
-        self.tree[0] = len(self.tree) - 1
-        self.data = np.zeros(capacity + 1, dtype=object)
-        self.data[0] = capacity
+        self.leaf_start = self.get_leaf_start(capacity)
+        self.depth = int(np.log2(self.leaf_start))
+        self.tree = np.zeros(2 * self.leaf_start)
+        self.min_tree = np.full(2 * self.leaf_start, np.inf)
 
-    def add(self, p, data):
+    def add(self, p, n=1):
         """
-        p : property
-        data : [s, a, r, s_, done]
+        p : priority of new data
+        n : number of new data
+        return: data indexs that the new data should be written to
         """
-        tree_index = self.now + self.parent_node_count + 1
-        self.data[self.now + 1] = data
-        self._updatetree(tree_index, p)
-        self.now += 1
-        if self.now > self.data[0]:
-            self.now = 0
+        data_index = (self.now + np.arange(n)) % self.capacity
+        self.now = (self.now + n) % self.capacity
+        self.update(data_index, np.full(n, p))
+        return data_index
 
-    def _updatetree(self, tree_index, p):
-        diff = p - self.tree[tree_index]
-        self._propagate(tree_index, diff)
+    def update(self, data_index, p):
+        """
+        set priorities of a batch of leaves and recompute their ancestors level by level.
+        """
+        tree_index = np.asarray(data_index) + self.leaf_start
         self.tree[tree_index] = p
-
-    def _propagate(self, tree_index, diff):
-        parent = tree_index // 2
-        self.tree[parent] += diff
-        if parent != 1:
-            self._propagate(parent, diff)
+        self.min_tree[tree_index] = p
+        for _ in range(self.depth):
+            tree_index //= 2
+            left = 2 * tree_index
+            self.tree[tree_index] = self.tree[left] + self.tree[left + 1]
+            self.min_tree[tree_index] = np.minimum(self.min_tree[left], self.min_tree[left + 1])
 
     @property
     def total(self):
         return self.tree[1]
 
+    @property
+    def min(self):
+        return self.min_tree[1]
+
     def get(self, seg_p_total):
         """
-        seg_p_total : The value of priority to sample
+        seg_p_total : The values of priority to sample, shape [batch,]
+        return: data indexs and priorities of the leaves that be found
         """
-        tree_index = self._retrieve(1, seg_p_total)
-        data_index = tree_index - self.parent_node_count
-        return (tree_index, data_index, self.tree[tree_index], self.data[data_index])
-
-    def _retrieve(self, tree_index, seg_p_total):
-        left = 2 * tree_index
-        right = left + 1
-        # if index 0 is the root node
-        # left = 2 * tree_index + 1
-        # right = 2 * (tree_index + 1)
-        if left >= self.tree[0]:
-            return tree_index
-        return self._retrieve(left, seg_p_total) if seg_p_total <= self.tree[left] else self._retrieve(right, seg_p_total - self.tree[left])
+        values = np.array(seg_p_total, dtype=np.float64).reshape(-1)
+        tree_index = np.ones(values.shape[0], dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * tree_index
+            left_p = self.tree[left]
+            go_right = (values > left_p) & (self.tree[left + 1] > 0)
+            values -= left_p * go_right
+            tree_index = left + go_right
+        return tree_index - self.leaf_start, self.tree[tree_index]
 
     def pp(self):
-        print(self.tree, self.data)
+        print(self.tree, self.min_tree)
 
-    def get_parent_node_count(self, capacity):
-        i = 0
-        while True:
-            if pow(2, i) < capacity <= pow(2, i + 1):
-                return pow(2, i + 1) - 1
-            i += 1
+    @staticmethod
+    def get_leaf_start(capacity):
+        i = 1
+        while i < capacity:
+            i *= 2
+        return i